@@ -0,0 +1,370 @@
+'''
+Benchmarks of env throughput, reset cost, masking and encoding
+
+Run all benchmarks and print the results:
+    python -m gym_coup.bench
+
+Save the results, and flag regressions against them later:
+    python -m gym_coup.bench --output baseline.json
+    python -m gym_coup.bench --baseline baseline.json
+'''
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+import numpy as np
+from gym_coup.envs.coup_env import CoupEnv
+from gym_coup.envs.coup_vector_env import CoupVectorEnv
+from gym_coup.utils.encode_obs import encode_obs, encode_obs_batch, ENCODED_OBS_SIZE
+
+# Env config for rollouts, see README Headless mode
+HEADLESS = {'check_invariants': 'off', 'log': False}
+
+
+def _rate(fn, duration):
+    '''
+    Call fn until duration seconds pass. fn returns how many ops it did.
+
+    Return ops per second
+    '''
+    n = 0
+    start = time.perf_counter()
+    end = start + duration
+    while True:
+        n += fn()
+        now = time.perf_counter()
+        if now >= end:
+            return n / (now - start)
+
+
+def _random_play(env, rng, steps):
+    '''
+    Take steps random valid actions, resetting finished games
+
+    Return number of games finished
+    '''
+    games = 0
+    for _ in range(steps):
+        _, _, done, _ = env.step(rng.choice(env.game.get_valid_actions()))
+        if done:
+            env.reset()
+            games += 1
+    return games
+
+
+def _sample_envs(num, seed=0):
+    '''
+    Return num envs at random points of random play
+    '''
+    rng = random.Random(seed)
+    env = CoupEnv(**HEADLESS)
+    env.reset(seed=seed)
+    envs = []
+    for _ in range(num):
+        _random_play(env, rng, rng.randrange(1, 10))
+        e = CoupEnv(**HEADLESS)
+        e.restore_state(env.clone_state())
+        envs.append(e)
+    return envs
+
+
+def bench_env_step(duration, **env_kwargs):
+    env = CoupEnv(**env_kwargs)
+    env.reset(seed=0)
+    rng = random.Random(0)
+    def run():
+        _random_play(env, rng, 1000)
+        return 1000
+    return _rate(run, duration)
+
+
+def bench_env_transition(duration):
+    '''
+    Step, then get the next player's observation and mask, as a training loop does
+    '''
+    env = CoupEnv(**HEADLESS)
+    env.reset(seed=0)
+    rng = random.Random(0)
+    mask = env.get_action_mask()
+    def run():
+        nonlocal mask
+        for _ in range(1000):
+            _, _, done, _ = env.step(rng.choice(np.flatnonzero(mask)))
+            if done:
+                env.reset()
+            env.last()
+            mask = env.get_action_mask()
+        return 1000
+    return _rate(run, duration)
+
+
+def bench_env_transition_fused(duration):
+    env = CoupEnv(**HEADLESS)
+    env.reset(seed=0)
+    rng = random.Random(0)
+    mask = env.get_action_mask()
+    def run():
+        nonlocal mask
+        for _ in range(1000):
+            _, _, _, mask, done = env.step_fused(rng.choice(np.flatnonzero(mask)))
+            if done:
+                env.reset()
+                mask = env.get_action_mask()
+        return 1000
+    return _rate(run, duration)
+
+
+def bench_env_reset(duration):
+    env = CoupEnv(**HEADLESS)
+    env.reset(seed=0)
+    def run():
+        for _ in range(1000):
+            env.reset()
+        return 1000
+    return 1e6 / _rate(run, duration)
+
+
+def bench_kernel_step(duration):
+    '''
+    step_kernel and legal_mask_kernel on the flat state, compiled if numba is installed
+    '''
+    from gym_coup.envs.kernel import step_kernel, legal_mask_kernel, reset_kernel, kernel_rng
+    rng = random.Random(0)
+    rng_state = kernel_rng(0)
+    state = reset_kernel(rng_state)
+    def run():
+        nonlocal state
+        for _ in range(1000):
+            valid = np.flatnonzero(legal_mask_kernel(state))
+            state, _, done = step_kernel(state, valid[rng.randrange(len(valid))], rng_state)
+            if done:
+                state = reset_kernel(rng_state)
+        return 1000
+    return _rate(run, duration)
+
+
+def bench_games(duration):
+    env = CoupEnv(**HEADLESS)
+    env.reset(seed=0)
+    rng = random.Random(0)
+    return _rate(lambda: _random_play(env, rng, 1000), duration)
+
+
+def bench_get_valid_actions(duration):
+    envs = _sample_envs(1000)
+    def run():
+        for e in envs:
+            e.get_valid_actions()
+        return len(envs)
+    return 1e6 / _rate(run, duration)
+
+
+def bench_get_obs(duration):
+    envs = _sample_envs(1000)
+    def run():
+        for e in envs:
+            e.get_obs(p2_view=e.game.whose_action == 1)
+        return len(envs)
+    return 1e6 / _rate(run, duration)
+
+
+def bench_encode_obs(duration):
+    obs = [e.get_obs() for e in _sample_envs(1000)]
+    def run():
+        for o in obs:
+            encode_obs(o)
+        return len(obs)
+    return _rate(run, duration)
+
+
+def bench_encode_obs_batch(duration):
+    obs = np.array([e.get_obs() for e in _sample_envs(1024)], dtype='int8')
+    out = np.empty((len(obs), ENCODED_OBS_SIZE), dtype='int8')
+    return _rate(lambda: len(encode_obs_batch(obs, out=out)), duration)
+
+
+def bench_vector_step(duration, num_envs=1024):
+    venv = CoupVectorEnv(num_envs, seed=0)
+    _, masks = venv.reset()
+    rng = np.random.default_rng(0)
+    def run():
+        nonlocal masks
+        for _ in range(10):
+            _, _, _, masks, _ = venv.step((rng.random(masks.shape) * masks).argmax(axis=1))
+        return 10 * num_envs
+    return _rate(run, duration)
+
+
+def bench_single_agent_vector_step(duration, num_envs=1024):
+    '''
+    Agent steps against a random opponent, each including the opponent's actions after it
+    '''
+    from gym_coup.envs.single_agent import SingleAgentCoupVectorEnv
+    from gym_coup.rollout import random_policy
+    venv = SingleAgentCoupVectorEnv(random_policy, num_envs, seed=0)
+    _, masks = venv.reset()
+    rng = np.random.default_rng(0)
+    def run():
+        nonlocal masks
+        for _ in range(10):
+            _, _, _, masks, _ = venv.step((rng.random(masks.shape) * masks).argmax(axis=1))
+        return 10 * num_envs
+    return _rate(run, duration)
+
+
+def bench_async_vector_step(duration, num_envs=1024, num_workers=2):
+    from gym_coup.envs.async_vector_env import AsyncCoupVectorEnv
+    with AsyncCoupVectorEnv(num_envs, num_workers=num_workers, seed=0) as venv:
+        _, masks = venv.reset()
+        rng = np.random.default_rng(0)
+        def run():
+            nonlocal masks
+            for _ in range(10):
+                _, _, _, masks, _ = venv.step((rng.random(masks.shape) * masks).argmax(axis=1))
+            return 10 * num_envs
+        return _rate(run, duration)
+
+
+def bench_rollout(duration, num_workers=2):
+    from gym_coup.rollout import RolloutEngine
+    with RolloutEngine(num_workers=num_workers, envs_per_worker=64, seed=0) as engine:
+        batches = engine.batches()
+        # Let the workers start before timing
+        next(batches)
+        try:
+            return _rate(lambda: len(next(batches)['action']), duration)
+        finally:
+            # Release the last batch while the buffers still exist
+            batches.close()
+
+
+# name: (function, unit, higher is better, needs worker processes)
+BENCHMARKS = {
+    'env_step':             (lambda d: bench_env_step(d, **HEADLESS), 'steps/s', True, False),
+    'env_step_default':     (bench_env_step, 'steps/s', True, False),
+    'env_step_compact':     (lambda d: bench_env_step(d, compact_state=True, **HEADLESS), 'steps/s', True, False),
+    'env_step_count_deck':  (lambda d: bench_env_step(d, count_deck=True, **HEADLESS), 'steps/s', True, False),
+    'env_step_forced':      (lambda d: bench_env_step(d, auto_forced_moves=True, **HEADLESS), 'steps/s', True, False),
+    'env_transition':       (bench_env_transition, 'steps/s', True, False),
+    'env_transition_fused': (bench_env_transition_fused, 'steps/s', True, False),
+    'kernel_step':          (bench_kernel_step, 'steps/s', True, False),
+    'env_reset':            (bench_env_reset, 'us', False, False),
+    'games':                (bench_games, 'games/s', True, False),
+    'get_valid_actions':    (bench_get_valid_actions, 'us', False, False),
+    'get_obs':              (bench_get_obs, 'us', False, False),
+    'encode_obs':           (bench_encode_obs, 'obs/s', True, False),
+    'encode_obs_batch':     (bench_encode_obs_batch, 'obs/s', True, False),
+    'vector_step':          (bench_vector_step, 'steps/s', True, False),
+    'single_agent_step':    (bench_single_agent_vector_step, 'steps/s', True, False),
+    'async_vector_step':    (bench_async_vector_step, 'steps/s', True, True),
+    'rollout':              (bench_rollout, 'steps/s', True, True),
+}
+
+
+def run_benchmarks(names=None, duration=1.0, repeat=3, multiprocess=True):
+    '''
+    Run benchmarks, keeping the best of repeat runs of each
+
+    names:        Benchmarks to run, default all of BENCHMARKS
+    duration:     Seconds per run
+    repeat:       Runs per benchmark
+    multiprocess: Whether to run benchmarks that start worker processes
+
+    Return {name: {'value', 'unit', 'higher_is_better'}}
+    '''
+    if names is None:
+        names = [k for k, v in BENCHMARKS.items() if multiprocess or not v[3]]
+    results = {}
+    for name in names:
+        if name not in BENCHMARKS:
+            raise ValueError(f'Unknown benchmark {name}')
+        fn, unit, higher_is_better, _ = BENCHMARKS[name]
+        values = [fn(duration) for _ in range(repeat)]
+        results[name] = {
+            'value': max(values) if higher_is_better else min(values),
+            'unit': unit,
+            'higher_is_better': higher_is_better,
+        }
+    return results
+
+
+def compare(results, baseline, tolerance=0.1):
+    '''
+    Find benchmarks that got worse than the baseline by more than tolerance,
+    a fraction of the baseline value. Benchmarks missing from either are skipped,
+    and so are baseline values of 0, ex: from a failed run, which give no scale.
+
+    Return list of (name, baseline value, new value, relative change)
+    '''
+    regressions = []
+    for name, r in results.items():
+        if name not in baseline:
+            continue
+        old, new = baseline[name]['value'], r['value']
+        if not old:
+            continue
+        change = (new - old) / old
+        worse = -change if r['higher_is_better'] else change
+        if worse > tolerance:
+            regressions.append((name, old, new, change))
+    return regressions
+
+
+def _metadata():
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m gym_coup.bench', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('names', nargs='*', help=f'Benchmarks to run, default all: {", ".join(BENCHMARKS)}')
+    parser.add_argument('--duration', type=float, default=1.0, help='Seconds per run')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per benchmark, the best is kept')
+    parser.add_argument('--no-multiprocess', action='store_true', help='Skip benchmarks that start worker processes')
+    parser.add_argument('--output', help='Write the results as JSON to this file, - for stdout')
+    parser.add_argument('--baseline', help='JSON file of earlier results to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='Fraction a benchmark can get worse than the baseline before it is flagged')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.names or None, args.duration, args.repeat, not args.no_multiprocess)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+
+    # Keep stdout for the JSON if it was asked for
+    out = sys.stderr if args.output == '-' else sys.stdout
+    for name, r in results.items():
+        line = f'{name:<20} {r["value"]:>14,.2f} {r["unit"]}'
+        if baseline is not None and name in baseline:
+            line += f'  ({(r["value"] - baseline[name]["value"]) / baseline[name]["value"]:+.1%})'
+        print(line, file=out)
+
+    if args.output:
+        data = json.dumps({'meta': _metadata(), 'results': results}, indent=2)
+        if args.output == '-':
+            print(data)
+        else:
+            with open(args.output, 'w') as f:
+                f.write(data + '\n')
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        for name, old, new, change in regressions:
+            print(f'REGRESSION {name}: {old:,.2f} -> {new:,.2f} ({change:+.1%})', file=out)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
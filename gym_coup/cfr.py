@@ -0,0 +1,284 @@
+'''
+Outcome sampling Monte Carlo CFR (MCCFR)
+
+Each iteration plays one game per player, the update player. The update
+player's actions are sampled from its current strategy mixed with some
+uniform exploration, the opponent's from its current strategy, and chance
+from the game's own RNG. On the way back up the sampled game, the update
+player's regrets and the opponent's average strategy are updated with
+importance-weighted counterfactual values, see Lanctot et al. 2009,
+"Monte Carlo Sampling for Regret Minimization in Extensive Games".
+
+Information sets are keyed on info_hash() of the player to act. Like the
+env's observation, it only holds the current position and not how it was
+reached, so this is CFR over that abstraction of the game.
+Each information set is one row of dense NumPy arrays, with a column per
+action id, so the tables can be saved, loaded and merged as whole arrays.
+'''
+import multiprocessing as mp
+import random
+import numpy as np
+from gym_coup.envs.coup_env import *
+from gym_coup.utils.seeding import spawn_seeds
+
+
+class MCCFR:
+    '''
+    Outcome sampling MCCFR over the 2 player game
+
+    keys:         (size,) uint64 info set hashes, row i is the info set keys[i]
+    regrets:      (size, NUM_ACTIONS) cumulative counterfactual regrets
+    strategy_sum: (size, NUM_ACTIONS) cumulative weights of the average strategy
+    iterations:   Iterations run so far
+    '''
+    def __init__(self, epsilon=0.6, max_depth=200, capacity=1 << 16, game_cls=Game, seed=None):
+        '''
+        epsilon:   Fraction of uniform exploration in the update player's sampling
+        max_depth: Actions before an unfinished game counts as a draw
+        capacity:  Info sets to allocate up front. The tables grow as needed
+        game_cls:  Game class the games are played in, Game or CompactGame
+        seed:      Seed of the solver's RNG, and of the worker seeds in train()
+        '''
+        self.epsilon = epsilon
+        self.max_depth = max_depth
+        self.game_cls = game_cls
+        self.rng = random.Random(seed)
+        self.seed_seq = np.random.SeedSequence(seed)
+        self.iterations = 0
+        self.size = 0
+        self.index = {}
+        self._keys = np.zeros(capacity, dtype='uint64')
+        self._regrets = np.zeros((capacity, NUM_ACTIONS))
+        self._strategy_sum = np.zeros((capacity, NUM_ACTIONS))
+
+    @property
+    def keys(self):
+        return self._keys[:self.size]
+
+    @property
+    def regrets(self):
+        return self._regrets[:self.size]
+
+    @property
+    def strategy_sum(self):
+        return self._strategy_sum[:self.size]
+
+    def _row(self, key):
+        '''
+        Return the row of info set key, adding it if it's new
+        '''
+        row = self.index.get(key)
+        if row is None:
+            row = self.size
+            if row == len(self._keys):
+                self._grow(2 * row)
+            self._keys[row] = key
+            self.index[key] = row
+            self.size += 1
+        return row
+
+    def _grow(self, capacity):
+        n = self.size
+        keys = np.zeros(capacity, dtype='uint64')
+        regrets = np.zeros((capacity, NUM_ACTIONS))
+        strategy_sum = np.zeros((capacity, NUM_ACTIONS))
+        keys[:n] = self._keys[:n]
+        regrets[:n] = self._regrets[:n]
+        strategy_sum[:n] = self._strategy_sum[:n]
+        self._keys, self._regrets, self._strategy_sum = keys, regrets, strategy_sum
+
+    def _set_tables(self, keys, regrets, strategy_sum):
+        n = len(keys)
+        self.size = 0
+        self._grow(max(n, len(self._keys)))
+        self._keys[:n] = keys
+        self._regrets[:n] = regrets
+        self._strategy_sum[:n] = strategy_sum
+        self.size = n
+        self.index = {int(k): i for i, k in enumerate(keys)}
+
+    def save(self, path):
+        '''
+        Save the tables and iteration count to an .npz file
+        '''
+        np.savez(path, keys=self.keys, regrets=self.regrets, strategy_sum=self.strategy_sum,
+                 iterations=self.iterations)
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        '''
+        Return a solver with the tables of a file from save()
+
+        kwargs: Solver options, see __init__
+        '''
+        solver = cls(**kwargs)
+        with np.load(path) as f:
+            solver._set_tables(f['keys'], f['regrets'], f['strategy_sum'])
+            solver.iterations = int(f['iterations'])
+        return solver
+
+    def _strategy(self, row, valid):
+        '''
+        Current strategy over the valid actions, by regret matching
+        '''
+        r = self._regrets[row].tolist()
+        pos = [r[a] if r[a] > 0.0 else 0.0 for a in valid]
+        total = sum(pos)
+        if total > 0.0:
+            return [x / total for x in pos]
+        return [1.0 / len(valid)] * len(valid)
+
+    def _episode(self, p):
+        '''
+        Play one sampled game and update the tables for update player p
+        '''
+        game = self.game_cls(rng=self.rng)
+        handlers = game._action_handlers
+        rand = self.rng.random
+        eps = self.epsilon
+        # Reach probability of the opponent of p, and of the sampling
+        opp_reach = 1.0
+        sample_reach = 1.0
+        path = []
+        for _ in range(self.max_depth):
+            if game.game_over:
+                break
+            valid = game.get_valid_actions()
+            n = len(valid)
+            if n == 1:
+                handlers[valid[0]](game)
+                continue
+            q = game.whose_action
+            row = self._row(game.info_hash(q))
+            policy = self._strategy(row, valid)
+            sample = [eps / n + (1.0 - eps) * x for x in policy] if q == p else policy
+
+            x = rand()
+            i = n - 1
+            for j in range(n - 1):
+                x -= sample[j]
+                if x < 0.0:
+                    i = j
+                    break
+            path.append((row, valid, policy, i, sample[i], q == p, opp_reach, sample_reach))
+            if q != p:
+                opp_reach *= policy[i]
+            sample_reach *= sample[i]
+            handlers[valid[i]](game)
+        # Also scores a game ended by the last allowed action
+        utility = 0.0
+        if game.game_over:
+            utility = -1.0 if game.get_num_face_up()[p] >= 2 else 1.0
+
+        # Sampled value of each position for p, weighted by
+        # the strategy over the sampling from there on
+        regrets = memoryview(self._regrets)
+        strategy_sum = memoryview(self._strategy_sum)
+        value = utility
+        for row, valid, policy, i, s, is_update, opp_reach, sample_reach in reversed(path):
+            child = value / s
+            value = policy[i] * child
+            w = opp_reach / sample_reach
+            if is_update:
+                d = value * w
+                for a in valid:
+                    regrets[row, a] -= d
+                regrets[row, valid[i]] += child * w
+            else:
+                for a, x in zip(valid, policy):
+                    strategy_sum[row, a] += x * w
+
+    def iteration(self):
+        '''
+        Run one iteration: one sampled game for each player
+        '''
+        self._episode(0)
+        self._episode(1)
+        self.iterations += 1
+
+    def train(self, iterations, num_workers=1, merge_interval=1000, checkpoint=None):
+        '''
+        Run iterations, in this process or across a process pool
+
+        iterations:     Iterations to run, in total over all workers
+        num_workers:    Worker processes. Each merge round, every worker
+                        runs up to merge_interval iterations from a copy of
+                        the tables, then the changes of all workers are added up
+        merge_interval: Iterations of each worker between merges,
+                        or between checkpoints with a single process
+        checkpoint:     Path to save() the tables to after every merge
+        '''
+        if num_workers <= 1:
+            while iterations > 0:
+                n = min(merge_interval, iterations)
+                for _ in range(n):
+                    self.iteration()
+                iterations -= n
+                if checkpoint is not None:
+                    self.save(checkpoint)
+            return
+
+        config = dict(epsilon=self.epsilon, max_depth=self.max_depth, game_cls=self.game_cls)
+        ctx = mp.get_context()
+        with ctx.Pool(num_workers) as pool:
+            while iterations > 0:
+                n = min(merge_interval * num_workers, iterations)
+                counts = [n // num_workers + (i < n % num_workers) for i in range(num_workers)]
+                tables = (self.keys.copy(), self.regrets.copy(), self.strategy_sum.copy())
+                jobs = [(config, tables, k, s) for k, s in zip(counts, spawn_seeds(self.seed_seq, num_workers)) if k]
+                for result in pool.map(_train_worker, jobs):
+                    self._merge(*result)
+                self.iterations += n
+                iterations -= n
+                if checkpoint is not None:
+                    self.save(checkpoint)
+
+    def _merge(self, keys, d_regrets, d_strategy_sum):
+        '''
+        Add the changes of a worker to the rows of keys
+        '''
+        rows = np.array([self._row(int(k)) for k in keys], dtype='int64')
+        self._regrets[rows] += d_regrets
+        self._strategy_sum[rows] += d_strategy_sum
+
+    def average_strategy(self, game):
+        '''
+        Return {action: probability} of the average strategy of the player to act,
+        uniform in info sets that haven't been reached
+        '''
+        valid = game.get_valid_actions()
+        row = self.index.get(game.info_hash(game.whose_action))
+        weights = self._strategy_sum[row, valid] if row is not None else np.zeros(len(valid))
+        total = weights.sum()
+        if total > 0:
+            return dict(zip(valid, (weights / total).tolist()))
+        return {a: 1.0 / len(valid) for a in valid}
+
+    def act(self, game, rng=None):
+        '''
+        Return an action of the player to act, sampled from the average strategy
+
+        rng: random.Random. Defaults to the solver's RNG
+        '''
+        strategy = self.average_strategy(game)
+        rng = self.rng if rng is None else rng
+        return rng.choices(list(strategy), weights=list(strategy.values()))[0]
+
+
+def _train_worker(job):
+    '''
+    Run iterations in a pool worker from a copy of the tables.
+    Return the keys of the rows that changed, and their changes
+    '''
+    config, (keys, regrets, strategy_sum), iterations, seed = job
+    solver = MCCFR(seed=seed, **config)
+    solver._set_tables(keys, regrets, strategy_sum)
+    for _ in range(iterations):
+        solver.iteration()
+    n = len(keys)
+    d_regrets = solver.regrets.copy()
+    d_strategy_sum = solver.strategy_sum.copy()
+    d_regrets[:n] -= regrets
+    d_strategy_sum[:n] -= strategy_sum
+    changed = np.flatnonzero(d_regrets.any(axis=1) | d_strategy_sum.any(axis=1))
+    return solver.keys[changed], d_regrets[changed], d_strategy_sum[changed]
@@ -1 +1,10 @@
-from gym_coup.envs.coup_env import CoupEnv
\ No newline at end of file
+from gym_coup.envs.coup_env import CoupEnv
+from gym_coup.envs.compact_game import CompactGame
+from gym_coup.envs.count_deck_game import CountDeckGame
+from gym_coup.envs.coup_vector_env import CoupVectorEnv
+from gym_coup.envs.async_vector_env import AsyncCoupVectorEnv
+from gym_coup.envs.profiling import Profiler
+from gym_coup.envs.replay import Replay
+from gym_coup.envs.determinization import sample_determinizations
+from gym_coup.envs.kernel import step_kernel, legal_mask_kernel, reset_kernel, kernel_rng
+from gym_coup.envs.single_agent import SingleAgentCoupEnv, SingleAgentCoupVectorEnv
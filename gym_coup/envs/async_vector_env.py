@@ -0,0 +1,246 @@
+import traceback
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+from gym_coup.envs.coup_env import NUM_ACTIONS
+from gym_coup.envs.coup_vector_env import CoupVectorEnv
+from gym_coup.utils.seeding import spawn_seeds
+
+OBS_SIZE = 21
+
+# Commands from the parent to a worker
+_STEP  = 1
+_RESET = 2
+_CLOSE = 3
+
+# Bytes kept of a worker's error message
+_ERROR_SIZE = 256
+
+
+def _shared_fields(n, num_workers):
+    '''
+    Shared arrays of an AsyncCoupVectorEnv: (shape, dtype)
+    '''
+    return {
+        'actions':   ((n,), 'int64'),
+        'obs':       ((n, OBS_SIZE), 'int8'),
+        'rewards':   ((n,), 'int8'),
+        'dones':     ((n,), 'bool'),
+        'masks':     ((n, NUM_ACTIONS), 'bool'),
+        'acting':    ((n,), 'int8'),
+        'final_obs': ((n, OBS_SIZE), 'int8'),
+        # Per worker: command, has seed, failed
+        'commands':  ((num_workers, 3), 'int64'),
+        # Per worker: reset seed as 4 uint32 words
+        'seeds':     ((num_workers, 4), 'uint32'),
+        # Per worker: UTF-8 error message of a failed command, zero padded
+        'errors':    ((num_workers, _ERROR_SIZE), 'uint8'),
+    }
+
+
+def _field_nbytes(shape, dtype):
+    # Keep every field 8-byte aligned
+    nbytes = int(np.prod(shape, dtype=int)) * np.dtype(dtype).itemsize
+    return -(-nbytes // 8) * 8
+
+
+def _map_fields(buf, fields):
+    arrays = {}
+    offset = 0
+    for k, (shape, dtype) in fields.items():
+        arrays[k] = np.ndarray(shape, dtype=dtype, buffer=buf, offset=offset)
+        offset += _field_nbytes(shape, dtype)
+    return arrays
+
+
+def _worker(worker_id, lo, hi, shm, fields, venv_kwargs, seed, work, done):
+    arrays = _map_fields(shm.buf, fields)
+    cmd = arrays['commands'][worker_id]
+    s = slice(lo, hi)
+    venv = CoupVectorEnv(hi - lo, seed=seed, **venv_kwargs)
+
+    while True:
+        work.acquire()
+        try:
+            if cmd[0] == _CLOSE:
+                break
+            elif cmd[0] == _RESET:
+                seed = None
+                if cmd[1]:
+                    seed = int.from_bytes(arrays['seeds'][worker_id].tobytes(), 'little')
+                obs, masks = venv.reset(seed=seed)
+                arrays['rewards'][s] = 0
+                arrays['dones'][s] = False
+                arrays['acting'][s] = 0
+            elif cmd[0] == _STEP:
+                obs, rewards, dones, masks, info = venv.step(arrays['actions'][s])
+                arrays['rewards'][s] = rewards
+                arrays['dones'][s] = dones
+                arrays['acting'][s] = info['acting_player']
+                # Zero where not done, also clearing rows of earlier steps
+                arrays['final_obs'][s] = info['final_obs'] if dones.any() else 0
+            arrays['obs'][s] = obs
+            arrays['masks'][s] = masks
+        except Exception as e:
+            traceback.print_exc()
+            msg = f'{type(e).__name__}: {e}'.encode()[:_ERROR_SIZE]
+            error = arrays['errors'][worker_id]
+            error[:] = 0
+            error[:len(msg)] = np.frombuffer(msg, dtype='uint8')
+            cmd[2] = 1
+        finally:
+            done.release()
+
+    del arrays, cmd
+    shm.close()
+
+
+class AsyncCoupVectorEnv:
+    '''
+    CoupVectorEnv split across worker processes
+
+    Each worker steps a slice of the games with its own CoupVectorEnv.
+    Actions, observations, masks and results are exchanged through one
+    shared memory block, and workers are signalled with semaphores,
+    so nothing is pickled or sent through pipes.
+
+    step_async() returns as soon as the workers are signalled. The caller
+    can do other work, ex: policy inference for another env, before
+    collecting the results with step_wait().
+    '''
+    def __init__(self, num_envs, num_workers=2, p_first_turn=0, is_partial_obs=True, seed=None):
+        '''
+        num_envs:       Number of games stepped together
+        num_workers:    Number of worker processes, each gets a slice of the games
+        p_first_turn:   Which player goes first, 0-indexed
+        is_partial_obs: Whether the game is partially observable
+        seed:           Seed for all workers, see gym_coup.utils.spawn_seeds
+        '''
+        if num_workers > num_envs:
+            raise ValueError('Need at least one env per worker')
+        self.num_envs = num_envs
+        self.num_workers = num_workers
+        bounds = np.linspace(0, num_envs, num_workers + 1).astype(int)
+        self.slices = [(int(bounds[i]), int(bounds[i + 1])) for i in range(num_workers)]
+
+        fields = _shared_fields(num_envs, num_workers)
+        size = sum(_field_nbytes(shape, dtype) for shape, dtype in fields.values())
+        self._shm = shared_memory.SharedMemory(create=True, size=size)
+        self._arrays = _map_fields(self._shm.buf, fields)
+        self._arrays['commands'][:] = 0
+
+        ctx = mp.get_context()
+        self._work = [ctx.Semaphore(0) for _ in range(num_workers)]
+        self._done = [ctx.Semaphore(0) for _ in range(num_workers)]
+        venv_kwargs = {'p_first_turn': p_first_turn, 'is_partial_obs': is_partial_obs}
+        self.processes = []
+        for i, (lo, hi), s in zip(range(num_workers), self.slices, spawn_seeds(seed, num_workers)):
+            p = ctx.Process(target=_worker,
+                            args=(i, lo, hi, self._shm, fields, venv_kwargs, s, self._work[i], self._done[i]),
+                            daemon=True)
+            p.start()
+            self.processes.append(p)
+        self._waiting = False
+        self.closed = False
+
+    def _check_idle(self):
+        if self.closed:
+            raise RuntimeError('Env is closed')
+        if self._waiting:
+            raise RuntimeError('Call step_wait() before sending another command')
+
+    def _send(self, command):
+        self._check_idle()
+        c = self._arrays['commands']
+        c[:, 0] = command
+        c[:, 2] = 0
+        for w in self._work:
+            w.release()
+        self._waiting = True
+
+    def _wait(self):
+        if not self._waiting:
+            raise RuntimeError('Call step_async() before step_wait()')
+        for d in self._done:
+            d.acquire()
+        self._waiting = False
+        for i in np.flatnonzero(self._arrays['commands'][:, 2]):
+            msg = self._arrays['errors'][i].tobytes().rstrip(b'\0').decode(errors='replace')
+            raise RuntimeError(f'Env worker {i} failed: {msg}')
+
+    def reset(self, seed=None):
+        '''
+        Start a new game in every env
+
+        seed: Reseed every worker, see gym_coup.utils.spawn_seeds
+
+        Return (obs, masks), views valid until the next step_async() or reset()
+        '''
+        c = self._arrays['commands']
+        c[:, 1] = seed is not None
+        if seed is not None:
+            for i, s in enumerate(spawn_seeds(seed, self.num_workers)):
+                self._arrays['seeds'][i] = np.frombuffer(s.to_bytes(16, 'little'), dtype='uint32')
+        self._send(_RESET)
+        self._wait()
+        return self._arrays['obs'], self._arrays['masks']
+
+    def step_async(self, actions):
+        '''
+        Start stepping every game with actions, an array of N legal action ids.
+        They are checked before any worker is signalled, so an invalid action
+        raises a RuntimeError and leaves every game as it was
+        '''
+        self._check_idle()
+        actions = np.asarray(actions)
+        if actions.shape != (self.num_envs,):
+            raise RuntimeError(f'Expected {self.num_envs} actions, got shape {actions.shape}')
+        # Negative ids would wrap around when indexing the masks
+        in_range = ((actions >= 0) & (actions < NUM_ACTIONS)).all()
+        if not in_range or not self._arrays['masks'][np.arange(self.num_envs), actions].all():
+            raise RuntimeError('Cannot step with an invalid action')
+        self._arrays['actions'][:] = actions
+        self._send(_STEP)
+
+    def step_wait(self):
+        '''
+        Wait for the workers to finish the step
+
+        Return (obs, rewards, dones, masks, info), same as CoupVectorEnv.step.
+        The arrays view shared memory, valid until the next step_async() or reset().
+        '''
+        self._wait()
+        a = self._arrays
+        info = {'acting_player': a['acting']}
+        if a['dones'].any():
+            info['final_obs'] = a['final_obs']
+        return a['obs'], a['rewards'], a['dones'], a['masks'], info
+
+    def step(self, actions):
+        self.step_async(actions)
+        return self.step_wait()
+
+    def close(self):
+        if self.closed:
+            return
+        if self._waiting:
+            self._wait()
+        self._send(_CLOSE)
+        for p in self.processes:
+            p.join(timeout=5)
+            if p.is_alive():
+                p.terminate()
+        self._arrays = None
+        self._shm.close()
+        self._shm.unlink()
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __del__(self):
+        if not getattr(self, 'closed', True):
+            self.close()
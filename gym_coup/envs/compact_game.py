@@ -0,0 +1,723 @@
+from array import array
+import random
+from gym_coup.envs.coup_env import *
+from gym_coup.envs.coup_env import _dispatch_table
+
+NUM_DECK_CARDS = 3 * len(Card.names)
+
+_INITIAL_STATE = array('b', [NONE] * 8 +               # Cards
+                            [NONE] * 8 +               # Face up
+                            [2, 2] +                   # Coins
+                            [NONE, NONE] +             # Last action
+                            [0, 0, 0, 0, 1, 0] +       # Lost challenge, turn flags
+                            [NUM_DECK_CARDS] +         # Deck size
+                            [i for _ in range(3) for i in range(len(Card.names))])
+
+
+class CompactPlayer:
+    '''
+    View of one player inside a CompactGame's state array
+    Supports the same API as Player
+    '''
+    __slots__ = ('game', 'id')
+
+    def __init__(self, game, id):
+        self.game = game
+        self.id = id
+
+    @property
+    def is_human(self):
+        return self.id < self.game.num_human_players
+
+    @property
+    def cards(self):
+        '''
+        Copies of the cards in hand. Changing them does not change the game.
+        '''
+        s = self.game.state
+        c = CARDS + 4 * self.id
+        f = FACE_UP + 4 * self.id
+        return [Card(s[c + i], bool(s[f + i])) for i in range(4) if s[c + i] != NONE]
+
+    @property
+    def coins(self):
+        return self.game.state[COINS + self.id]
+
+    @coins.setter
+    def coins(self, val):
+        self.game.state[COINS + self.id] = val
+
+    @property
+    def last_action(self):
+        return self.game.state[LAST_ACTION + self.id]
+
+    @last_action.setter
+    def last_action(self, val):
+        self.game.state[LAST_ACTION + self.id] = val
+
+    @property
+    def lost_challenge(self):
+        return bool(self.game.state[LOST_CHALLENGE + self.id])
+
+    @lost_challenge.setter
+    def lost_challenge(self, val):
+        self.game.state[LOST_CHALLENGE + self.id] = val
+
+    def add_card(self, card):
+        self.game._add_card(self.id, card.val if isinstance(card, Card) else card)
+
+    def add_coins(self, num):
+        self.game.state[COINS + self.id] += num
+
+    def remove_coins(self, num):
+        self.game.state[COINS + self.id] -= num
+
+    def has_face_down_card(self, card_val):
+        return self.game._has_face_down_card(self.id, card_val)
+
+    def get_obs(self, text=False):
+        '''
+        Return the current state of the player
+        Same format as Player.get_obs
+        '''
+        s = self.game.state
+        c = CARDS + 4 * self.id
+        f = FACE_UP + 4 * self.id
+        n = self.game._num_cards(self.id)
+        la = s[LAST_ACTION + self.id]
+        if text:
+            return ([(Card.names[s[c + i]], s[f + i]) for i in range(n)],
+                    s[COINS + self.id],
+                    CoupEnv.actions[la])
+        return ([(s[c + i], s[f + i]) for i in range(n)],
+                s[COINS + self.id],
+                la)
+
+    def _sort_cards(self):
+        self.game._sort_cards(self.id)
+
+    render = Player.render
+
+
+class CompactGame:
+    '''
+    2 player Coup game stored in one fixed-size int8 array
+    Same rules and public API as Game, without Card/Player objects
+    '''
+    __slots__ = ('state', 'turn_count', 'num_human_players', 'rng')
+
+    def __init__(self, num_human_players=0, p_first_turn=0, rng=None):
+        '''
+        num_human_players: Number of human players in the 2-player game
+        p_first_turn:      Which player goes first, 0-indexed
+        rng:               random.Random used to shuffle the deck.
+                           Defaults to the shared random module
+        '''
+        self.num_human_players = num_human_players
+        self.rng = random if rng is None else rng
+        self.state = array('b', _INITIAL_STATE)
+        self.shuffle_deck()
+        self.deal_cards()
+
+        s = self.state
+        s[WHOSE_TURN] = p_first_turn
+        s[WHOSE_ACTION] = p_first_turn
+        self.turn_count = 0
+
+        # In a 2 player game, the player going first starts with 1 coin instead of 2
+        s[COINS + p_first_turn] = 1
+
+    # State flags, same attributes as Game
+
+    @property
+    def whose_turn(self):
+        return self.state[WHOSE_TURN]
+
+    @whose_turn.setter
+    def whose_turn(self, val):
+        self.state[WHOSE_TURN] = val
+
+    @property
+    def whose_action(self):
+        return self.state[WHOSE_ACTION]
+
+    @whose_action.setter
+    def whose_action(self, val):
+        self.state[WHOSE_ACTION] = val
+
+    @property
+    def is_turn_begin(self):
+        return bool(self.state[IS_TURN_BEGIN])
+
+    @is_turn_begin.setter
+    def is_turn_begin(self, val):
+        self.state[IS_TURN_BEGIN] = val
+
+    @property
+    def game_over(self):
+        return bool(self.state[GAME_OVER])
+
+    @game_over.setter
+    def game_over(self, val):
+        self.state[GAME_OVER] = val
+
+    @property
+    def players(self):
+        return [CompactPlayer(self, 0), CompactPlayer(self, 1)]
+
+    @property
+    def deck(self):
+        '''
+        Copies of the cards in the deck
+        '''
+        s = self.state
+        return [Card(v) for v in s[DECK:DECK + s[DECK_SIZE]]]
+
+    def as_numpy(self):
+        '''
+        Return a writable np.int8 view of the state array
+        '''
+        return np.frombuffer(self.state, dtype='int8')
+
+    def to_array(self):
+        '''
+        Return a copy of the state array
+        '''
+        return array('b', self.state)
+
+    def load_array(self, state):
+        self.state[:] = array('b', state)
+
+    def clone_state(self):
+        '''
+        Return an immutable GameSnapshot of the game,
+        including the deck order and the RNG state
+        '''
+        return GameSnapshot(self.state.tobytes(), self.turn_count, self.rng.getstate())
+
+    def restore_state(self, snapshot):
+        '''
+        Set the game to a GameSnapshot from clone_state()
+        '''
+        self.state = array('b', snapshot.state)
+        self.turn_count = snapshot.turn_count
+        if snapshot.rng_state is not None:
+            self.rng.setstate(snapshot.rng_state)
+
+    def clone(self, rng=None):
+        '''
+        Return an independent copy of the game
+
+        rng: RNG of the copy. Defaults to a copy of this game's RNG,
+             so the copy plays out the same as this game would
+        '''
+        g = type(self).__new__(type(self))
+        g.state = array('b', self.state)
+        g.turn_count = self.turn_count
+        g.num_human_players = self.num_human_players
+        g.rng = copy_rng(self.rng) if rng is None else rng
+        return g
+
+    def get_obs(self, p2_view=False, text=False):
+        '''
+        Return the current state of the game
+        Same format as Game.get_obs
+        '''
+        p1 = CompactPlayer(self, int(p2_view)).get_obs(text=text)
+        p2 = CompactPlayer(self, 1 - int(p2_view)).get_obs(text=text)
+        return (p1[0], p2[0], # Cards
+                p1[1], p2[1], # Coins
+                p1[2], p2[2], # Last action
+                self.state[WHOSE_ACTION])
+
+    def partial_obs(self, p2_view=False):
+        '''
+        Return the observation from a player's view with the opponent's
+        face down cards hidden, same as Game.partial_obs.
+        Built from the state array when called
+        '''
+        s = self.state
+        me = 1 if p2_view else 0
+        opp = 1 - me
+        c = CARDS + 4 * me
+        opp_c = CARDS + 4 * opp
+        opp_face_up = s[FACE_UP + 4 * opp:FACE_UP + 4 * opp + 4]
+        obs = s[c:c + 4]
+        # Hide value of opp face down cards
+        obs.extend([v if f == 1 else NONE for v, f in zip(s[opp_c:opp_c + 4], opp_face_up)])
+        obs += s[FACE_UP + 4 * me:FACE_UP + 4 * me + 4]
+        obs += opp_face_up
+        obs.extend((s[COINS + me], s[COINS + opp], s[LAST_ACTION + me], s[LAST_ACTION + opp], s[WHOSE_ACTION]))
+        return obs
+
+    def get_num_face_up(self):
+        '''
+        Return the number of face up cards of each player
+        '''
+        s = self.state
+        return [s[FACE_UP:FACE_UP + 4].count(1),
+                s[FACE_UP + 4:FACE_UP + 8].count(1)]
+
+    @property
+    def state_hash(self):
+        '''
+        Zobrist hash of the full state, same as Game.state_hash.
+        Computed from the state array when read
+        '''
+        return zobrist_hash(self.state)
+
+    def info_hash(self, p):
+        '''
+        Zobrist hash of the information set of player p, same as Game.info_hash()
+        '''
+        return zobrist_hash(self.state, view=p)
+
+    # The observations and hashes are built from the state array, so they can't go stale
+    check_invariants = Game._check_rules
+
+    def render(self):
+        logger.info(f'Turn {self.turn_count}')
+        logger.info('Player: Cards | IsCardFaceUp | Coins | LastAction')
+        for p in self.players:
+            p.render()
+
+    def draw_card(self):
+        s = self.state
+        s[DECK_SIZE] -= 1
+        return s[DECK + s[DECK_SIZE]]
+
+    def _return_card(self, card_val):
+        s = self.state
+        s[DECK + s[DECK_SIZE]] = card_val
+        s[DECK_SIZE] += 1
+
+    def shuffle_deck(self):
+        s = self.state
+        end = DECK + s[DECK_SIZE]
+        d = s[DECK:end].tolist()
+        self.rng.shuffle(d)
+        s[DECK:end] = array('b', d)
+
+    def deal_cards(self):
+        for _ in range(2):
+            for p in range(2):
+                self._add_card(p, self.draw_card())
+        self._sort_cards(0)
+        self._sort_cards(1)
+
+    def next_player_turn(self):
+        '''
+        Increment whose turn it is
+        Turns can include several sub-actions
+        '''
+        s = self.state
+        s[WHOSE_TURN] = 1 - s[WHOSE_TURN]
+        # Players will always have the first action on their turn
+        s[WHOSE_ACTION] = s[WHOSE_TURN]
+        self.turn_count += 1
+        s[IS_TURN_BEGIN] = 1
+
+    def next_player_action(self):
+        '''
+        Increment whose action it is
+        '''
+        s = self.state
+        s[WHOSE_ACTION] = 1 - s[WHOSE_ACTION]
+        s[IS_TURN_BEGIN] = 0
+
+    def get_curr_action_player(self):
+        return CompactPlayer(self, self.state[WHOSE_ACTION])
+
+    def get_opp_player(self):
+        return CompactPlayer(self, 1 - self.state[WHOSE_ACTION])
+
+    # Hand helpers
+
+    def _num_cards(self, p):
+        return 2 if self.state[CARDS + 4 * p + 2] == NONE else 4
+
+    def _add_card(self, p, card_val):
+        s = self.state
+        c = CARDS + 4 * p
+        i = s[c:c + 4].index(NONE)
+        s[c + i] = card_val
+        s[FACE_UP + 4 * p + i] = 0
+
+    def _has_face_down_card(self, p, card_val):
+        s = self.state
+        c = CARDS + 4 * p
+        f = FACE_UP + 4 * p
+        for i in range(4):
+            if s[c + i] == card_val and s[f + i] == 0:
+                return True
+        return False
+
+    def _sort_cards(self, p):
+        '''
+        Always keep the cards sorted in alphabetical order,
+        same order as Player._sort_cards
+        '''
+        s = self.state
+        c = CARDS + 4 * p
+        f = FACE_UP + 4 * p
+        n = self._num_cards(p)
+        hand = sorted(zip(s[c:c + n], s[f:f + n]))
+        s[c:c + n] = array('b', [v for v, _ in hand])
+        s[f:f + n] = array('b', [u for _, u in hand])
+
+    def get_decision_context(self):
+        '''
+        Return the decision_context() of the player choosing an action
+        '''
+        s = self.state
+        curr = s[WHOSE_ACTION]
+        opp = 1 - curr
+
+        if s[IS_TURN_BEGIN]:
+            phase = PHASE_TURN_BEGIN
+        elif s[LOST_CHALLENGE + curr]:
+            phase = PHASE_LOST_CHALLENGE
+        elif s[WHOSE_TURN] != curr:
+            phase = PHASE_RESPOND
+        elif s[LAST_ACTION + curr] == EXCHANGE:
+            phase = PHASE_EXCHANGE
+        else:
+            phase = PHASE_BLOCKED
+
+        return decision_context(phase,
+                                s[LAST_ACTION + opp],
+                                COIN_BUCKETS[min(s[COINS + curr], 10)],
+                                s[COINS + opp] > 0,
+                                s[FACE_UP + 4 * curr] == 0,
+                                s[FACE_UP + 4 * curr + 1] == 0,
+                                s[CARDS + 4 * curr + 2] != NONE)
+
+    get_valid_actions = Game.get_valid_actions
+    get_action_mask = Game.get_action_mask
+
+    # Actions
+    # Same behaviour as the Game action of the same name
+
+    def _set_last_action(self, action):
+        self.state[LAST_ACTION + self.state[WHOSE_ACTION]] = action
+
+    def _add_coins(self, p, num):
+        self.state[COINS + p] += num
+
+    def _steal_coins(self, thief, victim):
+        num_steal = 2 if self.state[COINS + victim] >= 2 else 1
+        self._add_coins(victim, -num_steal)
+        self._add_coins(thief, num_steal)
+
+    def income(self):
+        self._add_coins(self.state[WHOSE_ACTION], 1)
+        self._set_last_action(INCOME)
+        self.next_player_turn()
+
+    def foreign_aid(self):
+        if self.state[IS_TURN_BEGIN]:
+            self._set_last_action(FOREIGN_AID)
+            self.next_player_action()
+        else:
+            self._add_coins(self.state[WHOSE_ACTION], 2)
+            self.next_player_turn()
+
+    def coup(self):
+        curr = self.state[WHOSE_ACTION]
+        if self.state[COINS + curr] < 7:
+            raise RuntimeError('Not possible to coup with < 7 coins')
+
+        self._add_coins(curr, -7)
+        self._set_last_action(COUP)
+        self.next_player_action()
+
+    def tax(self):
+        if self.state[IS_TURN_BEGIN]:
+            self._set_last_action(TAX)
+            self.next_player_action()
+        else:
+            self._add_coins(self.state[WHOSE_ACTION], 3)
+            self.next_player_turn()
+
+    def assassinate(self):
+        self._set_last_action(ASSASSINATE)
+        # Pay the coins whether or not the action is blocked/challenged
+        self._add_coins(self.state[WHOSE_ACTION], -3)
+        self.next_player_action()
+
+    def exchange(self):
+        if self.state[IS_TURN_BEGIN]:
+            self._set_last_action(EXCHANGE)
+            self.next_player_action()
+        else:
+            curr = self.state[WHOSE_ACTION]
+            self._add_card(curr, self.draw_card())
+            self._add_card(curr, self.draw_card())
+
+    def _exchange_return(self, lst):
+        s = self.state
+        curr = s[WHOSE_ACTION]
+        c = CARDS + 4 * curr
+        f = FACE_UP + 4 * curr
+        keep = [i for i in range(4) if i not in lst]
+        # Same deck order as Game, which returns the cards last first
+        for i in reversed(lst):
+            self._return_card(s[c + i])
+        s[c:c + 2] = array('b', [s[c + i] for i in keep])
+        s[f:f + 2] = array('b', [s[f + i] for i in keep])
+        s[c + 2:c + 4] = array('b', [NONE, NONE])
+        s[f + 2:f + 4] = array('b', [NONE, NONE])
+        self.shuffle_deck()
+        self._sort_cards(curr)
+
+        if s[LOST_CHALLENGE + 1 - curr]:
+            # opp still needs to choose a card to lose
+            self.next_player_action()
+        else:
+            self.next_player_turn()
+
+    def exchange_return_12(self):
+        self._set_last_action(EXCHANGE_RETURN_12)
+        self._exchange_return([0, 1])
+
+    def exchange_return_13(self):
+        self._set_last_action(EXCHANGE_RETURN_13)
+        self._exchange_return([0, 2])
+
+    def exchange_return_14(self):
+        self._set_last_action(EXCHANGE_RETURN_14)
+        self._exchange_return([0, 3])
+
+    def exchange_return_23(self):
+        self._set_last_action(EXCHANGE_RETURN_23)
+        self._exchange_return([1, 2])
+
+    def exchange_return_24(self):
+        self._set_last_action(EXCHANGE_RETURN_24)
+        self._exchange_return([1, 3])
+
+    def exchange_return_34(self):
+        self._set_last_action(EXCHANGE_RETURN_34)
+        self._exchange_return([2, 3])
+
+    def steal(self):
+        if self.state[IS_TURN_BEGIN]:
+            self._set_last_action(STEAL)
+            self.next_player_action()
+        else:
+            curr = self.state[WHOSE_ACTION]
+            self._steal_coins(curr, 1 - curr)
+            self.next_player_turn()
+
+    def _pass(self):
+        # Complete the opponent's action
+        act = self.state[LAST_ACTION + 1 - self.state[WHOSE_ACTION]]
+        self.next_player_action()
+        self._action_handlers[act](self)
+
+    def _pass_block(self):
+        # Block succeeds, so nothing to do. Next turn.
+        self.next_player_turn()
+
+    def pass_fa(self):
+        self._set_last_action(PASS_FA)
+        self._pass()
+
+    def pass_fa_block(self):
+        self._set_last_action(PASS_FA_BLOCK)
+        self._pass_block()
+
+    def pass_tax(self):
+        self._set_last_action(PASS_TAX)
+        self._pass()
+
+    def pass_exchange(self):
+        self._set_last_action(PASS_EXCHANGE)
+        self._pass()
+
+    def pass_assassinate_block(self):
+        self._set_last_action(PASS_ASSASSINATE_BLOCK)
+        self._pass_block()
+
+    def pass_steal(self):
+        self._set_last_action(PASS_STEAL)
+        self._pass()
+
+    def pass_steal_block(self):
+        self._set_last_action(PASS_STEAL_BLOCK)
+        self._pass_block()
+
+    def block_fa(self):
+        self._set_last_action(BLOCK_FA)
+        self.next_player_action()
+
+    def block_assassinate(self):
+        self._set_last_action(BLOCK_ASSASSINATE)
+        self.next_player_action()
+
+    def block_steal(self):
+        self._set_last_action(BLOCK_STEAL)
+        self.next_player_action()
+
+    # Challenge:
+    # Check if opp_player has the required card
+    # If they do, curr_player loses a card
+    # If they don't, opp_player loses a card
+
+    def challenge_fa_block(self):
+        s = self.state
+        curr = s[WHOSE_ACTION]
+        self._set_last_action(CHALLENGE_FA_BLOCK)
+
+        if self._has_face_down_card(1 - curr, DUKE):
+            s[LOST_CHALLENGE + curr] = 1
+            self._challenge_fail_replace_card(DUKE)
+        else:
+            s[LOST_CHALLENGE + 1 - curr] = 1
+            # Block failed, so complete the action
+            self._add_coins(curr, 2)
+            self.next_player_action()
+
+    def challenge_tax(self):
+        s = self.state
+        curr = s[WHOSE_ACTION]
+        self._set_last_action(CHALLENGE_TAX)
+
+        if self._has_face_down_card(1 - curr, DUKE):
+            s[LOST_CHALLENGE + curr] = 1
+            self._challenge_fail_replace_card(DUKE)
+            # Complete the action
+            self._add_coins(1 - curr, 3)
+        else:
+            s[LOST_CHALLENGE + 1 - curr] = 1
+            self.next_player_action()
+
+    def challenge_exchange(self):
+        s = self.state
+        curr = s[WHOSE_ACTION]
+        self._set_last_action(CHALLENGE_EXCHANGE)
+
+        if self._has_face_down_card(1 - curr, AMBASSADOR):
+            s[LOST_CHALLENGE + curr] = 1
+            self._challenge_fail_replace_card(AMBASSADOR)
+            # Complete the action
+            self.next_player_action()
+            self.exchange()
+        else:
+            s[LOST_CHALLENGE + 1 - curr] = 1
+            self.next_player_action()
+
+    def challenge_assassinate(self):
+        s = self.state
+        curr = s[WHOSE_ACTION]
+        self._set_last_action(CHALLENGE_ASSASSINATE)
+
+        if self._has_face_down_card(1 - curr, ASSASSIN):
+            # curr_player loses the game
+            self._reveal_all(curr)
+        else:
+            s[LOST_CHALLENGE + 1 - curr] = 1
+            # Coins spent are returned in this one case
+            self._add_coins(1 - curr, 3)
+            self.next_player_action()
+
+    def challenge_assassinate_block(self):
+        s = self.state
+        curr = s[WHOSE_ACTION]
+        self._set_last_action(CHALLENGE_ASSASSINATE_BLOCK)
+
+        if self._has_face_down_card(1 - curr, CONTESSA):
+            s[LOST_CHALLENGE + curr] = 1
+            self._challenge_fail_replace_card(CONTESSA)
+        else:
+            # opp_player loses the game
+            self._reveal_all(1 - curr)
+
+    def challenge_steal(self):
+        s = self.state
+        curr = s[WHOSE_ACTION]
+        self._set_last_action(CHALLENGE_STEAL)
+
+        if self._has_face_down_card(1 - curr, CAPTAIN):
+            s[LOST_CHALLENGE + curr] = 1
+            self._challenge_fail_replace_card(CAPTAIN)
+            # Complete the action
+            self._steal_coins(1 - curr, curr)
+        else:
+            s[LOST_CHALLENGE + 1 - curr] = 1
+            self.next_player_action()
+
+    def challenge_steal_block(self):
+        s = self.state
+        curr = s[WHOSE_ACTION]
+        self._set_last_action(CHALLENGE_STEAL_BLOCK)
+
+        if self._has_face_down_card(1 - curr, CAPTAIN):
+            s[LOST_CHALLENGE + curr] = 1
+            self._challenge_fail_replace_card(CAPTAIN)
+        elif self._has_face_down_card(1 - curr, AMBASSADOR):
+            s[LOST_CHALLENGE + curr] = 1
+            self._challenge_fail_replace_card(AMBASSADOR)
+        else:
+            s[LOST_CHALLENGE + 1 - curr] = 1
+            # Block failed, so complete the action
+            self._steal_coins(curr, 1 - curr)
+            self.next_player_action()
+
+    def _reveal_all(self, p):
+        # Lose 1 card for assassination
+        # and 1 card for losing challenge
+        s = self.state
+        s[FACE_UP + 4 * p] = 1
+        s[FACE_UP + 4 * p + 1] = 1
+        s[GAME_OVER] = 1
+        logger.info('Game Over')
+
+    def _challenge_fail_replace_card(self, card_val):
+        # If the challenged player actually had the correct card,
+        # shuffle it into the deck and give them a new card
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(f'Showing and replacing card {Card.names[card_val]}')
+        s = self.state
+        p = 1 - s[WHOSE_ACTION]
+        c = CARDS + 4 * p
+        f = FACE_UP + 4 * p
+        for i in range(4):
+            if s[c + i] == card_val and s[f + i] == 0:
+                self._return_card(card_val)
+                self.shuffle_deck()
+                s[c + i] = self.draw_card()
+                self._sort_cards(p)
+                return
+
+        raise RuntimeError(f'Tried to replace card {Card.names[card_val]} that was not in player\'s hand')
+
+    def _lose_card(self, card_ind):
+        s = self.state
+        curr = s[WHOSE_ACTION]
+        f = FACE_UP + 4 * curr
+        if s[f + card_ind] == 1:
+            raise RuntimeError(f'Cannot lose a card that is already face up')
+
+        s[f + card_ind] = 1
+        s[LOST_CHALLENGE + curr] = 0
+        self._sort_cards(curr)
+
+        # Check if the player has no cards remaining
+        s[GAME_OVER] = 0 not in s[f:f + 4]
+
+        if s[GAME_OVER]:
+            logger.info('Game Over')
+
+        self.next_player_turn()
+
+    def lose_card_1(self):
+        self._set_last_action(LOSE_CARD_1)
+        self._lose_card(0)
+
+    def lose_card_2(self):
+        self._set_last_action(LOSE_CARD_2)
+        self._lose_card(1)
+
+
+CompactGame._action_handlers = _dispatch_table(CompactGame)
@@ -0,0 +1,56 @@
+from gym_coup.envs.coup_env import *
+
+
+class CountDeckGame(Game):
+    '''
+    Game that keeps the deck as the number of each card left in it
+
+    The deck order is never seen between a shuffle and the next draw,
+    so rather than shuffling a list of Cards, each draw picks a card at
+    random from the counts with the game's RNG. Draws have the same
+    distribution as in Game, without the shuffles and list moves.
+
+    deck_counts: Number of cards of each value in the deck
+    deck:        Copy of the deck as Cards, in card order
+    '''
+    @property
+    def deck(self):
+        return [Card(v) for v, n in enumerate(self.deck_counts) for _ in range(n)]
+
+    @deck.setter
+    def deck(self, cards):
+        counts = [0] * len(Card.names)
+        for c in cards:
+            counts[c.val] += 1
+        self.deck_counts = counts
+        self.deck_size = len(cards)
+
+    def draw_card(self, index=0):
+        '''
+        Draw a card uniformly at random from the deck.
+        index is ignored, every card in the deck is equally likely
+        '''
+        counts = self.deck_counts
+        r = self.rng.randrange(self.deck_size)
+        v = 0
+        while r >= counts[v]:
+            r -= counts[v]
+            v += 1
+        counts[v] -= 1
+        self.deck_size -= 1
+        self._deck_hash = (self._deck_hash - ZOBRIST_DECK[v]) & HASH_MASK
+        return Card(v)
+
+    def _return_card(self, card):
+        self.deck_counts[card.val] += 1
+        self.deck_size += 1
+        self._deck_hash = (self._deck_hash + ZOBRIST_DECK[card.val]) & HASH_MASK
+
+    def shuffle_deck(self):
+        # Draws are already random
+        pass
+
+    def check_invariants(self):
+        super().check_invariants()
+        if self.deck_size != sum(self.deck_counts) or min(self.deck_counts) < 0:
+            raise RuntimeError('Deck counts do not match the deck size')
@@ -1,6 +1,8 @@
 import gym
 import numpy as np
-from random import shuffle
+from array import array
+from collections import namedtuple
+import random
 import logging
 
 logging.basicConfig()
@@ -49,6 +51,31 @@ EXCHANGE_RETURN_23          = 29
 EXCHANGE_RETURN_24          = 30
 EXCHANGE_RETURN_34          = 31
 
+# Zobrist keys, random 64-bit ints from a fixed seed so hashes are the same in every process.
+# A game's hash is the XOR of the keys of its current values, see zobrist_hash().
+# Lists are indexed by value, so -1 (NONE) picks the last key.
+def _zobrist_keys(rng, *shape):
+    if not shape:
+        return rng.getrandbits(64)
+    return [_zobrist_keys(rng, *shape[1:]) for _ in range(shape[0])]
+
+_zobrist_rng = random.Random(0x5eed)
+ZOBRIST_CARD           = _zobrist_keys(_zobrist_rng, 2, 4, 5, 2) # [player][slot][card][is face up]
+ZOBRIST_HIDDEN         = _zobrist_keys(_zobrist_rng, 2, 4)       # [player][slot], face down card seen by opp
+ZOBRIST_COINS          = _zobrist_keys(_zobrist_rng, 2, 64)      # [player][coins]
+ZOBRIST_LAST_ACTION    = _zobrist_keys(_zobrist_rng, 2, 33)      # [player][action]
+# Flags are one key, XORed in while the flag is set
+ZOBRIST_LOST_CHALLENGE = _zobrist_keys(_zobrist_rng, 2)          # [player]
+ZOBRIST_WHOSE_TURN     = _zobrist_keys(_zobrist_rng)             # P2's turn
+ZOBRIST_WHOSE_ACTION   = _zobrist_keys(_zobrist_rng)             # P2's action
+ZOBRIST_IS_TURN_BEGIN  = _zobrist_keys(_zobrist_rng)
+ZOBRIST_GAME_OVER      = _zobrist_keys(_zobrist_rng)
+# The deck is hashed as the sum of one key per card, mod 2^64,
+# so its order doesn't matter and equal cards don't cancel out
+ZOBRIST_DECK           = _zobrist_keys(_zobrist_rng, 5)          # [card]
+HASH_MASK = (1 << 64) - 1
+_FULL_DECK_HASH = 3 * sum(ZOBRIST_DECK) & HASH_MASK
+
 class Card:
     names = ['Assassin',
              'Ambassador',
@@ -57,40 +84,161 @@ class Card:
              'Duke']
     def __init__(self, val, is_face_up=False):
         self.val = val
-        self.is_face_up = is_face_up
+        self._is_face_up = is_face_up
+        # Player whose hand the card was last in. Its observations
+        # and hashes are updated when the card is turned
+        self.owner = None
+
+    @property
+    def is_face_up(self):
+        return self._is_face_up
+
+    @is_face_up.setter
+    def is_face_up(self, val):
+        self._is_face_up = val
+        if self.owner is not None:
+            self.owner._update_cards()
 
     def get_name(self):
         return Card.names[self.val]
 
     def __lt__(self, other):
         return (self.val < other.val or
-                (self.val == other.val and self.is_face_up < other.is_face_up))
+                (self.val == other.val and self._is_face_up < other._is_face_up))
+
+# Observation of a game before the cards are dealt, see CoupEnv.get_obs
+_INITIAL_OBS = array('b', [NONE] * 16 + [2, 2, NONE, NONE, 0])
+
 
 class Player:
-    def __init__(self, id, is_human=False):
+    def __init__(self, id, is_human=False, obs=None):
+        '''
+        obs: The game's observations from each player's view, see Game.partial_obs.
+             The player keeps its part of them up to date. Defaults to new arrays
+        '''
         self.id = id
         self.is_human = is_human
         self.cards = []
-        self.coins = 2
+        self._coins = 2
         self.last_action = NONE
 
         # Indicate that the player has lost a challenge
         # and must choose which card to lose
         self.lost_challenge = False
 
+        # Zobrist hashes, kept up to date by the game's actions, see Game.state_hash
+        #   _hash:              Coins, last action and lost challenge
+        #   _cards_hash:        Cards
+        #   _public_cards_hash: Cards as the opponent sees them
+        self._hash = ZOBRIST_COINS[id][2] ^ ZOBRIST_LAST_ACTION[id][NONE]
+        self._cards_hash = 0
+        self._public_cards_hash = 0
+
+        if obs is None:
+            obs = (array('b', _INITIAL_OBS), array('b', _INITIAL_OBS))
+        # Observations from the player's own view, and from the opponent's
+        self._own_obs = obs[id]
+        self._opp_obs = obs[1 - id]
+
+    @property
+    def hash(self):
+        '''
+        Zobrist hash of the player
+        '''
+        return self._hash ^ self._cards_hash
+
+    @property
+    def public_hash(self):
+        '''
+        Zobrist hash of the player as the opponent sees them,
+        with face down cards hidden
+        '''
+        return self._hash ^ self._public_cards_hash
+
+    @property
+    def coins(self):
+        return self._coins
+
+    @coins.setter
+    def coins(self, val):
+        keys = ZOBRIST_COINS[self.id]
+        self._hash ^= keys[self._coins] ^ keys[val]
+        self._coins = val
+        self._own_obs[16] = self._opp_obs[17] = val
+
     def add_card(self, card):
+        i = len(self.cards)
         self.cards.append(card)
+        card.owner = self
+        key = ZOBRIST_CARD[self.id][i][card.val][card.is_face_up]
+        self._cards_hash ^= key
+        self._public_cards_hash ^= key if card.is_face_up else ZOBRIST_HIDDEN[self.id][i]
+        own = self._own_obs
+        opp = self._opp_obs
+        own[i] = card.val
+        own[8 + i] = opp[12 + i] = card.is_face_up
+        opp[4 + i] = card.val if card.is_face_up else NONE
+
+    def _rehash(self):
+        '''
+        Recompute the hashes and observations from scratch
+        '''
+        self._hash = ZOBRIST_COINS[self.id][self.coins] ^ ZOBRIST_LAST_ACTION[self.id][self.last_action]
+        if self.lost_challenge:
+            self._hash ^= ZOBRIST_LOST_CHALLENGE[self.id]
+        self._own_obs[16] = self._opp_obs[17] = self.coins
+        self._own_obs[18] = self._opp_obs[19] = self.last_action
+        self._update_cards()
+
+    def _update_cards(self):
+        '''
+        Recompute the hashes and observations of the cards,
+        after they are reordered, returned or turned face up
+        '''
+        keys = ZOBRIST_CARD[self.id]
+        hidden = ZOBRIST_HIDDEN[self.id]
+        own = self._own_obs
+        opp = self._opp_obs
+        h = public = 0
+        i = 0
+        for c in self.cards:
+            c.owner = self
+            val = c.val
+            own[i] = val
+            if c._is_face_up:
+                key = keys[i][val][1]
+                h ^= key
+                public ^= key
+                own[8 + i] = opp[12 + i] = 1
+                opp[4 + i] = val
+            else:
+                h ^= keys[i][val][0]
+                public ^= hidden[i]
+                own[8 + i] = opp[12 + i] = 0
+                opp[4 + i] = NONE
+            i += 1
+        while i < 4:
+            own[i] = own[8 + i] = opp[4 + i] = opp[12 + i] = NONE
+            i += 1
+        self._cards_hash = h
+        self._public_cards_hash = public
 
     def add_coins(self, num):
-        self.coins += num
+        keys = ZOBRIST_COINS[self.id]
+        self._hash ^= keys[self._coins] ^ keys[self._coins + num]
+        self._coins += num
+        self._own_obs[16] = self._opp_obs[17] = self._coins
 
     def remove_coins(self, num):
-        self.coins -= num
+        keys = ZOBRIST_COINS[self.id]
+        self._hash ^= keys[self._coins] ^ keys[self._coins - num]
+        self._coins -= num
+        self._own_obs[16] = self._opp_obs[17] = self._coins
 
     def has_face_down_card(self, card_val):
         for i in range(len(self.cards)):
             c = self.cards[i]
-            if c.val == card_val and not c.is_face_up:
+            if c.val == card_val and not c._is_face_up:
                 return True
         return False
 
@@ -118,6 +266,27 @@ class Player:
                 self.coins,
                 la)
 
+    def clone(self, obs=None):
+        '''
+        obs: Observations of the game the copy is in.
+             Defaults to copies of this player's
+        '''
+        if obs is None:
+            own = array('b', self._own_obs)
+            opp = array('b', self._opp_obs)
+            obs = (own, opp) if self.id == 0 else (opp, own)
+        p = type(self)(self.id, self.is_human, obs)
+        p.cards = [Card(c.val, c.is_face_up) for c in self.cards]
+        for c in p.cards:
+            c.owner = p
+        p._coins = self._coins
+        p.last_action = self.last_action
+        p.lost_challenge = self.lost_challenge
+        p._hash = self._hash
+        p._cards_hash = self._cards_hash
+        p._public_cards_hash = self._public_cards_hash
+        return p
+
     def _sort_cards(self):
         '''
         Always keep the cards sorted in alphabetical order.
@@ -125,6 +294,7 @@ class Player:
         sorts we need by only sorting when cards are exchanged or lost.
         '''
         self.cards.sort()
+        self._update_cards()
 
     def render(self):
         text = f'P{self.id + 1}: '
@@ -138,18 +308,240 @@ class Player:
         logger.info(text)
 
 
+# Decision phases of the player choosing an action
+PHASE_TURN_BEGIN     = 0 # Choose the turn's action
+PHASE_LOST_CHALLENGE = 1 # Choose a card to lose
+PHASE_RESPOND        = 2 # Pass, block or challenge opp's action
+PHASE_EXCHANGE       = 3 # Choose cards to return to the deck
+PHASE_BLOCKED        = 4 # Pass or challenge opp's block
+NUM_PHASES           = 5
+
+# Coin bucket at the beginning of a turn, indexed by min(coins, 10)
+#   0: < 3   1: Can assassinate   2: Can coup   3: Must coup
+COIN_BUCKETS = (0, 0, 0, 1, 1, 1, 1, 2, 2, 2, 3)
+
+NUM_ACTIONS = 32
+
+def decision_context(phase, opp_last_action, coin_bucket, opp_has_coins,
+                     face_down_1, face_down_2, has_4_cards):
+    '''
+    Pack everything that decides the valid actions into one int,
+    an index into VALID_ACTIONS and ACTION_MASKS
+    '''
+    key = phase * 33 + opp_last_action + 1
+    key = key * 4 + coin_bucket
+    key = key * 2 + opp_has_coins
+    key = key * 2 + face_down_1
+    key = key * 2 + face_down_2
+    return key * 2 + has_4_cards
+
+NUM_DECISION_CONTEXTS = decision_context(NUM_PHASES, -1, 0, 0, 0, 0, 0)
+
+def _valid_actions_for_context(phase, opp_last_action, coin_bucket, opp_has_coins,
+                               face_down_1, face_down_2, has_4_cards):
+    '''
+    The rules behind Game.get_valid_actions, evaluated once per context
+    '''
+    def valid_lose_card_options():
+        valid = []
+        if face_down_1:
+            # Card is still in play. Can choose to give it up.
+            valid += [LOSE_CARD_1]
+        if face_down_2:
+            # Card is still in play. Can choose to give it up.
+            valid += [LOSE_CARD_2]
+        return valid
+
+    if phase == PHASE_TURN_BEGIN:
+        if coin_bucket == 3:
+            return [COUP]
+
+        valid = [INCOME, FOREIGN_AID, TAX, EXCHANGE]
+        if coin_bucket >= 1:
+            valid.append(ASSASSINATE)
+        if coin_bucket >= 2:
+            valid.append(COUP)
+        if opp_has_coins:
+            valid.append(STEAL)
+        return valid
+
+    elif phase == PHASE_LOST_CHALLENGE:
+        return valid_lose_card_options()
+
+    elif phase == PHASE_RESPOND:
+        # It is opp_player's turn, and curr_player can
+        # choose to block or challenge for certain actions
+        if opp_last_action == FOREIGN_AID:
+            return [PASS_FA, BLOCK_FA]
+        elif opp_last_action == TAX:
+            return [PASS_TAX, CHALLENGE_TAX]
+        elif opp_last_action == EXCHANGE:
+            return [PASS_EXCHANGE, CHALLENGE_EXCHANGE]
+        elif opp_last_action == STEAL:
+            return [PASS_STEAL, BLOCK_STEAL, CHALLENGE_STEAL]
+        elif opp_last_action == ASSASSINATE:
+            return valid_lose_card_options() + [BLOCK_ASSASSINATE, CHALLENGE_ASSASSINATE]
+        elif opp_last_action == COUP:
+            return valid_lose_card_options()
+
+    elif phase == PHASE_EXCHANGE:
+        # It is curr_player's turn, and opp_player has approved the exchange
+        if not has_4_cards:
+            raise RuntimeError('Player mid-exchange should have 4 cards including any eliminated')
+
+        valid = [EXCHANGE_RETURN_34]
+        if face_down_1:
+            valid += [EXCHANGE_RETURN_13, EXCHANGE_RETURN_14]
+        if face_down_2:
+            valid += [EXCHANGE_RETURN_23, EXCHANGE_RETURN_24]
+        if face_down_1 and face_down_2:
+            valid += [EXCHANGE_RETURN_12]
+        return valid
+
+    elif phase == PHASE_BLOCKED:
+        # It is curr_player's turn and opp_player wants to block their move
+        if opp_last_action == BLOCK_FA:
+            return [PASS_FA_BLOCK, CHALLENGE_FA_BLOCK]
+        elif opp_last_action == BLOCK_ASSASSINATE:
+            return [PASS_ASSASSINATE_BLOCK, CHALLENGE_ASSASSINATE_BLOCK]
+        elif opp_last_action == BLOCK_STEAL:
+            return [PASS_STEAL_BLOCK, CHALLENGE_STEAL_BLOCK]
+
+    raise RuntimeError('Invalid action progression')
+
+def _build_action_tables():
+    valid_actions = [None] * NUM_DECISION_CONTEXTS
+    masks = np.zeros((NUM_DECISION_CONTEXTS, NUM_ACTIONS), dtype=np.bool_)
+    for phase in range(NUM_PHASES):
+        for la in range(-1, NUM_ACTIONS):
+            for bucket in range(4):
+                for ctx in np.ndindex(2, 2, 2, 2):
+                    key = decision_context(phase, la, bucket, *ctx)
+                    try:
+                        valid = _valid_actions_for_context(phase, la, bucket, *ctx)
+                    except RuntimeError as e:
+                        # Raised again when the context is looked up
+                        valid_actions[key] = str(e)
+                        continue
+                    valid_actions[key] = tuple(valid)
+                    masks[key, valid] = True
+    masks.flags.writeable = False
+    return valid_actions, masks
+
+# Indexed by decision_context()
+#   VALID_ACTIONS: Tuple of valid action ids, or the error message if the context can't occur
+#   ACTION_MASKS:  Read-only np.bool_ mask of length 32
+VALID_ACTIONS, ACTION_MASKS = _build_action_tables()
+
+# Mask of a finished game, no valid actions
+NO_ACTIONS_MASK = np.zeros(NUM_ACTIONS, dtype=np.bool_)
+NO_ACTIONS_MASK.flags.writeable = False
+
+
+# Flat state layout, one int8 per entry
+# Used by CompactGame and game snapshots
+CARDS          = 0  # 2 players x 4 cards, -1 = No card
+FACE_UP        = 8  # 2 players x 4 cards, -1 = No card
+COINS          = 16 # 2 players
+LAST_ACTION    = 18 # 2 players
+LOST_CHALLENGE = 20 # 2 players
+WHOSE_TURN     = 22
+WHOSE_ACTION   = 23
+IS_TURN_BEGIN  = 24
+GAME_OVER      = 25
+DECK_SIZE      = 26
+DECK           = 27 # 15 cards, the first DECK_SIZE are in the deck, drawn from the last
+STATE_SIZE     = 42
+
+def zobrist_hash(state, view=None):
+    '''
+    Zobrist hash of a game in the flat state layout.
+    Equal to Game.state_hash and Game.info_hash() of the same game
+
+    view: None for the full state, or the player whose information set to hash:
+          the opponent's face down cards and the deck are hidden
+    '''
+    h = 0
+    for i, key in ((WHOSE_TURN, ZOBRIST_WHOSE_TURN), (WHOSE_ACTION, ZOBRIST_WHOSE_ACTION),
+                   (IS_TURN_BEGIN, ZOBRIST_IS_TURN_BEGIN), (GAME_OVER, ZOBRIST_GAME_OVER)):
+        if state[i]:
+            h ^= key
+    for p in range(2):
+        h ^= ZOBRIST_COINS[p][state[COINS + p]] ^ ZOBRIST_LAST_ACTION[p][state[LAST_ACTION + p]]
+        if state[LOST_CHALLENGE + p]:
+            h ^= ZOBRIST_LOST_CHALLENGE[p]
+        hidden = view is not None and view != p
+        for i in range(4):
+            val = state[CARDS + 4 * p + i]
+            if val == NONE:
+                continue
+            is_face_up = state[FACE_UP + 4 * p + i]
+            h ^= ZOBRIST_HIDDEN[p][i] if hidden and not is_face_up else ZOBRIST_CARD[p][i][val][is_face_up]
+    if view is None:
+        deck = 0
+        for val in state[DECK:DECK + state[DECK_SIZE]]:
+            deck += ZOBRIST_DECK[val]
+        h ^= deck & HASH_MASK
+    return h
+
+def copy_rng(rng):
+    '''
+    Return an independent random.Random with the same state as rng.
+    The shared random module can't be copied, so it is returned as is.
+    '''
+    if rng is random:
+        return rng
+    new = random.Random.__new__(random.Random)
+    new.setstate(rng.getstate())
+    return new
+
+# Immutable copy of a game
+#   state:      bytes in the flat state layout
+#   turn_count: Game.turn_count
+#   rng_state:  State of the RNG used to shuffle the deck
+GameSnapshot = namedtuple('GameSnapshot', ['state', 'turn_count', 'rng_state'])
+
+# Immutable copy of a CoupEnv
+#   game:               GameSnapshot
+#   cumulative_rewards: Rewards since each player's last action
+CoupEnvSnapshot = namedtuple('CoupEnvSnapshot', ['game', 'cumulative_rewards'])
+
+
 class Game:
     '''
     2 player Coup game
     Can have any combination of human and cpu players
     '''
-    def __init__(self, num_human_players=0, p_first_turn=0):
+    player_cls = Player
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Pick up any overridden action handlers
+        cls._action_handlers = _dispatch_table(cls)
+
+    def __init__(self, num_human_players=0, p_first_turn=0, rng=None):
         '''
         num_human_players: Number of human players in the 2-player game
         p_first_turn:      Which player goes first, 0-indexed
+        rng:               random.Random used to shuffle the deck.
+                           Defaults to the shared random module
         '''
-        self.players = [Player(i, True) for i in range(num_human_players)]
-        self.players += [Player(i+num_human_players, False) for i in range(2-num_human_players)]
+        self.rng = random if rng is None else rng
+
+        # Zobrist hashes of the turn flags, and of the cards in the deck.
+        # The players hash the rest, see state_hash
+        self._hash = ZOBRIST_IS_TURN_BEGIN
+        if p_first_turn:
+            self._hash ^= ZOBRIST_WHOSE_TURN ^ ZOBRIST_WHOSE_ACTION
+        self._deck_hash = _FULL_DECK_HASH
+
+        # Observations from each player's view, kept up to date
+        # by the actions, see partial_obs
+        self._obs = (array('b', _INITIAL_OBS), array('b', _INITIAL_OBS))
+        self._obs[0][20] = self._obs[1][20] = p_first_turn
+
+        self.players = [self.player_cls(i, True, self._obs) for i in range(num_human_players)]
+        self.players += [self.player_cls(i+num_human_players, False, self._obs) for i in range(2-num_human_players)]
 
         self.deck = [Card(i) for _ in range(3) for i in range(len(Card.names))]
         self.shuffle_deck()
@@ -171,7 +563,7 @@ class Game:
 
         if len(self.players) == 2:
             # In a 2 player game, the player going first starts with 1 coin instead of 2
-            self.players[p_first_turn].coins = 1
+            self.players[p_first_turn].remove_coins(1)
 
     def get_obs(self, p2_view=False, text=False):
         '''
@@ -208,17 +600,192 @@ class Game:
                 p1[2], p2[2], # Last action
                 self.whose_action)
 
+    def partial_obs(self, p2_view=False):
+        '''
+        Return the observation from a player's view, with the opponent's
+        face down cards hidden. Same values as CoupEnv.get_obs(p2_view)
+        with is_partial_obs, as an array('b') of length 21.
+
+        The array is kept up to date by the actions, so it is not rebuilt.
+        It changes as the game goes on, copy it to keep it
+        '''
+        return self._obs[1 if p2_view else 0]
+
+    def get_num_face_up(self):
+        '''
+        Return the number of face up cards of each player
+        '''
+        return [len([1 for c in p.cards if c._is_face_up]) for p in self.players]
+
+    @property
+    def state_hash(self):
+        '''
+        64-bit Zobrist hash of the full state: hands, coins, last actions,
+        lost challenges, turn flags and the cards in the deck, but not their order.
+        Kept up to date as the game changes, so reading it is O(1).
+        Same as zobrist_hash(self.to_array()), after rehash() if attributes
+        other than Player.coins and Card.is_face_up were set directly
+        '''
+        p1, p2 = self.players
+        return self._hash ^ self._deck_hash ^ p1.hash ^ p2.hash
+
+    def info_hash(self, p):
+        '''
+        64-bit Zobrist hash of the information set of player p:
+        the state without the opponent's face down cards and the deck.
+        Same as zobrist_hash(self.to_array(), view=p)
+        '''
+        return self._hash ^ self.players[p].hash ^ self.players[1 - p].public_hash
+
+    def rehash(self):
+        '''
+        Recompute the hashes and observations from scratch.
+        Only needed after setting attributes directly, other than
+        Player.coins and Card.is_face_up. The actions keep them up to date
+        '''
+        h = 0
+        if self.whose_turn:
+            h ^= ZOBRIST_WHOSE_TURN
+        if self.whose_action:
+            h ^= ZOBRIST_WHOSE_ACTION
+        if self.is_turn_begin:
+            h ^= ZOBRIST_IS_TURN_BEGIN
+        if self.game_over:
+            h ^= ZOBRIST_GAME_OVER
+        self._hash = h
+        self._obs[0][20] = self._obs[1][20] = self.whose_action
+        for p in self.players:
+            p._rehash()
+        deck = 0
+        for c in self.deck:
+            deck += ZOBRIST_DECK[c.val]
+        self._deck_hash = deck & HASH_MASK
+
+    def to_array(self):
+        '''
+        Return the game in the flat state layout as an array('b')
+        '''
+        state = array('b', bytes(STATE_SIZE))
+        for p in self.players:
+            n = len(p.cards)
+            c = CARDS + 4 * p.id
+            f = FACE_UP + 4 * p.id
+            state[c:c + 4] = array('b', [x.val for x in p.cards] + [NONE] * (4 - n))
+            state[f:f + 4] = array('b', [x.is_face_up for x in p.cards] + [NONE] * (4 - n))
+            state[COINS + p.id] = p.coins
+            state[LAST_ACTION + p.id] = p.last_action
+            state[LOST_CHALLENGE + p.id] = p.lost_challenge
+        state[WHOSE_TURN] = self.whose_turn
+        state[WHOSE_ACTION] = self.whose_action
+        state[IS_TURN_BEGIN] = self.is_turn_begin
+        state[GAME_OVER] = self.game_over
+        state[DECK_SIZE] = len(self.deck)
+        state[DECK:DECK + len(self.deck)] = array('b', [x.val for x in self.deck])
+        return state
+
+    def load_array(self, state):
+        '''
+        Set the game from the flat state layout
+        '''
+        for p in self.players:
+            c = CARDS + 4 * p.id
+            f = FACE_UP + 4 * p.id
+            p.cards = [Card(state[c + i], bool(state[f + i])) for i in range(4) if state[c + i] != NONE]
+            p.coins = state[COINS + p.id]
+            p.last_action = state[LAST_ACTION + p.id]
+            p.lost_challenge = bool(state[LOST_CHALLENGE + p.id])
+        self.whose_turn = state[WHOSE_TURN]
+        self.whose_action = state[WHOSE_ACTION]
+        self.is_turn_begin = bool(state[IS_TURN_BEGIN])
+        self.game_over = bool(state[GAME_OVER])
+        self.deck = [Card(v) for v in state[DECK:DECK + state[DECK_SIZE]]]
+        self.rehash()
+
+    def clone_state(self):
+        '''
+        Return an immutable GameSnapshot of the game,
+        including the deck order and the RNG state
+        '''
+        return GameSnapshot(bytes(self.to_array()), self.turn_count, self.rng.getstate())
+
+    def restore_state(self, snapshot):
+        '''
+        Set the game to a GameSnapshot from clone_state()
+        '''
+        self.load_array(array('b', snapshot.state))
+        self.turn_count = snapshot.turn_count
+        if snapshot.rng_state is not None:
+            self.rng.setstate(snapshot.rng_state)
+
+    def clone(self, rng=None):
+        '''
+        Return an independent copy of the game
+
+        rng: RNG of the copy. Defaults to a copy of this game's RNG,
+             so the copy plays out the same as this game would
+        '''
+        g = type(self).__new__(type(self))
+        g.__dict__.update(self.__dict__)
+        g.rng = copy_rng(self.rng) if rng is None else rng
+        g._obs = (array('b', self._obs[0]), array('b', self._obs[1]))
+        g.players = [p.clone(g._obs) for p in self.players]
+        g.deck = [Card(c.val, c.is_face_up) for c in self.deck]
+        return g
+
+    def check_invariants(self):
+        '''
+        Raise RuntimeError if the game is in an inconsistent state,
+        or its observations or hashes are out of date, see rehash()
+        '''
+        self._check_rules()
+        cached = self._cached()
+        # Recomputing them changes nothing when they are up to date
+        self.rehash()
+        if self._cached() != cached:
+            raise RuntimeError('Observations or hashes were out of date, call rehash() after setting attributes directly')
+
+    def _cached(self):
+        return (self.state_hash, self.info_hash(0), self.info_hash(1), self._obs[0].tobytes(), self._obs[1].tobytes())
+
+    def _check_rules(self):
+        '''
+        Raise RuntimeError if the game state breaks the rules
+        '''
+        players = self.players
+        num_face_up = self.get_num_face_up()
+        if not self.game_over and max(num_face_up) >= 2:
+            raise RuntimeError('Game over was not set when it should be')
+        if len(self.deck) + sum(len(p.cards) for p in players) != 15:
+            raise RuntimeError('Cards were lost or duplicated')
+        for p in players:
+            if len(p.cards) not in [2, 4]:
+                raise RuntimeError('Number of cards in hand must be 2 or 4')
+            if p.coins < 0:
+                raise RuntimeError('Player has negative coins')
+        if self.whose_action not in [0, 1] or self.whose_turn not in [0, 1]:
+            raise RuntimeError('Invalid player turn')
+
     def render(self):
         logger.info(f'Turn {self.turn_count}')
         logger.info('Player: Cards | IsCardFaceUp | Coins | LastAction')
         for p in self.players:
             p.render()
 
-    def draw_card(self, index=0):
-        return self.deck.pop(index)
+    def draw_card(self, index=-1):
+        '''
+        Remove and return a card of the deck, by default the top one.
+        The top is the last card, same as in the flat state layout
+        '''
+        card = self.deck.pop(index)
+        self._deck_hash = (self._deck_hash - ZOBRIST_DECK[card.val]) & HASH_MASK
+        return card
+
+    def _return_card(self, card):
+        self.deck.append(card)
+        self._deck_hash = (self._deck_hash + ZOBRIST_DECK[card.val]) & HASH_MASK
 
     def shuffle_deck(self):
-        shuffle(self.deck)
+        self.rng.shuffle(self.deck)
 
     def deal_cards(self):
         for _ in range(2):
@@ -235,17 +802,29 @@ class Game:
                 is a single turn of 3 actions
         '''
         self.whose_turn = 1 - self.whose_turn
+        h = self._hash ^ ZOBRIST_WHOSE_TURN
         # Players will always have the first action on their turn
-        self.whose_action = self.whose_turn
+        if self.whose_action != self.whose_turn:
+            self.whose_action = self.whose_turn
+            self._obs[0][20] = self._obs[1][20] = self.whose_action
+            h ^= ZOBRIST_WHOSE_ACTION
         self.turn_count += 1
-        self.is_turn_begin = True
+        if not self.is_turn_begin:
+            self.is_turn_begin = True
+            h ^= ZOBRIST_IS_TURN_BEGIN
+        self._hash = h
 
     def next_player_action(self):
         '''
         Increment whose action it is
         '''
         self.whose_action = 1 - self.whose_action
-        self.is_turn_begin = False
+        self._obs[0][20] = self._obs[1][20] = self.whose_action
+        h = self._hash ^ ZOBRIST_WHOSE_ACTION
+        if self.is_turn_begin:
+            self.is_turn_begin = False
+            h ^= ZOBRIST_IS_TURN_BEGIN
+        self._hash = h
 
     def get_curr_action_player(self):
         return self.players[self.whose_action]
@@ -253,103 +832,75 @@ class Game:
     def get_opp_player(self):
         return self.players[1 - self.whose_action]
 
-    def get_valid_actions(self):
-        curr_player = self.get_curr_action_player()
-        opp_player = self.get_opp_player()
-
-        def valid_lose_card_options():
-            valid = []
-            if not curr_player.cards[0].is_face_up:
-                # Card is still in play. Can choose to give it up.
-                valid += [LOSE_CARD_1]
-            if not curr_player.cards[1].is_face_up:
-                # Card is still in play. Can choose to give it up.
-                valid += [LOSE_CARD_2]
-            return valid
-
+    def get_decision_context(self):
+        '''
+        Return the decision_context() of the player choosing an action
+        '''
+        curr_player = self.players[self.whose_action]
+        opp_player = self.players[1 - self.whose_action]
 
         if self.is_turn_begin:
-            # It's the beginning of curr_player's turn
-
-            if curr_player.coins >= 10:
-                return [COUP]
-
-            valid = [INCOME, FOREIGN_AID, TAX, EXCHANGE]
-            if curr_player.coins >= 3:
-                valid.append(ASSASSINATE)
-            if curr_player.coins >= 7:
-                valid.append(COUP)
-            if opp_player.coins > 0:
-                valid.append(STEAL)
-            
-            return valid
-
+            phase = PHASE_TURN_BEGIN
         elif curr_player.lost_challenge:
-            return valid_lose_card_options()
-
+            phase = PHASE_LOST_CHALLENGE
         elif self.whose_turn != self.whose_action:
-            # It is opp_player's turn, and curr_player can
-            # choose to block or challenge for certain actions
-
-            if opp_player.last_action == FOREIGN_AID:
-                return [PASS_FA, BLOCK_FA]
-            elif opp_player.last_action == TAX:
-                return [PASS_TAX, CHALLENGE_TAX]
-            elif opp_player.last_action == EXCHANGE:
-                return [PASS_EXCHANGE, CHALLENGE_EXCHANGE]
-            elif opp_player.last_action == STEAL:
-                return [PASS_STEAL, BLOCK_STEAL, CHALLENGE_STEAL]
-            elif opp_player.last_action in [ASSASSINATE, COUP]:
-                valid = valid_lose_card_options()
-
-                if opp_player.last_action == ASSASSINATE:
-                    valid += [BLOCK_ASSASSINATE, CHALLENGE_ASSASSINATE]
-
-                return valid
-            else:
-                raise RuntimeError('Invalid action progression')
-
+            phase = PHASE_RESPOND
         elif curr_player.last_action == EXCHANGE:
-            # It is curr_player's turn, and opp_player has approved the exchange
-
-            if len(curr_player.cards) < 4:
-                raise RuntimeError('Player mid-exchange should have 4 cards including any eliminated')
-            
-            valid = [EXCHANGE_RETURN_34]
-            if not curr_player.cards[0].is_face_up:
-                valid += [EXCHANGE_RETURN_13, EXCHANGE_RETURN_14]
-            if not curr_player.cards[1].is_face_up:
-                valid += [EXCHANGE_RETURN_23, EXCHANGE_RETURN_24]
-            if (not curr_player.cards[0].is_face_up and
-                not curr_player.cards[1].is_face_up):
-                valid += [EXCHANGE_RETURN_12]
-
-            return valid
-
-        elif opp_player.last_action == BLOCK_FA:
-            # It is curr_player's turn and opp_player wants to block their move
-            return [PASS_FA_BLOCK, CHALLENGE_FA_BLOCK]
-        elif opp_player.last_action == BLOCK_ASSASSINATE:
-            # It is curr_player's turn and opp_player wants to block their move
-            return [PASS_ASSASSINATE_BLOCK, CHALLENGE_ASSASSINATE_BLOCK]
-        elif opp_player.last_action == BLOCK_STEAL:
-            # It is curr_player's turn and opp_player wants to block their move
-            return [PASS_STEAL_BLOCK, CHALLENGE_STEAL_BLOCK]
-        
+            phase = PHASE_EXCHANGE
         else:
-            raise RuntimeError('Invalid action progression')
+            phase = PHASE_BLOCKED
+
+        cards = curr_player.cards
+        return decision_context(phase,
+                                opp_player.last_action,
+                                COIN_BUCKETS[min(curr_player._coins, 10)],
+                                opp_player._coins > 0,
+                                not cards[0]._is_face_up,
+                                not cards[1]._is_face_up,
+                                len(cards) == 4)
+
+    def get_valid_actions(self):
+        valid = VALID_ACTIONS[self.get_decision_context()]
+        if valid.__class__ is str:
+            raise RuntimeError(valid)
+        return list(valid)
 
+    def get_action_mask(self):
+        '''
+        Return the valid actions as a read-only np.bool_ mask of length 32
+        '''
+        key = self.get_decision_context()
+        if VALID_ACTIONS[key].__class__ is str:
+            raise RuntimeError(VALID_ACTIONS[key])
+        return ACTION_MASKS[key]
+
+    def _set_last_action(self, action):
+        p = self.players[self.whose_action]
+        keys = ZOBRIST_LAST_ACTION[p.id]
+        p._hash ^= keys[p.last_action] ^ keys[action]
+        p.last_action = action
+        p._own_obs[18] = p._opp_obs[19] = action
+
+    def _set_lost_challenge(self, p, val):
+        if p.lost_challenge != val:
+            p._hash ^= ZOBRIST_LOST_CHALLENGE[p.id]
+            p.lost_challenge = val
+
+    def _set_game_over(self, val):
+        if self.game_over != val:
+            self._hash ^= ZOBRIST_GAME_OVER
+            self.game_over = val
 
     def income(self):
         curr_player = self.get_curr_action_player()
         curr_player.add_coins(1)
-        curr_player.last_action = INCOME
+        self._set_last_action(INCOME)
         self.next_player_turn()
 
     def foreign_aid(self):
         if self.is_turn_begin:
             # Before allowing the action to take effect, the opponent must not block it
-            self.get_curr_action_player().last_action = FOREIGN_AID
+            self._set_last_action(FOREIGN_AID)
             self.next_player_action()
         else:
             # PASS: Opponent did not block, so complete the action
@@ -358,17 +909,17 @@ class Game:
 
     def coup(self):
         curr_player = self.get_curr_action_player()
-        if curr_player.coins < 7:
+        if curr_player._coins < 7:
             raise RuntimeError('Not possible to coup with < 7 coins')
 
         curr_player.remove_coins(7)
-        curr_player.last_action = COUP
+        self._set_last_action(COUP)
         self.next_player_action()
 
     def tax(self):
         if self.is_turn_begin:
             # Before allowing the action to take effect, the opponent must not challenge it
-            self.get_curr_action_player().last_action = TAX
+            self._set_last_action(TAX)
             self.next_player_action()
         else:
             # PASS: Opponent did not challenge, so complete the action
@@ -377,7 +928,7 @@ class Game:
 
     def assassinate(self):
         curr_player = self.get_curr_action_player()
-        curr_player.last_action = ASSASSINATE
+        self._set_last_action(ASSASSINATE)
         # Pay the coins whether or not the action is blocked/challenged
         curr_player.remove_coins(3)
         self.next_player_action()
@@ -385,7 +936,7 @@ class Game:
     def exchange(self):
         if self.is_turn_begin:
             # Before drawing the 2 cards from the deck, the opponent must not challenge it
-            self.get_curr_action_player().last_action = EXCHANGE
+            self._set_last_action(EXCHANGE)
             self.next_player_action()
         else:
             # PASS: Opponent did not challenge, so draw 2 cards
@@ -399,7 +950,7 @@ class Game:
     def _exchange_return(self, lst):
         curr_player = self.get_curr_action_player()
         for ind in sorted(lst, reverse=True):
-            self.deck.append(curr_player.cards.pop(ind))
+            self._return_card(curr_player.cards.pop(ind))
         self.shuffle_deck()
         curr_player._sort_cards()
 
@@ -410,40 +961,40 @@ class Game:
             self.next_player_turn()
 
     def exchange_return_12(self):
-        self.get_curr_action_player().last_action = EXCHANGE_RETURN_12
+        self._set_last_action(EXCHANGE_RETURN_12)
         self._exchange_return([0, 1])
 
     def exchange_return_13(self):
-        self.get_curr_action_player().last_action = EXCHANGE_RETURN_13
+        self._set_last_action(EXCHANGE_RETURN_13)
         self._exchange_return([0, 2])
 
     def exchange_return_14(self):
-        self.get_curr_action_player().last_action = EXCHANGE_RETURN_14
+        self._set_last_action(EXCHANGE_RETURN_14)
         self._exchange_return([0, 3])
 
     def exchange_return_23(self):
-        self.get_curr_action_player().last_action = EXCHANGE_RETURN_23
+        self._set_last_action(EXCHANGE_RETURN_23)
         self._exchange_return([1, 2])
 
     def exchange_return_24(self):
-        self.get_curr_action_player().last_action = EXCHANGE_RETURN_24
+        self._set_last_action(EXCHANGE_RETURN_24)
         self._exchange_return([1, 3])
 
     def exchange_return_34(self):
-        self.get_curr_action_player().last_action = EXCHANGE_RETURN_34
+        self._set_last_action(EXCHANGE_RETURN_34)
         self._exchange_return([2, 3])
 
     def steal(self):
         if self.is_turn_begin:
             # Before allowing the action to take effect, the opponent must not block or challenge
-            self.get_curr_action_player().last_action = STEAL
+            self._set_last_action(STEAL)
             self.next_player_action()
         else:
             # PASS: Opponent did not challenge, so complete the action
             curr_player = self.get_curr_action_player()
             opp_player = self.get_opp_player()
 
-            num_steal = 2 if opp_player.coins >= 2 else 1
+            num_steal = 2 if opp_player._coins >= 2 else 1
             opp_player.remove_coins(num_steal)
             curr_player.add_coins(num_steal)
             self.next_player_turn()
@@ -452,50 +1003,50 @@ class Game:
         # Complete the opponent's action
         act = self.get_opp_player().last_action
         self.next_player_action()
-        getattr(self, CoupEnv.actions[act])()
+        self._action_handlers[act](self)
 
     def _pass_block(self):
         # Block succeeds, so nothing to do. Next turn.
         self.next_player_turn()
 
     def pass_fa(self):
-        self.get_curr_action_player().last_action = PASS_FA
+        self._set_last_action(PASS_FA)
         self._pass()
 
     def pass_fa_block(self):
-        self.get_curr_action_player().last_action = PASS_FA_BLOCK
+        self._set_last_action(PASS_FA_BLOCK)
         self._pass_block()
 
     def pass_tax(self):
-        self.get_curr_action_player().last_action = PASS_TAX
+        self._set_last_action(PASS_TAX)
         self._pass()
 
     def pass_exchange(self):
-        self.get_curr_action_player().last_action = PASS_EXCHANGE
+        self._set_last_action(PASS_EXCHANGE)
         self._pass()
 
     def pass_assassinate_block(self):
-        self.get_curr_action_player().last_action = PASS_ASSASSINATE_BLOCK
+        self._set_last_action(PASS_ASSASSINATE_BLOCK)
         self._pass_block()
 
     def pass_steal(self):
-        self.get_curr_action_player().last_action = PASS_STEAL
+        self._set_last_action(PASS_STEAL)
         self._pass()
 
     def pass_steal_block(self):
-        self.get_curr_action_player().last_action = PASS_STEAL_BLOCK
+        self._set_last_action(PASS_STEAL_BLOCK)
         self._pass_block()
 
     def block_fa(self):
-        self.get_curr_action_player().last_action = BLOCK_FA
+        self._set_last_action(BLOCK_FA)
         self.next_player_action()
 
     def block_assassinate(self):
-        self.get_curr_action_player().last_action = BLOCK_ASSASSINATE
+        self._set_last_action(BLOCK_ASSASSINATE)
         self.next_player_action()
 
     def block_steal(self):
-        self.get_curr_action_player().last_action = BLOCK_STEAL
+        self._set_last_action(BLOCK_STEAL)
         self.next_player_action()
 
     # Challenge:
@@ -506,16 +1057,16 @@ class Game:
     def challenge_fa_block(self):
         curr_player = self.get_curr_action_player()
         opp_player = self.get_opp_player()
-        curr_player.last_action = CHALLENGE_FA_BLOCK
+        self._set_last_action(CHALLENGE_FA_BLOCK)
 
         if opp_player.has_face_down_card(DUKE):
-            curr_player.lost_challenge = True
+            self._set_lost_challenge(curr_player, True)
             # Replace the revealed card
             self._challenge_fail_replace_card(DUKE)
             # curr_player must lose a card
             # It is still their action
         else:
-            opp_player.lost_challenge = True
+            self._set_lost_challenge(opp_player, True)
 
             # Block failed, so complete the action
             curr_player.add_coins(2)
@@ -526,10 +1077,10 @@ class Game:
     def challenge_tax(self):
         curr_player = self.get_curr_action_player()
         opp_player = self.get_opp_player()
-        curr_player.last_action = CHALLENGE_TAX
+        self._set_last_action(CHALLENGE_TAX)
 
         if opp_player.has_face_down_card(DUKE):
-            curr_player.lost_challenge = True
+            self._set_lost_challenge(curr_player, True)
             # Replace the revealed card
             self._challenge_fail_replace_card(DUKE)
 
@@ -539,17 +1090,17 @@ class Game:
             # curr_player must lose a card
             # It is still their action
         else:
-            opp_player.lost_challenge = True
+            self._set_lost_challenge(opp_player, True)
             # opp_player must lose a card
             self.next_player_action()
 
     def challenge_exchange(self):
         curr_player = self.get_curr_action_player()
         opp_player = self.get_opp_player()
-        curr_player.last_action = CHALLENGE_EXCHANGE
+        self._set_last_action(CHALLENGE_EXCHANGE)
 
         if opp_player.has_face_down_card(AMBASSADOR):
-            curr_player.lost_challenge = True
+            self._set_lost_challenge(curr_player, True)
             # Replace the revealed card
             self._challenge_fail_replace_card(AMBASSADOR)
 
@@ -560,25 +1111,26 @@ class Game:
             # curr_player must lose a card
             # After _exchange_return is called it will switch to their action
         else:
-            opp_player.lost_challenge = True
+            self._set_lost_challenge(opp_player, True)
             # opp_player must lose a card
             self.next_player_action()
 
     def challenge_assassinate(self):
         curr_player = self.get_curr_action_player()
         opp_player = self.get_opp_player()
-        curr_player.last_action = CHALLENGE_ASSASSINATE
+        self._set_last_action(CHALLENGE_ASSASSINATE)
 
         if opp_player.has_face_down_card(ASSASSIN):
             # curr_player loses the game
             # Lose 1 card for assassination
             # and 1 card for losing challenge
-            curr_player.cards[0].is_face_up = True
-            curr_player.cards[1].is_face_up = True
-            self.game_over = True
+            curr_player.cards[0]._is_face_up = True
+            curr_player.cards[1]._is_face_up = True
+            curr_player._update_cards()
+            self._set_game_over(True)
             logger.info('Game Over')
         else:
-            opp_player.lost_challenge = True
+            self._set_lost_challenge(opp_player, True)
 
             # Coins spent are returned in this one case
             opp_player.add_coins(3)
@@ -589,10 +1141,10 @@ class Game:
     def challenge_assassinate_block(self):
         curr_player = self.get_curr_action_player()
         opp_player = self.get_opp_player()
-        curr_player.last_action = CHALLENGE_ASSASSINATE_BLOCK
+        self._set_last_action(CHALLENGE_ASSASSINATE_BLOCK)
 
         if opp_player.has_face_down_card(CONTESSA):
-            curr_player.lost_challenge = True
+            self._set_lost_challenge(curr_player, True)
             # Replace the revealed card
             self._challenge_fail_replace_card(CONTESSA)
             # curr_player must lose a card
@@ -601,54 +1153,55 @@ class Game:
             # opp_player loses the game
             # Lose 1 card for assassination
             # and 1 card for losing challenge
-            opp_player.cards[0].is_face_up = True
-            opp_player.cards[1].is_face_up = True
-            self.game_over = True
+            opp_player.cards[0]._is_face_up = True
+            opp_player.cards[1]._is_face_up = True
+            opp_player._update_cards()
+            self._set_game_over(True)
             logger.info('Game Over')
 
     def challenge_steal(self):
         curr_player = self.get_curr_action_player()
         opp_player = self.get_opp_player()
-        curr_player.last_action = CHALLENGE_STEAL
+        self._set_last_action(CHALLENGE_STEAL)
 
         if opp_player.has_face_down_card(CAPTAIN):
-            curr_player.lost_challenge = True
+            self._set_lost_challenge(curr_player, True)
             # Replace the revealed card
             self._challenge_fail_replace_card(CAPTAIN)
 
             # Complete the action
-            num_steal = 2 if curr_player.coins >= 2 else 1
+            num_steal = 2 if curr_player._coins >= 2 else 1
             curr_player.remove_coins(num_steal)
             opp_player.add_coins(num_steal)
             # curr_player must lose a card
             # It is still their action
         else:
-            opp_player.lost_challenge = True
+            self._set_lost_challenge(opp_player, True)
             # opp_player must lose a card
             self.next_player_action()
 
     def challenge_steal_block(self):
         curr_player = self.get_curr_action_player()
         opp_player = self.get_opp_player()
-        curr_player.last_action = CHALLENGE_STEAL_BLOCK
+        self._set_last_action(CHALLENGE_STEAL_BLOCK)
 
         if opp_player.has_face_down_card(CAPTAIN):
-            curr_player.lost_challenge = True
+            self._set_lost_challenge(curr_player, True)
             # Replace the revealed card
             self._challenge_fail_replace_card(CAPTAIN)
             # curr_player must lose a card
             # It is still their action
         elif opp_player.has_face_down_card(AMBASSADOR):
-            curr_player.lost_challenge = True
+            self._set_lost_challenge(curr_player, True)
             # Replace the revealed card
             self._challenge_fail_replace_card(AMBASSADOR)
             # curr_player must lose a card
             # It is still their action
         else:
-            opp_player.lost_challenge = True
+            self._set_lost_challenge(opp_player, True)
 
             # Block failed, so complete the action
-            num_steal = 2 if opp_player.coins >= 2 else 1
+            num_steal = 2 if opp_player._coins >= 2 else 1
             opp_player.remove_coins(num_steal)
             curr_player.add_coins(num_steal)
 
@@ -658,12 +1211,13 @@ class Game:
     def _challenge_fail_replace_card(self, card_val):
         # If the challenged player actually had the correct card,
         # shuffle it into the deck and give them a new card
-        logger.info(f'Showing and replacing card {Card.names[card_val]}')
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(f'Showing and replacing card {Card.names[card_val]}')
         p = self.get_opp_player()
         for i in range(len(p.cards)):
             c = p.cards[i]
             if c.val == card_val and not c.is_face_up:
-                self.deck.append(c)
+                self._return_card(c)
                 self.shuffle_deck()
                 p.cards[i] = self.draw_card()
                 p._sort_cards()
@@ -676,12 +1230,12 @@ class Game:
         if curr_player.cards[card_ind].is_face_up:
             raise RuntimeError(f'Cannot lose a card that is already face up')
 
-        curr_player.cards[card_ind].is_face_up = True
-        curr_player.lost_challenge = False
+        curr_player.cards[card_ind]._is_face_up = True
+        self._set_lost_challenge(curr_player, False)
         curr_player._sort_cards()
 
         # Check if the player has no cards remaining
-        self.game_over = not (False in [x.is_face_up for x in curr_player.cards])
+        self._set_game_over(not (False in [x._is_face_up for x in curr_player.cards]))
 
         if self.game_over:
             logger.info('Game Over')
@@ -689,11 +1243,11 @@ class Game:
         self.next_player_turn()
 
     def lose_card_1(self):
-        self.get_curr_action_player().last_action = LOSE_CARD_1
+        self._set_last_action(LOSE_CARD_1)
         self._lose_card(0)
 
     def lose_card_2(self):
-        self.get_curr_action_player().last_action = LOSE_CARD_2
+        self._set_last_action(LOSE_CARD_2)
         self._lose_card(1)
 
 
@@ -740,16 +1294,80 @@ class CoupEnv(gym.Env):
         31: 'exchange_return_34'  # return cards 3,4
     }
 
-    def __init__(self, num_human_players=0, p_first_turn=0, is_partial_obs=True):
+    invariant_modes = ['off', 'sampled', 'full']
+
+    def __init__(self, num_human_players=0, p_first_turn=0, is_partial_obs=True, compact_state=False,
+                 count_deck=False, kernel=False, auto_forced_moves=False,
+                 check_invariants='full', invariant_sample_rate=0.01, log=True, profile=False):
         '''
-        num_human_players: Number of human players in the 2-player game
-        p_first_turn:      Which player goes first, 0-indexed
-        is_partial_obs:    Whether the game is partially observable
-                           (true in real life where cards are hidden from opponent)
+        num_human_players:     Number of human players in the 2-player game
+        p_first_turn:          Which player goes first, 0-indexed
+        is_partial_obs:        Whether the game is partially observable
+                               (true in real life where cards are hidden from opponent)
+        compact_state:         Whether to store the game in a single int8 array (CompactGame)
+                               instead of Card/Player objects
+        count_deck:            Whether to store the deck as counts of each card (CountDeckGame)
+                               and draw from them, instead of shuffling a list of Cards.
+                               Not supported with compact_state or kernel
+        kernel:                Whether to take actions with the functional kernel,
+                               step_kernel, on the flat state (KernelGame)
+        auto_forced_moves:     Whether step() takes the action of every decision point with
+                               only one valid action, ex: [COUP] with 10 coins, so a player
+                               always has a choice when it returns. See forced_actions
+        check_invariants:      When to check Game.check_invariants() after a step
+                               'full':    Every step
+                               'sampled': Every n-th step, see invariant_sample_rate
+                               'off':     Never
+        invariant_sample_rate: Fraction of steps checked in 'sampled' mode, in (0, 1].
+                               Every round(1 / rate)-th step is checked on a fixed
+                               schedule, not a random fraction of steps
+        log:                   Whether the env logs debug info. When False,
+                               no log messages are built at all
+        profile:               Whether to record call counts and time of each action
+                               handler and hot helper in self.profiler, see Profiler
         '''
         self.num_human_players = num_human_players
         self.p_first_turn = p_first_turn
         self.is_partial_obs = is_partial_obs
+        self.log = log
+        self.auto_forced_moves = auto_forced_moves
+        # [(player, action)] taken by the last step in auto_forced_moves mode
+        self.forced_actions = []
+        # Each env has its own RNG, seeded with reset(seed=...)
+        self.rng = random.Random()
+
+        if check_invariants not in self.invariant_modes:
+            raise ValueError(f'check_invariants must be one of {self.invariant_modes}, got {check_invariants!r}')
+        self.check_invariants = check_invariants
+        # Check every n steps, 0 = never
+        if check_invariants == 'full':
+            self._check_interval = 1
+        elif check_invariants == 'sampled':
+            if not 0 < invariant_sample_rate <= 1:
+                raise ValueError(f'invariant_sample_rate must be in (0, 1], got {invariant_sample_rate!r}')
+            self._check_interval = max(1, round(1 / invariant_sample_rate))
+        else:
+            self._check_interval = 0
+        self._num_steps = 0
+
+        if count_deck and (compact_state or kernel):
+            raise ValueError('count_deck is not supported with compact_state or kernel')
+        if kernel:
+            from gym_coup.envs.kernel import KernelGame
+            self.game_cls = KernelGame
+        elif compact_state:
+            from gym_coup.envs.compact_game import CompactGame
+            self.game_cls = CompactGame
+        elif count_deck:
+            from gym_coup.envs.count_deck_game import CountDeckGame
+            self.game_cls = CountDeckGame
+        else:
+            self.game_cls = Game
+        self.profiler = None
+        if profile:
+            from gym_coup.envs.profiling import Profiler
+            self.profiler = Profiler()
+            self.game_cls = self.profiler.instrument(self.game_cls)
         self.game = None
         self.cumulative_rewards = None
 
@@ -783,11 +1401,21 @@ class CoupEnv(gym.Env):
         high = np.array([4, 4, 4, 4, 4, 4, 4, 4, 1, 1, 1, 1, 1, 1, 1, 1, 12, 12, 31, 31, 1], dtype='int8')
         self.observation_space = gym.spaces.Box(low, high, dtype='int8')
 
-    def step(self, action):
-        if isinstance(action, int):
-            action = self.actions[action]
+    def _act(self, action, forced=False):
+        '''
+        Take an action, and update the rewards
+
+        forced: Whether the action was the only valid one, taken by the env.
+                The player didn't act, so their cumulative reward carries on
+
+        Return (whose_a, reward), who took the action and their reward
+        '''
+        if isinstance(action, (int, np.integer)):
+            if not 0 <= action < NUM_ACTIONS:
+                raise RuntimeError(f'Cannot step with action {action}')
+            handler = self.game._action_handlers[action]
         elif isinstance(action, str):
-            pass
+            handler = getattr(type(self.game), action)
         else:
             raise RuntimeError(f'Cannot step with action type {type(action)}')
 
@@ -795,22 +1423,19 @@ class CoupEnv(gym.Env):
         whose_a = self.game.whose_action
 
         # Num face up cards of each player before the action
-        num_cards_1 = [len([1 for c in p.cards if c.is_face_up]) for p in self.game.players]
-
-        getattr(self.game, action)()
+        num_cards_1 = self.game.get_num_face_up()
 
-        # Get the observation from the perspective of
-        # the player who just took the action
-        obs = self.get_obs(whose_a == 1)
-        logger.debug(f'Observation: {obs}')
+        handler(self.game)
 
         # Num face up cards of each player after the action
-        num_cards_2 = [len([1 for c in p.cards if c.is_face_up]) for p in self.game.players]
+        num_cards_2 = self.game.get_num_face_up()
 
-        if 2 in num_cards_2 and not self.game.game_over:
-            raise RuntimeError('Game over was not set when it should be')
+        self._num_steps += 1
+        if self._check_interval and self._num_steps % self._check_interval == 0:
+            self.game.check_invariants()
 
-        self.cumulative_rewards[whose_a] = 0
+        if not forced:
+            self.cumulative_rewards[whose_a] = 0
         reward = 0
         # Get number of cards lost this action by each player
         dif_curr = num_cards_2[whose_a] - num_cards_1[whose_a]
@@ -822,14 +1447,110 @@ class CoupEnv(gym.Env):
 
         self.cumulative_rewards[whose_a] += reward
         self.cumulative_rewards[1-whose_a] -= reward
+        return whose_a, reward
+
+    def _act_forced(self, whose_a, reward):
+        '''
+        Take the only valid action until a player has a choice or the game is over,
+        recording them in forced_actions
+
+        Return the reward of whose_a, including the forced actions
+        '''
+        game = self.game
+        self.forced_actions = forced = []
+        while not game.game_over:
+            valid = game.get_valid_actions()
+            if len(valid) != 1:
+                break
+            p, r = self._act(valid[0], forced=True)
+            reward += r if p == whose_a else -r
+            forced.append((p, valid[0]))
+        return reward
+
+    def step(self, action):
+        '''
+        Take an action
+
+        Return (obs, reward, done, info)
+            obs:    Observation from the view of the player who took the action
+            reward: Reward of the player who took the action
+            done:   Whether the game is over
+            info:   With auto_forced_moves, 'forced_actions' [(player, action)]
+                    taken after the action because they were the only valid one
+        '''
+        whose_a, reward = self._act(action)
+        info = dict()
+        if self.auto_forced_moves:
+            reward = self._act_forced(whose_a, reward)
+            info['forced_actions'] = self.forced_actions
 
-        logger.debug(f'Reward: {reward}')
+        # Get the observation from the perspective of
+        # the player who just took the action
+        obs = self.get_obs(whose_a == 1)
 
-        return (obs, reward, self.game.game_over, dict())
+        if self.log and logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f'Observation: {obs}')
+            logger.debug(f'Reward: {reward}')
 
-    def reset(self):
-        self.game = Game(self.num_human_players, self.p_first_turn)
+        return (obs, reward, self.game.game_over, info)
+
+    def step_fused(self, action):
+        '''
+        Take an action, and return everything the next player to act needs,
+        in place of step(), last() and get_action_mask().
+        Only the next player's observation and mask are built
+
+        Return (reward, next_player, obs, mask, done)
+            reward:      Reward of the player who took the action,
+                         including any forced_actions after it
+            next_player: Player to act next, 0 = P1
+            obs:         Observation from next_player's view
+            mask:        Valid actions of next_player, a read-only np.bool_ mask of length 32.
+                         No actions once the game is over
+            done:        Whether the game is over
+        '''
+        whose_a, reward = self._act(action)
+        if self.auto_forced_moves:
+            reward = self._act_forced(whose_a, reward)
+        game = self.game
+        p = game.whose_action
+        done = game.game_over
+        obs = self.get_obs(p2_view=p == 1)
+
+        if self.log and logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f'Observation: {obs}')
+            logger.debug(f'Reward: {reward}')
+
+        return (reward, p, obs, NO_ACTIONS_MASK if done else game.get_action_mask(), done)
+
+    def reset(self, seed=None):
+        '''
+        Start a new game
+
+        seed: Reseed the env's RNG, ex: from gym_coup.utils.spawn_seeds().
+              Otherwise the RNG continues from the previous game
+        '''
+        if seed is not None:
+            self.rng.seed(seed)
+        self.game = self.game_cls(self.num_human_players, self.p_first_turn, self.rng)
         self.cumulative_rewards = [0, 0]
+        self.forced_actions = []
+
+    def replay(self, seed, actions, checkpoint_interval=16):
+        '''
+        Re-run a game of this env's config from its seed and action log
+
+        seed:                Seed the game was reset with, reset(seed=seed)
+        actions:             Action ids passed to step(), in order. With
+                             auto_forced_moves the forced actions are taken again
+        checkpoint_interval: Steps between snapshots. Seeking to any step
+                             replays at most this many actions
+
+        Return a Replay, with the rewards and acting players of every step
+        and seek(k) to rebuild the state after k actions
+        '''
+        from gym_coup.envs.replay import Replay
+        return Replay(self, seed, actions, checkpoint_interval)
 
     def last(self):
         p = self.game.whose_action
@@ -838,6 +1559,21 @@ class CoupEnv(gym.Env):
                 self.game.game_over,
                 dict())
 
+    def clone_state(self):
+        '''
+        Return an immutable snapshot of the env, to restore with restore_state()
+        '''
+        return CoupEnvSnapshot(self.game.clone_state(), tuple(self.cumulative_rewards))
+
+    def restore_state(self, snapshot):
+        '''
+        Set the env to a snapshot from clone_state()
+        '''
+        if self.game is None:
+            self.reset()
+        self.game.restore_state(snapshot.game)
+        self.cumulative_rewards = list(snapshot.cumulative_rewards)
+
     def render(self, mode='human'):
         if self.game is not None:
             self.game.render()
@@ -850,12 +1586,22 @@ class CoupEnv(gym.Env):
             return None
 
         a = self.game.get_valid_actions()
-        logger.debug(f'Valid actions: {[self.actions[x] for x in a]}')
+        if self.log and logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f'Valid actions: {[self.actions[x] for x in a]}')
         if text:
             return [self.actions[x] for x in a]
         else:
             return a
 
+    def get_action_mask(self):
+        '''
+        Get the valid actions as a read-only np.bool_ mask of length 32
+        '''
+        if self.game is None:
+            return None
+
+        return self.game.get_action_mask()
+
     def get_obs(self, p2_view=False, text=False):
         '''
         Return the current state of the environment
@@ -888,6 +1634,9 @@ class CoupEnv(gym.Env):
         Note: many observations will never occur in game
               ex: All 4 cards are the same. Both players have all cards face up.
         '''
+        if self.is_partial_obs and not text:
+            return tuple(self.game.partial_obs(p2_view))
+
         p1cards, p2cards, p1coins, p2coins, p1la, p2la, wa = self.game.get_obs(p2_view=p2_view, text=text)
 
         # Partial Observability
@@ -915,3 +1664,12 @@ class CoupEnv(gym.Env):
         obs += [p1coins, p2coins, p1la, p2la, wa]
         obs = tuple(obs)
         return obs
+
+
+def _dispatch_table(cls):
+    '''
+    Action handlers of a game class, indexed by action id
+    '''
+    return tuple(getattr(cls, CoupEnv.actions[a]) for a in range(NUM_ACTIONS))
+
+Game._action_handlers = _dispatch_table(Game)
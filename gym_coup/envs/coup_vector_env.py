@@ -0,0 +1,566 @@
+import gym
+import numpy as np
+from gym_coup.envs.coup_env import *
+
+_FULL_DECK = np.array([i for _ in range(3) for i in range(len(Card.names))], dtype='int8')
+_NUM_DECK_CARDS = len(_FULL_DECK)
+
+# Sort key used for cards that are not in the hand
+NO_CARD_KEY = 127
+
+COIN_BUCKET_TABLE = np.array(COIN_BUCKETS, dtype='int32')
+
+
+class CoupVectorEnv:
+    '''
+    Batch of N 2p Coup games stepped together
+
+    All game state is held as struct-of-arrays, one row per game,
+    and every action handler operates on an array of game indices.
+    The rules are the same as Game, and the observation layout is
+    the same as CoupEnv.get_obs().
+    '''
+    def __init__(self, num_envs, p_first_turn=0, is_partial_obs=True, seed=None):
+        '''
+        num_envs:       Number of games stepped together
+        p_first_turn:   Which player goes first, 0-indexed
+        is_partial_obs: Whether the game is partially observable
+                        (true in real life where cards are hidden from opponent)
+        seed:           Seed for the env's random number generator,
+                        int or np.random.SeedSequence
+        '''
+        self.num_envs = num_envs
+        self.p_first_turn = p_first_turn
+        self.is_partial_obs = is_partial_obs
+        self.rng = np.random.default_rng(seed)
+
+        n = num_envs
+        # Cards in hand, -1 = No card. Sorted like Player._sort_cards
+        self.cards = np.full((n, 2, 4), NONE, dtype='int8')
+        # -1 = No card
+        self.face_up = np.full((n, 2, 4), NONE, dtype='int8')
+        self.coins = np.zeros((n, 2), dtype='int8')
+        self.last_action = np.full((n, 2), NONE, dtype='int8')
+        self.lost_challenge = np.zeros((n, 2), dtype=bool)
+        self.whose_turn = np.zeros(n, dtype='int8')
+        self.whose_action = np.zeros(n, dtype='int8')
+        self.is_turn_begin = np.zeros(n, dtype=bool)
+        self.game_over = np.zeros(n, dtype=bool)
+        self.turn_count = np.zeros(n, dtype='int32')
+        # Cards are drawn from the end of the deck
+        self.deck = np.zeros((n, _NUM_DECK_CARDS), dtype='int8')
+        self.deck_size = np.zeros(n, dtype='int8')
+
+        self.masks = np.zeros((n, len(CoupEnv.actions) - 1), dtype=bool)
+
+        self._handlers = [getattr(self, '_' + CoupEnv.actions[a]) for a in range(len(CoupEnv.actions) - 1)]
+        self._all = np.arange(n)
+
+        single_obs_space = CoupEnv().observation_space
+        self.single_observation_space = single_obs_space
+        self.single_action_space = gym.spaces.Discrete(len(self._handlers))
+        self.observation_space = gym.spaces.Box(np.tile(single_obs_space.low, (n, 1)),
+                                                np.tile(single_obs_space.high, (n, 1)),
+                                                dtype='int8')
+        self.action_space = gym.spaces.MultiDiscrete([len(self._handlers)] * n)
+
+    def reset(self, seed=None):
+        '''
+        Start a new game in every env
+
+        seed: Reseed the env's RNG. Otherwise the RNG continues from the previous games
+
+        Return (obs, masks) for the player to act in each game
+        '''
+        if seed is not None:
+            self.rng = np.random.default_rng(seed)
+        self._reset_envs(self._all)
+        return self._get_obs_and_masks()
+
+    def step(self, actions):
+        '''
+        Take one action in every game
+
+        actions: Array of N legal action ids, one per game
+
+        Return (obs, rewards, dones, masks, info)
+            obs:     (N, 21) observations from the perspective
+                     of the player to act next in each game
+            rewards: (N,) rewards for the player who took the action.
+                     The game is zero-sum, so the opponent gets -rewards
+            dones:   (N,) whether the action ended the game.
+                     Finished games are reset, so obs and masks
+                     already belong to the new game
+            masks:   (N, 32) legal actions of the player to act next
+            info:    'acting_player' (N,) who took each action
+                     'final_obs' (N, 21) observation of the finished game
+                     from the acting player's view, only where dones
+        '''
+        actions = np.asarray(actions)
+        if actions.shape != (self.num_envs,):
+            raise RuntimeError(f'Expected {self.num_envs} actions, got shape {actions.shape}')
+        # Negative ids would wrap around when indexing the masks
+        if ((actions < 0) | (actions >= NUM_ACTIONS)).any() or not self.masks[self._all, actions].all():
+            raise RuntimeError('Cannot step with an invalid action')
+
+        rewards, acting = self._act(self._all, actions)
+
+        dones = self.game_over.copy()
+        info = {'acting_player': acting}
+        if dones.any():
+            done_idx = np.flatnonzero(dones)
+            final_obs = np.zeros((self.num_envs, 21), dtype='int8')
+            final_obs[done_idx] = self._get_obs(done_idx, acting[done_idx])
+            info['final_obs'] = final_obs
+            self._reset_envs(done_idx)
+
+        obs, masks = self._get_obs_and_masks()
+        return obs, rewards.astype('int8'), dones, masks, info
+
+    def _act(self, idx, actions):
+        '''
+        Take actions in the games idx, without resetting the ones that finish
+
+        Return (rewards, acting) of the players who took the actions
+        '''
+        acting = self.whose_action[idx]
+        num_face_up_1 = (self.face_up[idx] == 1).sum(axis=2)
+
+        for a in np.unique(actions):
+            self._handlers[a](idx[actions == a])
+
+        num_face_up_2 = (self.face_up[idx] == 1).sum(axis=2)
+        dif = num_face_up_2 - num_face_up_1
+        rows = np.arange(len(idx))
+        # -1 if you lose a card, +1 if your opp loses a card
+        rewards = dif[rows, 1 - acting] - dif[rows, acting]
+        return rewards, acting
+
+    def get_obs(self, p2_view=None):
+        '''
+        Return the (N, 21) observations
+
+        p2_view: Per-game or scalar perspective (0/False = P1, 1/True = P2).
+                 Defaults to the player to act next in each game
+        '''
+        if p2_view is None:
+            p = self.whose_action
+        else:
+            p = np.broadcast_to(np.asarray(p2_view, dtype='int8'), (self.num_envs,))
+        return self._get_obs(self._all, p)
+
+    def get_action_mask(self):
+        '''
+        Return the (N, 32) legal actions of the player to act next
+        '''
+        return self.masks.copy()
+
+    def _get_obs_and_masks(self):
+        self._update_masks()
+        return self._get_obs(self._all, self.whose_action), self.masks.copy()
+
+    def _get_obs(self, idx, p):
+        o = 1 - p
+        obs = np.empty((len(idx), 21), dtype='int8')
+        obs[:, 0:4] = self.cards[idx, p]
+        opp_cards = self.cards[idx, o]
+        opp_face_up = self.face_up[idx, o]
+        if self.is_partial_obs:
+            # Hide value of opp face down cards
+            opp_cards = np.where(opp_face_up == 1, opp_cards, NONE)
+        obs[:, 4:8] = opp_cards
+        obs[:, 8:12] = self.face_up[idx, p]
+        obs[:, 12:16] = opp_face_up
+        obs[:, 16] = self.coins[idx, p]
+        obs[:, 17] = self.coins[idx, o]
+        obs[:, 18] = self.last_action[idx, p]
+        obs[:, 19] = self.last_action[idx, o]
+        obs[:, 20] = self.whose_action[idx]
+        return obs
+
+    def _update_masks(self):
+        '''
+        Look up the valid actions of every game by its decision_context()
+        '''
+        rows = self._all
+        cur = self.whose_action
+        opp = 1 - cur
+        cur_coins = self.coins[rows, cur]
+        cur_face_up = self.face_up[rows, cur]
+
+        phase = np.full(self.num_envs, PHASE_BLOCKED, dtype='int32')
+        phase[self.last_action[rows, cur] == EXCHANGE] = PHASE_EXCHANGE
+        phase[self.whose_turn != cur] = PHASE_RESPOND
+        phase[self.lost_challenge[rows, cur]] = PHASE_LOST_CHALLENGE
+        phase[self.is_turn_begin] = PHASE_TURN_BEGIN
+
+        keys = decision_context(phase,
+                                self.last_action[rows, opp].astype('int32'),
+                                COIN_BUCKET_TABLE[np.minimum(cur_coins, 10)],
+                                self.coins[rows, opp] > 0,
+                                cur_face_up[:, 0] == 0,
+                                cur_face_up[:, 1] == 0,
+                                cur_face_up[:, 2] != NONE)
+        self.masks = ACTION_MASKS[keys]
+
+    # Game helpers over arrays of game indices
+
+    def _reset_envs(self, idx):
+        n = len(idx)
+        self.deck[idx] = _FULL_DECK
+        self.deck_size[idx] = _NUM_DECK_CARDS
+        self._shuffle_deck(idx)
+
+        self.cards[idx] = NONE
+        self.face_up[idx] = NONE
+        for p in range(2):
+            self.cards[idx, p, 0] = self._draw_card(idx)
+            self.cards[idx, p, 1] = self._draw_card(idx)
+            self.face_up[idx, p, :2] = 0
+            self._sort_cards(idx, np.full(n, p))
+
+        first = self.p_first_turn
+        # In a 2 player game, the player going first starts with 1 coin instead of 2
+        self.coins[idx, first] = 1
+        self.coins[idx, 1 - first] = 2
+        self.last_action[idx] = NONE
+        self.lost_challenge[idx] = False
+        self.whose_turn[idx] = first
+        self.whose_action[idx] = first
+        self.is_turn_begin[idx] = True
+        self.game_over[idx] = False
+        self.turn_count[idx] = 0
+
+    def _shuffle_deck(self, idx):
+        keys = self.rng.random((len(idx), _NUM_DECK_CARDS))
+        # Keep the empty slots at the end
+        keys[np.arange(_NUM_DECK_CARDS) >= self.deck_size[idx, None]] = 2
+        order = np.argsort(keys, axis=1)
+        self.deck[idx] = np.take_along_axis(self.deck[idx], order, axis=1)
+
+    def _draw_card(self, idx):
+        self.deck_size[idx] -= 1
+        return self.deck[idx, self.deck_size[idx]]
+
+    def _return_card(self, idx, vals):
+        self.deck[idx, self.deck_size[idx]] = vals
+        self.deck_size[idx] += 1
+
+    def _sort_cards(self, idx, p):
+        cards = self.cards[idx, p]
+        face_up = self.face_up[idx, p]
+        key = np.where(cards == NONE, NO_CARD_KEY, cards * 2 + face_up)
+        order = np.argsort(key, axis=1, kind='stable')
+        self.cards[idx, p] = np.take_along_axis(cards, order, axis=1)
+        self.face_up[idx, p] = np.take_along_axis(face_up, order, axis=1)
+
+    def _next_player_turn(self, idx):
+        self.whose_turn[idx] = 1 - self.whose_turn[idx]
+        self.whose_action[idx] = self.whose_turn[idx]
+        self.turn_count[idx] += 1
+        self.is_turn_begin[idx] = True
+
+    def _next_player_action(self, idx):
+        self.whose_action[idx] = 1 - self.whose_action[idx]
+        self.is_turn_begin[idx] = False
+
+    def _set_last_action(self, idx, action):
+        self.last_action[idx, self.whose_action[idx]] = action
+
+    def _has_face_down_card(self, idx, p, card_val):
+        return ((self.cards[idx, p] == card_val) & (self.face_up[idx, p] == 0)).any(axis=1)
+
+    def _steal_coins(self, idx, thief, victim):
+        num_steal = np.where(self.coins[idx, victim] >= 2, 2, 1)
+        self.coins[idx, victim] -= num_steal
+        self.coins[idx, thief] += num_steal
+
+    def _challenge_fail_replace_card(self, idx, card_val):
+        # If the challenged player actually had the correct card,
+        # shuffle it into the deck and give them a new card
+        p = 1 - self.whose_action[idx]
+        hand = self.cards[idx, p]
+        pos = ((hand == card_val) & (self.face_up[idx, p] == 0)).argmax(axis=1)
+        self._return_card(idx, card_val)
+        self._shuffle_deck(idx)
+        self.cards[idx, p, pos] = self._draw_card(idx)
+        self._sort_cards(idx, p)
+
+    def _reveal_all(self, idx, p):
+        # Lose both cards, ending the game
+        self.face_up[idx, p, 0] = 1
+        self.face_up[idx, p, 1] = 1
+        self.game_over[idx] = True
+
+    def _lose_card(self, idx, card_ind):
+        p = self.whose_action[idx]
+        self.face_up[idx, p, card_ind] = 1
+        self.lost_challenge[idx, p] = False
+        self._sort_cards(idx, p)
+
+        # Check if the player has no cards remaining
+        hand_face_up = self.face_up[idx, p]
+        self.game_over[idx] = ((hand_face_up == 1) | (hand_face_up == NONE)).all(axis=1)
+        self._next_player_turn(idx)
+
+    def _exchange_return(self, idx, keep, ret):
+        p = self.whose_action[idx]
+        hand = self.cards[idx, p]
+        face_up = self.face_up[idx, p]
+        for i in ret:
+            self._return_card(idx, hand[:, i])
+        self.cards[idx, p, :2] = hand[:, keep]
+        self.face_up[idx, p, :2] = face_up[:, keep]
+        self.cards[idx, p, 2:] = NONE
+        self.face_up[idx, p, 2:] = NONE
+        self._shuffle_deck(idx)
+        self._sort_cards(idx, p)
+
+        # opp still needs to choose a card to lose
+        opp_lost = self.lost_challenge[idx, 1 - p]
+        self._next_player_action(idx[opp_lost])
+        self._next_player_turn(idx[~opp_lost])
+
+    # Action completion once the opponent passes or loses the challenge
+
+    def _complete_foreign_aid(self, idx):
+        self.coins[idx, self.whose_action[idx]] += 2
+        self._next_player_turn(idx)
+
+    def _complete_tax(self, idx):
+        self.coins[idx, self.whose_action[idx]] += 3
+        self._next_player_turn(idx)
+
+    def _complete_exchange(self, idx):
+        p = self.whose_action[idx]
+        self.cards[idx, p, 2] = self._draw_card(idx)
+        self.cards[idx, p, 3] = self._draw_card(idx)
+        self.face_up[idx, p, 2:] = 0
+
+    def _complete_steal(self, idx):
+        p = self.whose_action[idx]
+        self._steal_coins(idx, p, 1 - p)
+        self._next_player_turn(idx)
+
+    # Action handlers, indexed by action id
+
+    def _income(self, idx):
+        self.coins[idx, self.whose_action[idx]] += 1
+        self._set_last_action(idx, INCOME)
+        self._next_player_turn(idx)
+
+    def _foreign_aid(self, idx):
+        self._set_last_action(idx, FOREIGN_AID)
+        self._next_player_action(idx)
+
+    def _coup(self, idx):
+        self.coins[idx, self.whose_action[idx]] -= 7
+        self._set_last_action(idx, COUP)
+        self._next_player_action(idx)
+
+    def _tax(self, idx):
+        self._set_last_action(idx, TAX)
+        self._next_player_action(idx)
+
+    def _assassinate(self, idx):
+        self._set_last_action(idx, ASSASSINATE)
+        # Pay the coins whether or not the action is blocked/challenged
+        self.coins[idx, self.whose_action[idx]] -= 3
+        self._next_player_action(idx)
+
+    def _exchange(self, idx):
+        self._set_last_action(idx, EXCHANGE)
+        self._next_player_action(idx)
+
+    def _steal(self, idx):
+        self._set_last_action(idx, STEAL)
+        self._next_player_action(idx)
+
+    def _lose_card_1(self, idx):
+        self._set_last_action(idx, LOSE_CARD_1)
+        self._lose_card(idx, 0)
+
+    def _lose_card_2(self, idx):
+        self._set_last_action(idx, LOSE_CARD_2)
+        self._lose_card(idx, 1)
+
+    def _pass_fa(self, idx):
+        self._set_last_action(idx, PASS_FA)
+        self._next_player_action(idx)
+        self._complete_foreign_aid(idx)
+
+    def _pass_fa_block(self, idx):
+        self._set_last_action(idx, PASS_FA_BLOCK)
+        self._next_player_turn(idx)
+
+    def _pass_tax(self, idx):
+        self._set_last_action(idx, PASS_TAX)
+        self._next_player_action(idx)
+        self._complete_tax(idx)
+
+    def _pass_exchange(self, idx):
+        self._set_last_action(idx, PASS_EXCHANGE)
+        self._next_player_action(idx)
+        self._complete_exchange(idx)
+
+    def _pass_assassinate_block(self, idx):
+        self._set_last_action(idx, PASS_ASSASSINATE_BLOCK)
+        self._next_player_turn(idx)
+
+    def _pass_steal(self, idx):
+        self._set_last_action(idx, PASS_STEAL)
+        self._next_player_action(idx)
+        self._complete_steal(idx)
+
+    def _pass_steal_block(self, idx):
+        self._set_last_action(idx, PASS_STEAL_BLOCK)
+        self._next_player_turn(idx)
+
+    def _block_fa(self, idx):
+        self._set_last_action(idx, BLOCK_FA)
+        self._next_player_action(idx)
+
+    def _block_assassinate(self, idx):
+        self._set_last_action(idx, BLOCK_ASSASSINATE)
+        self._next_player_action(idx)
+
+    def _block_steal(self, idx):
+        self._set_last_action(idx, BLOCK_STEAL)
+        self._next_player_action(idx)
+
+    # Challenge:
+    # Check if opp_player has the required card
+    # If they do, curr_player loses a card
+    # If they don't, opp_player loses a card
+
+    def _challenge_fa_block(self, idx):
+        self._set_last_action(idx, CHALLENGE_FA_BLOCK)
+        cur = self.whose_action[idx]
+        has = self._has_face_down_card(idx, 1 - cur, DUKE)
+
+        s = idx[has]
+        self.lost_challenge[s, self.whose_action[s]] = True
+        self._challenge_fail_replace_card(s, DUKE)
+
+        f = idx[~has]
+        cur = self.whose_action[f]
+        self.lost_challenge[f, 1 - cur] = True
+        # Block failed, so complete the action
+        self.coins[f, cur] += 2
+        self._next_player_action(f)
+
+    def _challenge_tax(self, idx):
+        self._set_last_action(idx, CHALLENGE_TAX)
+        cur = self.whose_action[idx]
+        has = self._has_face_down_card(idx, 1 - cur, DUKE)
+
+        s = idx[has]
+        cur = self.whose_action[s]
+        self.lost_challenge[s, cur] = True
+        self._challenge_fail_replace_card(s, DUKE)
+        self.coins[s, 1 - cur] += 3
+
+        f = idx[~has]
+        self.lost_challenge[f, 1 - self.whose_action[f]] = True
+        self._next_player_action(f)
+
+    def _challenge_exchange(self, idx):
+        self._set_last_action(idx, CHALLENGE_EXCHANGE)
+        cur = self.whose_action[idx]
+        has = self._has_face_down_card(idx, 1 - cur, AMBASSADOR)
+
+        s = idx[has]
+        self.lost_challenge[s, self.whose_action[s]] = True
+        self._challenge_fail_replace_card(s, AMBASSADOR)
+        self._next_player_action(s)
+        self._complete_exchange(s)
+
+        f = idx[~has]
+        self.lost_challenge[f, 1 - self.whose_action[f]] = True
+        self._next_player_action(f)
+
+    def _challenge_assassinate(self, idx):
+        self._set_last_action(idx, CHALLENGE_ASSASSINATE)
+        cur = self.whose_action[idx]
+        has = self._has_face_down_card(idx, 1 - cur, ASSASSIN)
+
+        # curr_player loses both cards and the game
+        s = idx[has]
+        self._reveal_all(s, self.whose_action[s])
+
+        f = idx[~has]
+        opp = 1 - self.whose_action[f]
+        self.lost_challenge[f, opp] = True
+        # Coins spent are returned in this one case
+        self.coins[f, opp] += 3
+        self._next_player_action(f)
+
+    def _challenge_assassinate_block(self, idx):
+        self._set_last_action(idx, CHALLENGE_ASSASSINATE_BLOCK)
+        cur = self.whose_action[idx]
+        has = self._has_face_down_card(idx, 1 - cur, CONTESSA)
+
+        s = idx[has]
+        self.lost_challenge[s, self.whose_action[s]] = True
+        self._challenge_fail_replace_card(s, CONTESSA)
+
+        # opp_player loses both cards and the game
+        f = idx[~has]
+        self._reveal_all(f, 1 - self.whose_action[f])
+
+    def _challenge_steal(self, idx):
+        self._set_last_action(idx, CHALLENGE_STEAL)
+        cur = self.whose_action[idx]
+        has = self._has_face_down_card(idx, 1 - cur, CAPTAIN)
+
+        s = idx[has]
+        cur = self.whose_action[s]
+        self.lost_challenge[s, cur] = True
+        self._challenge_fail_replace_card(s, CAPTAIN)
+        self._steal_coins(s, 1 - cur, cur)
+
+        f = idx[~has]
+        self.lost_challenge[f, 1 - self.whose_action[f]] = True
+        self._next_player_action(f)
+
+    def _challenge_steal_block(self, idx):
+        self._set_last_action(idx, CHALLENGE_STEAL_BLOCK)
+        opp = 1 - self.whose_action[idx]
+        has_cap = self._has_face_down_card(idx, opp, CAPTAIN)
+        has_amb = ~has_cap & self._has_face_down_card(idx, opp, AMBASSADOR)
+
+        for has, card_val in [(has_cap, CAPTAIN), (has_amb, AMBASSADOR)]:
+            s = idx[has]
+            self.lost_challenge[s, self.whose_action[s]] = True
+            self._challenge_fail_replace_card(s, card_val)
+
+        f = idx[~(has_cap | has_amb)]
+        cur = self.whose_action[f]
+        self.lost_challenge[f, 1 - cur] = True
+        # Block failed, so complete the action
+        self._steal_coins(f, cur, 1 - cur)
+        self._next_player_action(f)
+
+    def _exchange_return_12(self, idx):
+        self._set_last_action(idx, EXCHANGE_RETURN_12)
+        self._exchange_return(idx, [2, 3], [0, 1])
+
+    def _exchange_return_13(self, idx):
+        self._set_last_action(idx, EXCHANGE_RETURN_13)
+        self._exchange_return(idx, [1, 3], [0, 2])
+
+    def _exchange_return_14(self, idx):
+        self._set_last_action(idx, EXCHANGE_RETURN_14)
+        self._exchange_return(idx, [1, 2], [0, 3])
+
+    def _exchange_return_23(self, idx):
+        self._set_last_action(idx, EXCHANGE_RETURN_23)
+        self._exchange_return(idx, [0, 3], [1, 2])
+
+    def _exchange_return_24(self, idx):
+        self._set_last_action(idx, EXCHANGE_RETURN_24)
+        self._exchange_return(idx, [0, 2], [1, 3])
+
+    def _exchange_return_34(self, idx):
+        self._set_last_action(idx, EXCHANGE_RETURN_34)
+        self._exchange_return(idx, [0, 1], [2, 3])
@@ -0,0 +1,165 @@
+import numpy as np
+from gym_coup.envs.coup_env import *
+
+# Actions that start a turn and wait for the opponent to respond
+_RESPONDED_ACTIONS = (FOREIGN_AID, COUP, TAX, ASSASSINATE, EXCHANGE, STEAL)
+_PASSES = (PASS_FA, PASS_TAX, PASS_STEAL)
+_BLOCKS = (BLOCK_FA, BLOCK_ASSASSINATE, BLOCK_STEAL)
+_BLOCK_CHALLENGES = (CHALLENGE_FA_BLOCK, CHALLENGE_ASSASSINATE_BLOCK, CHALLENGE_STEAL_BLOCK)
+_EXCHANGE_RETURNS = (EXCHANGE_RETURN_12, EXCHANGE_RETURN_13, EXCHANGE_RETURN_14,
+                     EXCHANGE_RETURN_23, EXCHANGE_RETURN_24, EXCHANGE_RETURN_34)
+
+
+def turn_flags(whose_action, last_actions, num_cards, is_turn_begin=None):
+    '''
+    Work out the turn state that an observation leaves out
+    from the last actions of both players
+
+    whose_action:  Player choosing the next action
+    last_actions:  Last action of each player
+    num_cards:     Number of cards in hand of each player
+    is_turn_begin: Only needed when the player choosing lost a card last
+                   and the opponent's last action awaits a response,
+                   ex: P1 coups, P2 loses a card, and it is P2's turn,
+                   vs P2 loses a card ending P2's turn, P1 coups, and P2 must respond.
+                   Both look the same, so ValueError is raised if it isn't given
+
+    Return (whose_turn, is_turn_begin, lost challenge of each player)
+    '''
+    w = whose_action
+    o = 1 - w
+    a, b = last_actions[w], last_actions[o]
+
+    def lost_challenge(p):
+        return [p == 0, p == 1]
+
+    if num_cards[w] == 4:
+        # Choosing cards to return. The opponent may have lost a challenge of the exchange
+        return w, False, lost_challenge(o if b == CHALLENGE_EXCHANGE else None)
+    if b in _RESPONDED_ACTIONS:
+        if a in _PASSES:
+            # Passed, so the opponent's action completed and the turn ended
+            return w, True, lost_challenge(None)
+        if a in (CHALLENGE_TAX, CHALLENGE_STEAL):
+            return o, False, lost_challenge(w)
+        if a == CHALLENGE_ASSASSINATE:
+            # Lost the challenge and the game
+            return o, False, lost_challenge(None)
+        if a in (LOSE_CARD_1, LOSE_CARD_2):
+            if is_turn_begin is None:
+                raise ValueError('Observation can be the start of a turn or a response, pass is_turn_begin')
+            if is_turn_begin:
+                return w, True, lost_challenge(None)
+        # Respond to the opponent's action
+        return o, False, lost_challenge(None)
+    if b in _BLOCKS:
+        return w, False, lost_challenge(w if a in _BLOCK_CHALLENGES else None)
+    if b in (CHALLENGE_FA_BLOCK, CHALLENGE_STEAL_BLOCK) and a in _BLOCKS:
+        # The opponent challenged a block, and it was a bluff
+        return o, False, lost_challenge(w)
+    if b in (CHALLENGE_TAX, CHALLENGE_STEAL, CHALLENGE_ASSASSINATE, CHALLENGE_EXCHANGE) and a in _RESPONDED_ACTIONS:
+        # The opponent challenged the turn's action, and it was a bluff
+        return w, False, lost_challenge(w)
+    if b in _EXCHANGE_RETURNS and a == CHALLENGE_EXCHANGE:
+        # Lost a challenge of the opponent's exchange, and it is done
+        return o, False, lost_challenge(w)
+    # Otherwise a turn just ended, ex: income, a pass or a lost card
+    return w, True, lost_challenge(None)
+
+
+def observe(state, p2_view=False):
+    '''
+    Return the partial observation of a game in the flat state layout,
+    same as CoupEnv.get_obs(p2_view) as an int8 array
+    '''
+    state = np.asarray(state, dtype='int8')
+    me, opp = (1, 0) if p2_view else (0, 1)
+    cards = state[CARDS:CARDS + 8].reshape(2, 4)
+    face_up = state[FACE_UP:FACE_UP + 8].reshape(2, 4)
+    obs = np.empty(21, dtype='int8')
+    obs[0:4] = cards[me]
+    # Hide value of opp face down cards
+    obs[4:8] = np.where(face_up[opp] == 1, cards[opp], NONE)
+    obs[8:12] = face_up[me]
+    obs[12:16] = face_up[opp]
+    obs[16:18] = state[COINS + me], state[COINS + opp]
+    obs[18:20] = state[LAST_ACTION + me], state[LAST_ACTION + opp]
+    obs[20] = state[WHOSE_ACTION]
+    return obs
+
+
+def sample_determinizations(obs, k, p2_view=False, is_turn_begin=None, rng=None):
+    '''
+    Sample full game states consistent with an observation
+
+    The opponent's face down cards and the deck order are drawn uniformly
+    from the cards not seen, out of the 3 of each card in the game.
+    Hands stay sorted like Player._sort_cards, so a face down card sorted
+    next to a face up one is drawn only from the values that sort there.
+
+    obs:           Observation from CoupEnv.get_obs(p2_view), with the opponent's
+                   face down cards hidden
+    k:             Number of states
+    p2_view:       Whether obs is from P2's view
+    is_turn_begin: Whether a turn is starting, only needed if turn_flags() can't tell
+    rng:           np.random.Generator or seed
+
+    Return (k, STATE_SIZE) int8 array of states in the flat state layout,
+    ex: to load into CompactGame.load_array
+    '''
+    rng = np.random.default_rng(rng)
+    obs = np.asarray(obs, dtype='int8')
+    me, opp = (1, 0) if p2_view else (0, 1)
+
+    state = np.zeros(STATE_SIZE, dtype='int8')
+    for p, i in ((me, 0), (opp, 1)):
+        state[CARDS + 4 * p:CARDS + 4 * p + 4] = obs[4 * i:4 * i + 4]
+        state[FACE_UP + 4 * p:FACE_UP + 4 * p + 4] = obs[8 + 4 * i:12 + 4 * i]
+        state[COINS + p] = obs[16 + i]
+        state[LAST_ACTION + p] = obs[18 + i]
+    whose_action = int(obs[20])
+    num_cards = [4 if state[CARDS + 4 * p + 2] != NONE or state[FACE_UP + 4 * p + 2] != NONE else 2
+                 for p in range(2)]
+    whose_turn, turn_begin, lost_challenge = turn_flags(
+        whose_action, state[LAST_ACTION:LAST_ACTION + 2].tolist(), num_cards, is_turn_begin)
+    state[GAME_OVER] = any(state[FACE_UP + 4 * p] == 1 and state[FACE_UP + 4 * p + 1] == 1 for p in range(2))
+    state[WHOSE_TURN] = whose_turn
+    state[WHOSE_ACTION] = whose_action
+    state[IS_TURN_BEGIN] = turn_begin
+    # Nobody is left to lose a card once the game is over
+    state[LOST_CHALLENGE:LOST_CHALLENGE + 2] = lost_challenge if not state[GAME_OVER] else 0
+
+    # Cards the viewer hasn't seen, ex: all face down cards of the opponent
+    counts = np.full(len(Card.names), 3)
+    seen = state[CARDS:CARDS + 8]
+    np.subtract.at(counts, seen[seen != NONE], 1)
+    if (counts < 0).any():
+        raise ValueError('Observation has more than 3 of a card')
+    pool = np.repeat(np.arange(len(Card.names), dtype='int8'), counts)
+
+    c = CARDS + 4 * opp
+    f = FACE_UP + 4 * opp
+    hidden = [c + i for i in range(4) if state[f + i] == 0 and state[c + i] == NONE]
+    if len(hidden) > len(pool):
+        raise ValueError('Observation has more cards than the game')
+
+    # Random order of the pool per state: the hidden cards, then the deck.
+    # A hidden card next to a face up one must sort on the right side of it
+    keys = rng.random((k, len(pool)))
+    up = [i for i in range(2) if state[f + i] == 1]
+    if len(up) == 1 and len(hidden) and hidden[0] < c + 2:
+        u = state[c + up[0]]
+        allowed = np.flatnonzero(pool > u if up[0] == 0 else pool <= u)
+        if not len(allowed):
+            raise ValueError('No card can sort next to the face up card')
+        keys[np.arange(k), rng.choice(allowed, size=k)] = -1
+    cards = pool[np.argsort(keys, axis=1)]
+
+    states = np.repeat(state[None], k, axis=0)
+    states[:, hidden] = cards[:, :len(hidden)]
+    if hidden[:2] == [c, c + 1]:
+        states[:, c:c + 2].sort(axis=1)
+    deck = cards[:, len(hidden):]
+    states[:, DECK_SIZE] = deck.shape[1]
+    states[:, DECK:DECK + deck.shape[1]] = deck
+    return states
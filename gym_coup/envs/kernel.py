@@ -0,0 +1,500 @@
+'''
+Functional game kernel over the flat state layout
+
+step_kernel and legal_mask_kernel take a game as an int8 NumPy array in the
+flat state layout, see STATE_SIZE, and use only integer array ops, so they
+compile with numba when it's installed. Without numba they run as plain Python.
+
+Randomness comes from rng_state, a (1,) int64 array holding a 32-bit xorshift
+state that the kernel advances in place, see kernel_rng(). Draws pick a
+random card of the deck instead of shuffling it: the deck order is never
+seen, so this is the same distribution as drawing from a shuffled deck.
+'''
+import random
+from array import array
+import numpy as np
+from gym_coup.envs.coup_env import *
+from gym_coup.envs.coup_env import _dispatch_table
+from gym_coup.envs.compact_game import CompactGame
+
+try:
+    from numba import njit
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+    def njit(fn):
+        return fn
+
+_COIN_BUCKETS = np.array(COIN_BUCKETS, dtype='int64')
+_NUM_CARD_VALUES = len(Card.names)
+_NUM_DECK_CARDS = 3 * _NUM_CARD_VALUES
+
+
+def kernel_rng(seed=None):
+    '''
+    Return a new rng_state for the kernel
+
+    seed: Seed of the state, or None for a random one
+    '''
+    # xorshift never leaves 0, so keep the state odd
+    return np.array([random.Random(seed).getrandbits(32) | 1], dtype='int64')
+
+
+@njit
+def _rand_below(rng_state, n):
+    '''
+    Random int in [0, n) from a xorshift32 step
+    '''
+    x = int(rng_state[0])
+    x ^= (x << 13) & 0xFFFFFFFF
+    x ^= x >> 17
+    x ^= (x << 5) & 0xFFFFFFFF
+    rng_state[0] = x
+    return (x * n) >> 32
+
+
+@njit
+def _draw_card(s, rng_state):
+    n = int(s[DECK_SIZE])
+    i = DECK + _rand_below(rng_state, n)
+    val = int(s[i])
+    # Fill the gap with the last card of the deck
+    s[i] = s[DECK + n - 1]
+    s[DECK_SIZE] = n - 1
+    return val
+
+
+@njit
+def _return_card(s, val):
+    n = int(s[DECK_SIZE])
+    s[DECK + n] = val
+    s[DECK_SIZE] = n + 1
+
+
+@njit
+def _num_cards(s, p):
+    return 2 if s[CARDS + 4 * p + 2] == NONE else 4
+
+
+@njit
+def _add_card(s, p, val):
+    c = CARDS + 4 * p
+    for i in range(4):
+        if s[c + i] == NONE:
+            s[c + i] = val
+            s[FACE_UP + 4 * p + i] = 0
+            return
+
+
+@njit
+def _has_face_down_card(s, p, val):
+    c = CARDS + 4 * p
+    f = FACE_UP + 4 * p
+    for i in range(4):
+        if s[c + i] == val and s[f + i] == 0:
+            return True
+    return False
+
+
+@njit
+def _num_face_up(s, p):
+    f = FACE_UP + 4 * p
+    n = 0
+    for i in range(4):
+        if s[f + i] == 1:
+            n += 1
+    return n
+
+
+@njit
+def _sort_cards(s, p):
+    '''
+    Insertion sort of the hand by (card, face up), same order as Player._sort_cards
+    '''
+    c = CARDS + 4 * p
+    f = FACE_UP + 4 * p
+    for i in range(1, _num_cards(s, p)):
+        val = int(s[c + i])
+        up = int(s[f + i])
+        j = i - 1
+        while j >= 0 and (s[c + j] > val or (s[c + j] == val and s[f + j] > up)):
+            s[c + j + 1] = s[c + j]
+            s[f + j + 1] = s[f + j]
+            j -= 1
+        s[c + j + 1] = val
+        s[f + j + 1] = up
+
+
+@njit
+def _next_player_turn(s):
+    s[WHOSE_TURN] = 1 - s[WHOSE_TURN]
+    # Players will always have the first action on their turn
+    s[WHOSE_ACTION] = s[WHOSE_TURN]
+    s[IS_TURN_BEGIN] = 1
+
+
+@njit
+def _next_player_action(s):
+    s[WHOSE_ACTION] = 1 - s[WHOSE_ACTION]
+    s[IS_TURN_BEGIN] = 0
+
+
+@njit
+def _steal_coins(s, thief, victim):
+    num_steal = 2 if s[COINS + victim] >= 2 else 1
+    s[COINS + victim] -= num_steal
+    s[COINS + thief] += num_steal
+
+
+@njit
+def _reveal_all(s, p):
+    # Lose 1 card for assassination
+    # and 1 card for losing challenge
+    s[FACE_UP + 4 * p] = 1
+    s[FACE_UP + 4 * p + 1] = 1
+    s[GAME_OVER] = 1
+
+
+@njit
+def _challenge_fail_replace_card(s, rng_state, val):
+    # The challenged player had the card, so it goes back
+    # into the deck and they draw a new one
+    p = 1 - int(s[WHOSE_ACTION])
+    c = CARDS + 4 * p
+    f = FACE_UP + 4 * p
+    for i in range(4):
+        if s[c + i] == val and s[f + i] == 0:
+            _return_card(s, val)
+            s[c + i] = _draw_card(s, rng_state)
+            _sort_cards(s, p)
+            return
+    raise RuntimeError('Tried to replace a card that was not in player\'s hand')
+
+
+@njit
+def _complete(s, rng_state, action):
+    '''
+    Complete an action of the player to act that the opponent passed on
+    '''
+    curr = int(s[WHOSE_ACTION])
+    if action == FOREIGN_AID:
+        s[COINS + curr] += 2
+        _next_player_turn(s)
+    elif action == TAX:
+        s[COINS + curr] += 3
+        _next_player_turn(s)
+    elif action == EXCHANGE:
+        _add_card(s, curr, _draw_card(s, rng_state))
+        _add_card(s, curr, _draw_card(s, rng_state))
+    elif action == STEAL:
+        _steal_coins(s, curr, 1 - curr)
+        _next_player_turn(s)
+    else:
+        raise RuntimeError('Invalid action progression')
+
+
+@njit
+def _exchange_return(s, i, j):
+    curr = int(s[WHOSE_ACTION])
+    c = CARDS + 4 * curr
+    f = FACE_UP + 4 * curr
+    _return_card(s, s[c + i])
+    _return_card(s, s[c + j])
+    k = 0
+    for x in range(4):
+        if x != i and x != j:
+            s[c + k] = s[c + x]
+            s[f + k] = s[f + x]
+            k += 1
+    for x in range(2, 4):
+        s[c + x] = NONE
+        s[f + x] = NONE
+    _sort_cards(s, curr)
+
+    if s[LOST_CHALLENGE + 1 - curr]:
+        # opp still needs to choose a card to lose
+        _next_player_action(s)
+    else:
+        _next_player_turn(s)
+
+
+@njit
+def _lose_card(s, i):
+    curr = int(s[WHOSE_ACTION])
+    f = FACE_UP + 4 * curr
+    if s[f + i] == 1:
+        raise RuntimeError('Cannot lose a card that is already face up')
+
+    s[f + i] = 1
+    s[LOST_CHALLENGE + curr] = 0
+    _sort_cards(s, curr)
+
+    # Check if the player has no cards remaining
+    game_over = 1
+    for x in range(4):
+        if s[f + x] == 0:
+            game_over = 0
+    s[GAME_OVER] = game_over
+    _next_player_turn(s)
+
+
+@njit
+def _challenge(s, rng_state, val):
+    '''
+    The player to act challenges the opponent's claim of card val
+
+    Return whether the challenge failed, ie the opponent had the card.
+    The loser of the challenge is marked, and the card is replaced if shown
+    '''
+    curr = int(s[WHOSE_ACTION])
+    if _has_face_down_card(s, 1 - curr, val):
+        s[LOST_CHALLENGE + curr] = 1
+        _challenge_fail_replace_card(s, rng_state, val)
+        return True
+    s[LOST_CHALLENGE + 1 - curr] = 1
+    return False
+
+
+@njit
+def _apply(s, action, rng_state):
+    '''
+    Take action in place. Same rules as the Game action of the same id
+    '''
+    curr = int(s[WHOSE_ACTION])
+    opp = 1 - curr
+    turn_begin = s[IS_TURN_BEGIN] != 0
+
+    if action < 0 or action >= NUM_ACTIONS:
+        raise RuntimeError('Invalid action')
+    if action == FOREIGN_AID or action == TAX or action == EXCHANGE or action == STEAL:
+        if turn_begin:
+            s[LAST_ACTION + curr] = action
+            _next_player_action(s)
+        else:
+            _complete(s, rng_state, action)
+        return
+    if action == COUP and s[COINS + curr] < 7:
+        raise RuntimeError('Not possible to coup with < 7 coins')
+    s[LAST_ACTION + curr] = action
+
+    if action == INCOME:
+        s[COINS + curr] += 1
+        _next_player_turn(s)
+    elif action == COUP:
+        s[COINS + curr] -= 7
+        _next_player_action(s)
+    elif action == ASSASSINATE:
+        # Pay the coins whether or not the action is blocked/challenged
+        s[COINS + curr] -= 3
+        _next_player_action(s)
+    elif action == LOSE_CARD_1:
+        _lose_card(s, 0)
+    elif action == LOSE_CARD_2:
+        _lose_card(s, 1)
+    elif action == PASS_FA or action == PASS_TAX or action == PASS_EXCHANGE or action == PASS_STEAL:
+        # Complete the opponent's action
+        act = int(s[LAST_ACTION + opp])
+        _next_player_action(s)
+        _complete(s, rng_state, act)
+    elif action == PASS_FA_BLOCK or action == PASS_ASSASSINATE_BLOCK or action == PASS_STEAL_BLOCK:
+        # Block succeeds, so nothing to do. Next turn.
+        _next_player_turn(s)
+    elif action == BLOCK_FA or action == BLOCK_ASSASSINATE or action == BLOCK_STEAL:
+        _next_player_action(s)
+    elif action == CHALLENGE_FA_BLOCK:
+        if not _challenge(s, rng_state, DUKE):
+            # Block failed, so complete the action
+            s[COINS + curr] += 2
+            _next_player_action(s)
+    elif action == CHALLENGE_TAX:
+        if _challenge(s, rng_state, DUKE):
+            s[COINS + opp] += 3
+        else:
+            _next_player_action(s)
+    elif action == CHALLENGE_EXCHANGE:
+        if _challenge(s, rng_state, AMBASSADOR):
+            _next_player_action(s)
+            _complete(s, rng_state, EXCHANGE)
+        else:
+            _next_player_action(s)
+    elif action == CHALLENGE_ASSASSINATE:
+        if _has_face_down_card(s, opp, ASSASSIN):
+            # curr loses the game
+            _reveal_all(s, curr)
+        else:
+            s[LOST_CHALLENGE + opp] = 1
+            # Coins spent are returned in this one case
+            s[COINS + opp] += 3
+            _next_player_action(s)
+    elif action == CHALLENGE_ASSASSINATE_BLOCK:
+        if _has_face_down_card(s, opp, CONTESSA):
+            s[LOST_CHALLENGE + curr] = 1
+            _challenge_fail_replace_card(s, rng_state, CONTESSA)
+        else:
+            # opp loses the game
+            _reveal_all(s, opp)
+    elif action == CHALLENGE_STEAL:
+        if _challenge(s, rng_state, CAPTAIN):
+            _steal_coins(s, opp, curr)
+        else:
+            _next_player_action(s)
+    elif action == CHALLENGE_STEAL_BLOCK:
+        if _has_face_down_card(s, opp, CAPTAIN):
+            s[LOST_CHALLENGE + curr] = 1
+            _challenge_fail_replace_card(s, rng_state, CAPTAIN)
+        elif not _challenge(s, rng_state, AMBASSADOR):
+            # Block failed, so complete the action
+            _steal_coins(s, curr, opp)
+            _next_player_action(s)
+    elif action == EXCHANGE_RETURN_12:
+        _exchange_return(s, 0, 1)
+    elif action == EXCHANGE_RETURN_13:
+        _exchange_return(s, 0, 2)
+    elif action == EXCHANGE_RETURN_14:
+        _exchange_return(s, 0, 3)
+    elif action == EXCHANGE_RETURN_23:
+        _exchange_return(s, 1, 2)
+    elif action == EXCHANGE_RETURN_24:
+        _exchange_return(s, 1, 3)
+    else:
+        _exchange_return(s, 2, 3)
+
+
+@njit
+def _step(s, action, rng_state):
+    '''
+    Take action in place
+
+    Return the reward of the player who took it, same as CoupEnv.step
+    '''
+    curr = int(s[WHOSE_ACTION])
+    before_curr = _num_face_up(s, curr)
+    before_opp = _num_face_up(s, 1 - curr)
+    _apply(s, action, rng_state)
+    # -1 for each card you lose, +1 for each card your opp loses
+    return (before_curr - _num_face_up(s, curr)) + (_num_face_up(s, 1 - curr) - before_opp)
+
+
+@njit
+def step_kernel(state, action, rng_state):
+    '''
+    Take an action in a game in the flat state layout
+
+    state:     int8 array of STATE_SIZE, left unchanged
+    action:    Action id, valid in state
+    rng_state: From kernel_rng(), advanced in place
+
+    Return (next state, reward of the player who acted, whether the game is over)
+    '''
+    s = state.copy()
+    reward = _step(s, action, rng_state)
+    return s, reward, bool(s[GAME_OVER])
+
+
+@njit
+def legal_mask_kernel(state):
+    '''
+    Return the valid actions of the player to act in state
+    as a np.bool_ mask of length 32, all False if the game is over
+    or the state can't occur
+    '''
+    if state[GAME_OVER]:
+        return np.zeros(NUM_ACTIONS, dtype=np.bool_)
+    curr = int(state[WHOSE_ACTION])
+    opp = 1 - curr
+
+    if state[IS_TURN_BEGIN]:
+        phase = PHASE_TURN_BEGIN
+    elif state[LOST_CHALLENGE + curr]:
+        phase = PHASE_LOST_CHALLENGE
+    elif state[WHOSE_TURN] != curr:
+        phase = PHASE_RESPOND
+    elif state[LAST_ACTION + curr] == EXCHANGE:
+        phase = PHASE_EXCHANGE
+    else:
+        phase = PHASE_BLOCKED
+
+    # Same packing as decision_context()
+    key = phase * 33 + int(state[LAST_ACTION + opp]) + 1
+    key = key * 4 + _COIN_BUCKETS[min(int(state[COINS + curr]), 10)]
+    key = key * 2 + (1 if state[COINS + opp] > 0 else 0)
+    key = key * 2 + (1 if state[FACE_UP + 4 * curr] == 0 else 0)
+    key = key * 2 + (1 if state[FACE_UP + 4 * curr + 1] == 0 else 0)
+    key = key * 2 + (1 if state[CARDS + 4 * curr + 2] != NONE else 0)
+    return ACTION_MASKS[key].copy()
+
+
+@njit
+def reset_kernel(rng_state, p_first_turn=0):
+    '''
+    Return a new game in the flat state layout, with the cards dealt
+    '''
+    s = np.full(STATE_SIZE, NONE, dtype=np.int8)
+    s[COINS] = 2
+    s[COINS + 1] = 2
+    s[LOST_CHALLENGE] = 0
+    s[LOST_CHALLENGE + 1] = 0
+    s[WHOSE_TURN] = p_first_turn
+    s[WHOSE_ACTION] = p_first_turn
+    s[IS_TURN_BEGIN] = 1
+    s[GAME_OVER] = 0
+    s[DECK_SIZE] = _NUM_DECK_CARDS
+    for i in range(_NUM_DECK_CARDS):
+        s[DECK + i] = i % _NUM_CARD_VALUES
+    for _ in range(2):
+        for p in range(2):
+            _add_card(s, p, _draw_card(s, rng_state))
+    _sort_cards(s, 0)
+    _sort_cards(s, 1)
+    # In a 2 player game, the player going first starts with 1 coin instead of 2
+    s[COINS + p_first_turn] = 1
+    return s
+
+
+class KernelGame(CompactGame):
+    '''
+    CompactGame that deals and takes every action with the kernel,
+    to run the kernel behind the Game API and CoupEnv
+
+    The kernel's rng_state is seeded from the game's rng before each action,
+    so clones and snapshots play out the same as the game would.
+    '''
+    __slots__ = ()
+
+    def __init__(self, num_human_players=0, p_first_turn=0, rng=None):
+        self.num_human_players = num_human_players
+        self.rng = random if rng is None else rng
+        self.state = array('b', reset_kernel(self._rng_state(), p_first_turn).tobytes())
+        self.turn_count = 0
+
+    def _rng_state(self):
+        return np.array([self.rng.getrandbits(32) | 1], dtype='int64')
+
+    def _step(self, action):
+        _step(self.as_numpy(), action, self._rng_state())
+        if self.state[IS_TURN_BEGIN]:
+            self.turn_count += 1
+
+    def get_action_mask(self):
+        '''
+        Return the valid actions as a read-only np.bool_ mask of length 32,
+        from legal_mask_kernel
+        '''
+        mask = legal_mask_kernel(self.as_numpy())
+        if not mask.any() and not self.state[GAME_OVER]:
+            raise RuntimeError('Invalid action progression')
+        mask.flags.writeable = False
+        return mask
+
+
+def _kernel_handler(action):
+    def handler(self):
+        self._step(action)
+    handler.__name__ = CoupEnv.actions[action]
+    return handler
+
+
+for _a in range(NUM_ACTIONS):
+    setattr(KernelGame, CoupEnv.actions[_a], _kernel_handler(_a))
+KernelGame._action_handlers = _dispatch_table(KernelGame)
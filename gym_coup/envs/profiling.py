@@ -0,0 +1,71 @@
+import functools
+from time import perf_counter
+from gym_coup.envs.coup_env import CoupEnv, NUM_ACTIONS, _dispatch_table
+
+
+class Profiler:
+    '''
+    Call counts and cumulative wall time of a game class's action handlers
+    and hot helpers
+
+    instrument() returns a subclass of the game class with timed methods.
+    Games of the original class are untouched, so a game that isn't
+    profiled pays nothing.
+
+    Times are inclusive. Passing on an action completes the opponent's action,
+    so ex: the time of pass_tax includes a call of tax.
+    '''
+    helpers = ('get_obs', 'partial_obs', 'get_valid_actions', 'get_action_mask', 'shuffle_deck', '_sort_cards')
+
+    def __init__(self):
+        # name: [calls, seconds], updated in place by the timed methods
+        self._stats = {}
+
+    def _timed(self, name, fn):
+        entry = self._stats.setdefault(name, [0, 0.0])
+
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                entry[0] += 1
+                entry[1] += perf_counter() - start
+        return timed
+
+    def instrument(self, game_cls):
+        '''
+        Return a subclass of game_cls, ex: Game or CompactGame,
+        that records its stats in this profiler
+        '''
+        ns = {}
+        for a in range(NUM_ACTIONS):
+            name = CoupEnv.actions[a]
+            ns[name] = self._timed(name, getattr(game_cls, name))
+        for name in self.helpers:
+            if hasattr(game_cls, name):
+                ns[name] = self._timed(name, getattr(game_cls, name))
+
+        # Game sorts cards in Player, CompactGame in the game itself
+        player_cls = getattr(game_cls, 'player_cls', None)
+        if player_cls is not None:
+            ns['player_cls'] = type('Profiled' + player_cls.__name__, (player_cls,),
+                                    {'_sort_cards': self._timed('_sort_cards', player_cls._sort_cards)})
+        if hasattr(game_cls, '__slots__'):
+            ns['__slots__'] = ()
+
+        cls = type('Profiled' + game_cls.__name__, (game_cls,), ns)
+        cls._action_handlers = _dispatch_table(cls)
+        return cls
+
+    def stats(self):
+        '''
+        Return {name: {'calls': int, 'time': seconds}} of every timed method
+        '''
+        return {k: {'calls': v[0], 'time': v[1]} for k, v in self._stats.items()}
+
+    def reset(self):
+        for v in self._stats.values():
+            v[0] = 0
+            v[1] = 0.0
@@ -0,0 +1,94 @@
+import numpy as np
+from gym_coup.envs.coup_env import *
+
+
+class Replay:
+    '''
+    A game re-run from its seed and action log, see CoupEnv.replay()
+
+    The whole game is run once up front, keeping the reward and acting player
+    of every step and a snapshot every checkpoint_interval steps.
+    With auto_forced_moves, each step also takes the forced actions after it,
+    as CoupEnv.step does, so the log holds only the actions passed to step().
+    seek(k) then rebuilds the state after any k actions from the nearest
+    snapshot, so it costs at most checkpoint_interval actions.
+
+    rewards: (T,) int8, reward of the player who took each action
+    players: (T,) int8, who took each action, 0 = P1
+    done:    Whether the last action ended the game
+    '''
+    def __init__(self, env, seed, actions, checkpoint_interval=16):
+        '''
+        env:                 CoupEnv the game was played in, for its config
+        seed:                Seed the game was reset with
+        actions:             Action ids passed to step(), in order
+        checkpoint_interval: Steps between snapshots
+        '''
+        if checkpoint_interval < 1:
+            raise ValueError('checkpoint_interval must be at least 1')
+        self.actions = np.asarray(actions, dtype='int8')
+        self.checkpoint_interval = checkpoint_interval
+
+        # Cursor env that seek() moves, with the same game config as env
+        self.env = CoupEnv(env.num_human_players, env.p_first_turn, env.is_partial_obs,
+                           check_invariants='off', log=False, auto_forced_moves=env.auto_forced_moves)
+        self.env.game_cls = env.game_cls
+        self.env.reset(seed=seed)
+
+        n = len(self.actions)
+        self.rewards = np.empty(n, dtype='int8')
+        self.players = np.empty(n, dtype='int8')
+        self.checkpoints = [self.env.clone_state()]
+        for k in range(n):
+            if k and k % checkpoint_interval == 0:
+                self.checkpoints.append(self.env.clone_state())
+            self.players[k] = self.env.game.whose_action
+            self.rewards[k] = self._advance(k)
+        self.done = self.env.game.game_over
+        self._pos = n
+
+    def __len__(self):
+        return len(self.actions)
+
+    def _advance(self, k):
+        '''
+        Take action k in the cursor env, and any forced actions after it,
+        same as CoupEnv.step but without building the observation. Return the reward
+        '''
+        env = self.env
+        game = env.game
+        a = int(self.actions[k])
+        if game.game_over or not game.get_action_mask()[a]:
+            raise RuntimeError(f'Invalid action {a} at step {k}')
+
+        whose_a, reward = env._act(a)
+        if env.auto_forced_moves:
+            reward = env._act_forced(whose_a, reward)
+        return reward
+
+    def seek(self, k):
+        '''
+        Set the cursor env to the state after the first k actions
+
+        Return the cursor env. It changes on the next seek(), so clone
+        anything that needs to be kept, ex: env.clone_state()
+        '''
+        if not 0 <= k <= len(self.actions):
+            raise IndexError(f'Step {k} out of range')
+        c = min(k // self.checkpoint_interval, len(self.checkpoints) - 1)
+        start = c * self.checkpoint_interval
+        # Moving forward from the current state is never slower than from the checkpoint
+        if not start <= self._pos <= k:
+            self.env.restore_state(self.checkpoints[c])
+            self._pos = start
+        for i in range(self._pos, k):
+            self._advance(i)
+        self._pos = k
+        return self.env
+
+    def obs(self, k):
+        '''
+        Return the observation of the player to act after the first k actions
+        '''
+        env = self.seek(k)
+        return env.get_obs(p2_view=env.game.whose_action == 1)
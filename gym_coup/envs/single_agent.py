@@ -0,0 +1,203 @@
+import gym
+import numpy as np
+from gym_coup.envs.coup_env import *
+from gym_coup.envs.coup_vector_env import CoupVectorEnv
+
+
+class SingleAgentCoupEnv(gym.Env):
+    '''
+    CoupEnv from one player's seat, against a fixed opponent policy
+
+    Every opponent action, including blocks, challenges, lost cards and
+    exchange returns, is taken inside reset() and step(), which only return
+    when the agent has to act or the game is over.
+
+    The opponent is a batched policy(obs, masks) -> actions, same as
+    RolloutEngine's, called with a batch of 1.
+    '''
+    metadata = CoupEnv.metadata
+
+    def __init__(self, opponent, agent_player=0, **env_kwargs):
+        '''
+        opponent:     policy(obs, masks) of the other player.
+                      obs (B, 21) and masks (B, 32), returns (B,) actions
+        agent_player: Seat of the agent, 0 = P1
+        env_kwargs:   CoupEnv options
+        '''
+        self.opponent = opponent
+        self.agent_player = agent_player
+        self.env = CoupEnv(**env_kwargs)
+        self.action_space = self.env.action_space
+        self.observation_space = self.env.observation_space
+        self._mask = None
+
+    @property
+    def game(self):
+        return self.env.game
+
+    def _play_opponent(self, p, obs, mask, done):
+        '''
+        Take the opponent's actions from the result of the last step_fused()
+        until it's the agent's action or the game is over
+
+        Return (sum of the opponent's rewards, done)
+        '''
+        reward = 0
+        while not done and p != self.agent_player:
+            action = self.opponent(np.array([obs], dtype='int8'), mask[None])[0]
+            r, p, obs, mask, done = self.env.step_fused(int(action))
+            reward += r
+        self._mask = NO_ACTIONS_MASK if done else mask
+        return reward, done
+
+    def reset(self, seed=None):
+        '''
+        Start a new game, and play the opponent's actions if it goes first
+
+        seed: Reseed the env's RNG
+
+        Return the agent's observation
+        '''
+        self.env.reset(seed=seed)
+        game = self.env.game
+        p = game.whose_action
+        self._play_opponent(p, self.env.get_obs(p2_view=p == 1), game.get_action_mask(), False)
+        return self.env.get_obs(p2_view=self.agent_player == 1)
+
+    def step(self, action):
+        '''
+        Take the agent's action, then the opponent's until the agent acts again
+
+        Return (obs, reward, done, info)
+            obs:    Observation from the agent's view
+            reward: Agent's reward for its action and the opponent's actions after it
+            done:   Whether the game is over
+            info:   'action_mask' valid actions of the agent, see get_action_mask()
+        '''
+        reward, p, obs, mask, done = self.env.step_fused(action)
+        opp_reward, done = self._play_opponent(p, obs, mask, done)
+        # Zero-sum, so the opponent's reward is the agent's loss
+        reward -= opp_reward
+        if done or p != self.agent_player:
+            obs = self.env.get_obs(p2_view=self.agent_player == 1)
+        return obs, reward, done, {'action_mask': self._mask}
+
+    def get_action_mask(self):
+        '''
+        Return the valid actions of the agent as a read-only np.bool_ mask of length 32,
+        no actions once the game is over
+        '''
+        return self._mask
+
+    def get_valid_actions(self):
+        if self.env.game.game_over:
+            return []
+        return self.env.get_valid_actions()
+
+    def render(self, mode='human'):
+        self.env.render(mode)
+
+
+class SingleAgentCoupVectorEnv:
+    '''
+    CoupVectorEnv from one player's seat in every game, against a fixed opponent policy
+
+    After the agent's actions, the opponent acts in every game waiting on it with
+    one batched policy call, repeated until the agent has to act in every game.
+    Finished games are reset, and the opponent plays first in the new game if it goes first.
+    '''
+    def __init__(self, opponent, num_envs, agent_player=0, p_first_turn=0, is_partial_obs=True, seed=None):
+        '''
+        opponent:     policy(obs, masks) of the other player.
+                      obs (B, 21) and masks (B, 32), returns (B,) actions
+        num_envs:     Number of games stepped together
+        agent_player: Seat of the agent in every game, 0 = P1
+        p_first_turn, is_partial_obs, seed: CoupVectorEnv options
+        '''
+        self.opponent = opponent
+        self.agent_player = agent_player
+        self.venv = CoupVectorEnv(num_envs, p_first_turn=p_first_turn,
+                                  is_partial_obs=is_partial_obs, seed=seed)
+        self.num_envs = num_envs
+        self.single_observation_space = self.venv.single_observation_space
+        self.single_action_space = self.venv.single_action_space
+        self.observation_space = self.venv.observation_space
+        self.action_space = self.venv.action_space
+
+    def _play_opponent(self):
+        '''
+        Take the opponent's actions in every game waiting on it,
+        one batched policy call per round
+
+        Return (N,) the agent's rewards from the opponent's actions
+        '''
+        venv = self.venv
+        rewards = np.zeros(self.num_envs, dtype='int8')
+        while True:
+            waiting = np.flatnonzero((venv.whose_action != self.agent_player) & ~venv.game_over)
+            if not len(waiting):
+                return rewards
+            venv._update_masks()
+            masks = venv.masks[waiting]
+            actions = np.asarray(self.opponent(venv._get_obs(waiting, venv.whose_action[waiting]), masks))
+            # Negative ids would wrap around when indexing the masks
+            if ((actions < 0) | (actions >= NUM_ACTIONS)).any() or not masks[np.arange(len(waiting)), actions].all():
+                raise RuntimeError('Opponent took an invalid action')
+            r, _ = venv._act(waiting, actions)
+            rewards[waiting] -= r.astype('int8')
+
+    def _get_obs_and_masks(self):
+        venv = self.venv
+        venv._update_masks()
+        return venv._get_obs(venv._all, self.agent_player), venv.masks.copy()
+
+    def reset(self, seed=None):
+        '''
+        Start a new game in every env, and play the opponent's actions where it goes first
+
+        Return (obs, masks) of the agent in each game
+        '''
+        self.venv.reset(seed=seed)
+        self._play_opponent()
+        return self._get_obs_and_masks()
+
+    def step(self, actions):
+        '''
+        Take the agent's action in every game, then the opponent's
+        until the agent has to act again in every game
+
+        actions: Array of N legal action ids, one per game
+
+        Return (obs, rewards, dones, masks, info)
+            obs:     (N, 21) observations from the agent's view
+            rewards: (N,) agent's rewards for its action and the opponent's actions after it
+            dones:   (N,) whether the game ended. Finished games are reset,
+                     so obs and masks already belong to the new game
+            masks:   (N, 32) legal actions of the agent
+            info:    'final_obs' (N, 21) agent's observation of the finished game, only where dones
+        '''
+        venv = self.venv
+        actions = np.asarray(actions)
+        if actions.shape != (self.num_envs,):
+            raise RuntimeError(f'Expected {self.num_envs} actions, got shape {actions.shape}')
+        # Negative ids would wrap around when indexing the masks
+        if ((actions < 0) | (actions >= NUM_ACTIONS)).any() or not venv.masks[venv._all, actions].all():
+            raise RuntimeError('Cannot step with an invalid action')
+
+        rewards, _ = venv._act(venv._all, actions)
+        rewards = rewards.astype('int8') + self._play_opponent()
+
+        dones = venv.game_over.copy()
+        info = {}
+        if dones.any():
+            done_idx = np.flatnonzero(dones)
+            final_obs = np.zeros((self.num_envs, 21), dtype='int8')
+            final_obs[done_idx] = venv._get_obs(done_idx, self.agent_player)
+            info['final_obs'] = final_obs
+            venv._reset_envs(done_idx)
+            # New games where the opponent goes first. Nothing can be lost
+            # before the agent's first action, so there is no reward to count
+            self._play_opponent()
+
+        obs, masks = self._get_obs_and_masks()
+        return obs, rewards, dones, masks, info
@@ -0,0 +1,255 @@
+'''
+Information set Monte Carlo tree search (ISMCTS) baseline agent
+
+Each simulation plays out one determinization: a full game with the
+opponent's face down cards and the deck order drawn from the cards the
+searching player hasn't seen, see sample_determinizations().
+All determinizations share one tree. Its nodes are information sets,
+keyed on the info_hash() of the player to act, so each player chooses
+only on what that player knows. The tree is kept between moves, and a
+position searched before picks up its statistics.
+
+Leaves are evaluated in batches: the simulations of a batch are played
+to their leaves first, then the value function is called once with all
+of their states, ex: a NumPy or neural network evaluator. A virtual loss
+on the edges taken keeps the simulations of a batch from all following
+the same path.
+'''
+import math
+import random
+import time
+from array import array
+from collections import OrderedDict
+import numpy as np
+from gym_coup.envs.coup_env import *
+from gym_coup.envs.compact_game import CompactGame
+from gym_coup.envs.determinization import observe, sample_determinizations
+
+# Edge statistics: [visits, total value for the player choosing, availability]
+_N     = 0
+_W     = 1
+_AVAIL = 2
+
+
+def _terminal_value(game, p):
+    '''
+    Value of a finished game for player p
+    '''
+    return -1.0 if game.get_num_face_up()[p] >= 2 else 1.0
+
+
+def random_rollouts(states, rng=None, max_actions=500):
+    '''
+    Value function that plays each state out with uniformly random actions
+
+    states:      (B, STATE_SIZE) int8 states in the flat state layout
+    rng:         random.Random to pick actions with.
+                 Defaults to the shared random module
+    max_actions: Actions before an unfinished game counts as a draw
+
+    Return (B,) values for the player to act in each state: 1 win, -1 loss, 0 draw
+    '''
+    rng = random if rng is None else rng
+    game = CompactGame(rng=rng)
+    handlers = game._action_handlers
+    values = np.zeros(len(states))
+    for i, s in enumerate(states):
+        game.load_array(s.tobytes())
+        p = game.whose_action
+        for _ in range(max_actions):
+            if game.game_over:
+                break
+            handlers[rng.choice(game.get_valid_actions())](game)
+        # Also scores a game ended by the last allowed action
+        if game.game_over:
+            values[i] = _terminal_value(game, p)
+    return values
+
+
+class ISMCTSAgent:
+    '''
+    ISMCTS agent that picks actions for the player to act in a Game
+
+    tree: Information set hash -> {action: [visits, total value, availability]},
+          least recently visited first
+    '''
+    def __init__(self, simulations=1000, time_limit=None, batch_size=32, c=1.0, value_fn=None,
+                 max_depth=100, max_nodes=1 << 17, game_cls=CompactGame, seed=None):
+        '''
+        simulations: Simulations per move, or None for no limit
+        time_limit:  Seconds per move, or None for no limit.
+                     Checked between batches, so at least one batch is run
+        batch_size:  Simulations whose leaves are evaluated together
+        c:           UCB exploration constant
+        value_fn:    Called with a (B, STATE_SIZE) int8 array of leaf states in the
+                     flat state layout, B <= batch_size. Returns (B,) values in [-1, 1]
+                     for the player to act in each state. Defaults to random_rollouts
+        max_depth:   Actions in a simulation before its state is a leaf,
+                     since positions can repeat forever
+        max_nodes:   Max information sets kept in the tree. The least recently
+                     visited are dropped first, so the root of a search, visited
+                     by every simulation, is kept
+        game_cls:    Game class simulations are played in, Game or CompactGame
+        seed:        Seed of the agent's RNGs
+        '''
+        if simulations is None and time_limit is None:
+            raise ValueError('Need a simulations or time_limit budget')
+        if batch_size < 1:
+            raise ValueError('batch_size must be at least 1')
+        self.simulations = simulations
+        self.time_limit = time_limit
+        self.batch_size = batch_size
+        self.c = c
+        self.max_depth = max_depth
+        self.max_nodes = max_nodes
+        self.rng = random.Random(seed)
+        self.np_rng = np.random.default_rng(seed)
+        if value_fn is None:
+            value_fn = lambda states: random_rollouts(states, self.rng)
+        self.value_fn = value_fn
+        self._sim = game_cls(rng=self.rng)
+        self.tree = OrderedDict()
+
+    def reset(self):
+        '''
+        Drop the tree, ex: before a new game
+        '''
+        self.tree.clear()
+
+    def act(self, game):
+        '''
+        Return the most visited action of the player to act in game
+        '''
+        valid = game.get_valid_actions()
+        if len(valid) == 1:
+            return valid[0]
+        visits = self.search(game)
+        return max(valid, key=visits.__getitem__)
+
+    def search(self, game):
+        '''
+        Run simulations from the information set of the player to act in game,
+        within the simulations and time_limit budgets
+
+        Return {action: visits} of the valid actions, including visits
+        from earlier searches of the same information set
+        '''
+        if game.game_over:
+            raise RuntimeError('Cannot search a finished game')
+        p = game.whose_action
+        obs = observe(game.to_array(), p == 1)
+        key = game.info_hash(p)
+        self._add_node(key)
+
+        deadline = None if self.time_limit is None else time.perf_counter() + self.time_limit
+        done = 0
+        while self.simulations is None or done < self.simulations:
+            if done and deadline is not None and time.perf_counter() >= deadline:
+                break
+            n = self.batch_size if self.simulations is None else min(self.batch_size, self.simulations - done)
+            self._run_batch(sample_determinizations(obs, n, p2_view=p == 1,
+                                                    is_turn_begin=game.is_turn_begin, rng=self.np_rng))
+            done += n
+
+        node = self.tree.get(key, {})
+        return {a: node[a][_N] if a in node else 0 for a in game.get_valid_actions()}
+
+    def _add_node(self, key):
+        tree = self.tree
+        node = tree.get(key)
+        if node is None:
+            node = tree[key] = {}
+            if len(tree) > self.max_nodes:
+                tree.popitem(last=False)
+        else:
+            tree.move_to_end(key)
+        return node
+
+    def _select(self, node, valid):
+        '''
+        Pick an untried action, or else the best by UCB, counting
+        every valid action as available.
+        Return the action and its edge
+        '''
+        untried = []
+        best = None
+        best_score = -math.inf
+        log = math.log
+        sqrt = math.sqrt
+        c = self.c
+        for a in valid:
+            edge = node.get(a)
+            if edge is None:
+                edge = node[a] = [0, 0.0, 0]
+            edge[_AVAIL] += 1
+            n = edge[_N]
+            if not n:
+                untried.append(a)
+            elif not untried:
+                score = edge[_W] / n + c * sqrt(log(edge[_AVAIL]) / n)
+                if score > best_score:
+                    best, best_score = a, score
+        if untried:
+            best = self.rng.choice(untried)
+        return best, node[best]
+
+    def _run_batch(self, states):
+        '''
+        Run one simulation from each state, then evaluate the leaves together
+        and back up the values
+        '''
+        sim = self._sim
+        handlers = sim._action_handlers
+        tree = self.tree
+        paths = []
+        # Player the value of each simulation is for, and the value
+        players = []
+        values = []
+        leaves = []
+        leaf_states = np.empty((len(states), STATE_SIZE), dtype='int8')
+        for s in states:
+            sim.load_array(array('b', s.tobytes()))
+            path = []
+            for _ in range(self.max_depth):
+                if sim.game_over:
+                    break
+                valid = sim.get_valid_actions()
+                if len(valid) == 1:
+                    # Forced, nothing to learn
+                    handlers[valid[0]](sim)
+                    continue
+                p = sim.whose_action
+                key = sim.info_hash(p)
+                node = tree.get(key)
+                if node is None:
+                    node = self._add_node(key)
+                    if path:
+                        # Expanded a new information set, which is the leaf
+                        break
+                else:
+                    tree.move_to_end(key)
+                a, edge = self._select(node, valid)
+                # Virtual loss until the value is backed up
+                edge[_N] += 1
+                edge[_W] -= 1.0
+                path.append((edge, p))
+                handlers[a](sim)
+
+            p = sim.whose_action
+            if sim.game_over:
+                values.append(_terminal_value(sim, p))
+            else:
+                leaf_states[len(leaves)] = np.frombuffer(sim.to_array(), dtype='int8')
+                leaves.append(len(values))
+                values.append(0.0)
+            paths.append(path)
+            players.append(p)
+
+        if leaves:
+            leaf_values = self.value_fn(leaf_states[:len(leaves)])
+            for i, v in zip(leaves, leaf_values):
+                values[i] = float(v)
+
+        for path, q, v in zip(paths, players, values):
+            for edge, p in path:
+                edge[_W] += 1.0 + (v if p == q else -v)
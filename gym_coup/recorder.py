@@ -0,0 +1,203 @@
+import os
+import json
+import gym
+import numpy as np
+
+# One transition, packed to 37 bytes
+#   obs:     Observation of the acting player before the action
+#   mask:    Valid actions of the acting player, bit i = action i
+#   action:  Action taken
+#   reward:  Reward of the acting player
+#   done:    Whether the action ended the game
+#   forced:  Forced actions the env took after the action with auto_forced_moves,
+#            see CoupEnv.forced_actions. Included in reward and done
+#   episode: Episode id
+RECORD_DTYPE = np.dtype([
+    ('obs',     'i1', (21,)),
+    ('mask',    '<u4'),
+    ('action',  'i1'),
+    ('reward',  'i1'),
+    ('done',    '?'),
+    ('forced',  'u1'),
+    ('episode', '<i8'),
+])
+
+# Per episode: first record, number of records
+EPISODE_DTYPE = np.dtype([('start', '<i8'), ('length', '<i8')])
+
+_META = 'meta.json'
+_EPISODES = 'episodes.bin'
+
+
+def _chunk_name(i):
+    return f'transitions_{i:05d}.bin'
+
+
+def pack_mask(mask):
+    '''
+    Pack a length 32 bool action mask into a uint32
+    '''
+    return np.packbits(mask, bitorder='little').view('<u4')[0]
+
+
+def unpack_masks(bits):
+    '''
+    Unpack uint32 action masks into a (N, 32) bool array
+    '''
+    bits = np.ascontiguousarray(bits, dtype='<u4')
+    return np.unpackbits(bits.view('u1').reshape(-1, 4), axis=1, bitorder='little').astype(bool)
+
+
+class TrajectoryRecorder(gym.Wrapper):
+    '''
+    Wrapper around CoupEnv that appends every transition to memory-mapped files
+
+    Records are written to preallocated chunk files of RECORD_DTYPE, and each
+    episode's (start, length) to an index file, all in one directory.
+    Read them back with TrajectoryReader.
+
+    With auto_forced_moves only the actions passed to step() are recorded,
+    each with the number of forced actions after it, so an episode's
+    actions can be re-run with CoupEnv.replay().
+    '''
+    def __init__(self, env, path, chunk_size=1 << 20):
+        '''
+        env:        CoupEnv to record
+        path:       Directory for the files, created if needed. Must not hold a recording
+        chunk_size: Records per chunk file
+        '''
+        super().__init__(env)
+        if os.path.exists(os.path.join(path, _META)):
+            raise FileExistsError(f'{path} already holds a recording')
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.chunk_size = chunk_size
+        self.num_records = 0
+        self.num_episodes = 0
+        self._episode_start = None
+        self._chunk = None
+        self._num_chunks = 0
+        self._episodes = open(os.path.join(path, _EPISODES), 'wb')
+        self._write_meta()
+
+    def _write_meta(self):
+        with open(os.path.join(self.path, _META), 'w') as f:
+            json.dump({'chunk_size': self.chunk_size,
+                       'num_records': self.num_records,
+                       'num_episodes': self.num_episodes,
+                       'dtype': RECORD_DTYPE.descr}, f)
+
+    def _next_chunk(self):
+        if self._chunk is not None:
+            # Full chunks stay readable if the recorder isn't closed
+            self._chunk.flush()
+            self._episodes.flush()
+            self._write_meta()
+        self._chunk = np.memmap(os.path.join(self.path, _chunk_name(self._num_chunks)),
+                                dtype=RECORD_DTYPE, mode='w+', shape=(self.chunk_size,))
+        self._num_chunks += 1
+
+    def _end_episode(self):
+        start, self._episode_start = self._episode_start, None
+        # Skip episodes with no steps, ex: reset twice
+        if start is None or start == self.num_records:
+            return
+        self._episodes.write(np.array([(start, self.num_records - start)], dtype=EPISODE_DTYPE).tobytes())
+        self.num_episodes += 1
+
+    def reset(self, **kwargs):
+        # An unfinished episode is kept, without a done record
+        self._end_episode()
+        self._episode_start = self.num_records
+        return self.env.reset(**kwargs)
+
+    def step(self, action):
+        if self._episode_start is None:
+            raise RuntimeError('Call reset() before step()')
+        p = self.env.game.whose_action
+        obs = self.env.get_obs(p2_view=p == 1)
+        mask = pack_mask(self.env.get_action_mask())
+
+        result = self.env.step(action)
+        reward, done = result[1], result[2]
+        forced = len(result[3].get('forced_actions', ()))
+
+        i = self.num_records % self.chunk_size
+        if i == 0:
+            self._next_chunk()
+        self._chunk[i] = (obs, mask, action, reward, done, forced, self.num_episodes)
+        self.num_records += 1
+        if done:
+            self._end_episode()
+        return result
+
+    def close(self):
+        if self._episodes.closed:
+            return
+        self._end_episode()
+        self._episodes.close()
+        if self._chunk is not None:
+            self._chunk.flush()
+            self._chunk = None
+            # Trim the preallocated tail of the last chunk
+            used = self.num_records - (self._num_chunks - 1) * self.chunk_size
+            os.truncate(os.path.join(self.path, _chunk_name(self._num_chunks - 1)),
+                        used * RECORD_DTYPE.itemsize)
+        self._write_meta()
+        self.env.close()
+
+
+class TrajectoryReader:
+    '''
+    Read-only view of a TrajectoryRecorder directory
+
+    Chunks are memory-mapped, so nothing is loaded until it is accessed.
+    '''
+    def __init__(self, path):
+        with open(os.path.join(path, _META)) as f:
+            meta = json.load(f)
+        self.path = path
+        self.chunk_size = meta['chunk_size']
+        self.num_records = meta['num_records']
+        self.chunks = []
+        for i, start in enumerate(range(0, self.num_records, self.chunk_size)):
+            n = min(self.chunk_size, self.num_records - start)
+            self.chunks.append(np.memmap(os.path.join(path, _chunk_name(i)),
+                                         dtype=RECORD_DTYPE, mode='r', shape=(n,)))
+        self.episodes = np.array([], dtype=EPISODE_DTYPE)
+        if meta['num_episodes']:
+            self.episodes = np.memmap(os.path.join(path, _EPISODES), dtype=EPISODE_DTYPE,
+                                      mode='r', shape=(meta['num_episodes'],))
+
+    def __len__(self):
+        return self.num_records
+
+    def __getitem__(self, i):
+        if not -self.num_records <= i < self.num_records:
+            raise IndexError(f'Record {i} out of range')
+        i %= self.num_records
+        return self.chunks[i // self.chunk_size][i % self.chunk_size]
+
+    def records(self, start=0, stop=None):
+        '''
+        Return records [start, stop). A view when they are in one chunk,
+        otherwise a copy.
+        '''
+        stop = self.num_records if stop is None else min(stop, self.num_records)
+        if start >= stop:
+            return np.empty(0, dtype=RECORD_DTYPE)
+        first, last = start // self.chunk_size, (stop - 1) // self.chunk_size
+        parts = [self.chunks[c][max(start - c * self.chunk_size, 0):stop - c * self.chunk_size]
+                 for c in range(first, last + 1)]
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def episode(self, i):
+        '''
+        Return the records of episode i
+        '''
+        start, length = self.episodes[i]
+        return self.records(int(start), int(start + length))
+
+    def __iter__(self):
+        for c in self.chunks:
+            yield from c
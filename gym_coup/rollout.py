@@ -0,0 +1,293 @@
+import time
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+from gym_coup.envs.coup_env import CoupEnv, NUM_ACTIONS
+from gym_coup.utils.seeding import spawn_seeds
+
+OBS_SIZE = 21
+
+# Fields of one transition: (shape, dtype)
+#   obs:    Observation of the acting player before the action
+#   mask:   Valid actions of the acting player
+#   action: Action taken
+#   reward: Reward of the acting player. The opponent gets -reward
+#   done:   Whether the action ended the game
+#   player: Who took the action, 0 = P1
+#   env_id: Which game the action was taken in, unique across workers:
+#           worker index * envs_per_worker + the game's index in its worker
+TRANSITION_FIELDS = {
+    'obs':    ((OBS_SIZE,), 'int8'),
+    'mask':   ((NUM_ACTIONS,), 'bool'),
+    'action': ((), 'int8'),
+    'reward': ((), 'int8'),
+    'done':   ((), 'bool'),
+    'player': ((), 'int8'),
+    'env_id': ((), 'int32'),
+}
+
+# Header: write count, read count
+_HEADER_SIZE = 2 * 8
+
+
+def random_policy(obs, masks):
+    '''
+    Pick a uniformly random valid action for each game
+
+    obs:   (N, 21) observations of the players to act
+    masks: (N, 32) valid actions
+
+    Return (N,) actions
+    '''
+    return (np.random.random(masks.shape) * masks).argmax(axis=1)
+
+
+class RingBuffer:
+    '''
+    Single-producer single-consumer ring of transitions in shared memory
+
+    The writer blocks when the ring is full, so no transition is dropped.
+    The reader gets views into the shared memory, valid until it advances.
+    '''
+    def __init__(self, capacity, name=None):
+        '''
+        capacity: Max number of unread transitions
+        name:     Attach to an existing buffer instead of creating one
+        '''
+        self.capacity = capacity
+        size = _HEADER_SIZE + sum(capacity * int(np.prod(shape, dtype=int)) * np.dtype(dtype).itemsize
+                                  for shape, dtype in TRANSITION_FIELDS.values())
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            self.owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.owner = False
+        self._map()
+        if self.owner:
+            self.counts[:] = 0
+
+    def _map(self):
+        buf = self.shm.buf
+        self.counts = np.ndarray((2,), dtype='int64', buffer=buf)
+        self.fields = {}
+        offset = _HEADER_SIZE
+        for k, (shape, dtype) in TRANSITION_FIELDS.items():
+            a = np.ndarray((self.capacity,) + shape, dtype=dtype, buffer=buf, offset=offset)
+            self.fields[k] = a
+            offset += a.nbytes
+
+    def __getstate__(self):
+        return (self.capacity, self.shm.name)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def free(self):
+        return self.capacity - (self.counts[0] - self.counts[1])
+
+    def available(self):
+        return int(self.counts[0] - self.counts[1])
+
+    def write(self, stop=None, **transitions):
+        '''
+        Append a batch of transitions, waiting for the reader if the ring is full
+
+        stop:        Optional Event. Give up waiting when it is set
+        transitions: One array per field of TRANSITION_FIELDS, same length
+
+        Return whether the batch was written
+        '''
+        n = len(transitions['action'])
+        while self.free() < n:
+            if stop is not None and stop.is_set():
+                return False
+            time.sleep(0.0001)
+
+        start = self.counts[0]
+        idx = (start + np.arange(n)) % self.capacity
+        for k, a in self.fields.items():
+            a[idx] = transitions[k]
+        # Publish only after the data is in place
+        self.counts[0] = start + n
+        return True
+
+    def peek(self, max_n=None):
+        '''
+        Return views of the oldest unread transitions, as a dict of field arrays.
+        The views are contiguous, so they stop at the end of the ring.
+        '''
+        start = int(self.counts[1])
+        n = self.available()
+        if max_n is not None:
+            n = min(n, max_n)
+        i = start % self.capacity
+        n = min(n, self.capacity - i)
+        return {k: a[i:i + n] for k, a in self.fields.items()}
+
+    def advance(self, n):
+        '''
+        Release n transitions to the writer
+        '''
+        self.counts[1] += n
+
+    def close(self):
+        self.fields = None
+        self.counts = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def _worker(buffer, policy, num_envs, first_env_id, seed, env_kwargs, stop):
+    seeds = spawn_seeds(seed, num_envs + 1)
+    envs = [CoupEnv(**env_kwargs) for _ in range(num_envs)]
+    for env, s in zip(envs, seeds):
+        env.reset(seed=s)
+    # Workers are forked with the same global NumPy RNG, which policies may use
+    np.random.seed(seeds[-1] % 2**32)
+
+    obs = np.empty((num_envs, OBS_SIZE), dtype='int8')
+    masks = np.empty((num_envs, NUM_ACTIONS), dtype=bool)
+    players = np.empty(num_envs, dtype='int8')
+    rewards = np.empty(num_envs, dtype='int8')
+    dones = np.empty(num_envs, dtype=bool)
+    env_ids = np.arange(first_env_id, first_env_id + num_envs, dtype='int32')
+
+    while not stop.is_set():
+        for i, env in enumerate(envs):
+            p = env.game.whose_action
+            players[i] = p
+            obs[i] = env.get_obs(p2_view=p == 1)
+            masks[i] = env.get_action_mask()
+
+        actions = np.asarray(policy(obs, masks))
+
+        for i, env in enumerate(envs):
+            _, rewards[i], dones[i], _ = env.step(actions[i])
+            if dones[i]:
+                env.reset()
+
+        if not buffer.write(stop=stop, obs=obs, mask=masks, action=actions, reward=rewards,
+                            done=dones, player=players, env_id=env_ids):
+            break
+
+
+class RolloutEngine:
+    '''
+    Self-play rollouts in worker processes
+
+    Each worker steps its own set of CoupEnv games, picking every action
+    with one batched policy call, and writes the transitions into its own
+    shared memory RingBuffer. The learner reads them with batches().
+    '''
+    def __init__(self, policy=random_policy, num_workers=4, envs_per_worker=16,
+                 capacity=1 << 16, seed=None, env_kwargs=None):
+        '''
+        policy:          Picklable callable (obs (N, 21), masks (N, 32)) -> (N,) actions
+        num_workers:     Number of worker processes
+        envs_per_worker: Number of games stepped by each worker
+        capacity:        Transitions held by each worker's ring buffer
+        seed:            Seed for all workers, see gym_coup.utils.spawn_seeds
+        env_kwargs:      Keyword args for each CoupEnv.
+                         Defaults to headless mode with no invariant checks
+        '''
+        if capacity < envs_per_worker:
+            raise ValueError('capacity must hold at least one step of every env')
+        self.policy = policy
+        self.num_workers = num_workers
+        self.envs_per_worker = envs_per_worker
+        self.capacity = capacity
+        self.seeds = spawn_seeds(seed, num_workers)
+        self.env_kwargs = {'check_invariants': 'off', 'log': False}
+        if env_kwargs is not None:
+            self.env_kwargs.update(env_kwargs)
+        self.buffers = []
+        self.processes = []
+        self._stop = None
+
+    def start(self):
+        ctx = mp.get_context()
+        self._stop = ctx.Event()
+        self.buffers = [RingBuffer(self.capacity) for _ in range(self.num_workers)]
+        for i in range(self.num_workers):
+            p = ctx.Process(target=_worker,
+                            args=(self.buffers[i], self.policy, self.envs_per_worker,
+                                  i * self.envs_per_worker, self.seeds[i], self.env_kwargs, self._stop),
+                            daemon=True)
+            p.start()
+            self.processes.append(p)
+        return self
+
+    def batches(self, max_n=None):
+        '''
+        Yield the unread transitions of every worker in turn, forever.
+        Each batch is a dict of field arrays viewing the shared memory.
+        They are only valid until the next batch is requested,
+        so copy anything that needs to be kept.
+
+        max_n: Max transitions per batch
+        '''
+        while True:
+            empty = True
+            for b in self.buffers:
+                batch = b.peek(max_n)
+                n = len(batch['action'])
+                if n == 0:
+                    continue
+                empty = False
+                try:
+                    yield batch
+                finally:
+                    b.advance(n)
+            if empty:
+                self._check_workers()
+                time.sleep(0.0001)
+
+    def collect(self, n):
+        '''
+        Return a copy of the next n transitions as a dict of field arrays
+        '''
+        out = {k: np.empty((n,) + shape, dtype=dtype) for k, (shape, dtype) in TRANSITION_FIELDS.items()}
+        i = 0
+        while i < n:
+            got = False
+            for b in self.buffers:
+                batch = b.peek(n - i)
+                m = len(batch['action'])
+                if m == 0:
+                    continue
+                got = True
+                for k, a in out.items():
+                    a[i:i + m] = batch[k]
+                b.advance(m)
+                i += m
+                if i == n:
+                    break
+            if not got:
+                self._check_workers()
+                time.sleep(0.0001)
+        return out
+
+    def _check_workers(self):
+        for p in self.processes:
+            if p.exitcode is not None and p.exitcode != 0:
+                raise RuntimeError(f'Rollout worker exited with code {p.exitcode}')
+
+    def close(self):
+        if self._stop is not None:
+            self._stop.set()
+        for p in self.processes:
+            p.join(timeout=5)
+            if p.is_alive():
+                p.terminate()
+        for b in self.buffers:
+            b.close()
+        self.processes = []
+        self.buffers = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.close()
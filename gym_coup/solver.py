@@ -0,0 +1,642 @@
+'''
+Exact solver for the perfect information game
+
+Both players see each other's cards, as with is_partial_obs=False.
+Only the deck order is hidden, so every shuffle is a chance node:
+each card drawn from the deck is one of the cards left in it, picked
+uniformly at random.
+
+Games can repeat positions forever, ex: both players keep stealing
+from each other, so positions are not solved by a plain recursive search.
+Instead the solver builds the graph of every position reachable from
+the one asked about and runs value iteration over it. A game that never
+ends is worth 0 to both players, same as a draw.
+
+Face up cards are never turned back down, so turn starts are solved in
+stages, one per set of face up cards, see _stage(). A stage only leads to
+itself or to stages with more cards face up, which are solved first and
+then stand in as constants. Only one stage's graph is built at a time,
+apart from the stages waiting on it, and the total number of nodes is
+bounded by max_graph_size. Turn starts that only differ in coins play the
+same turn with their coins shifted, so each turn is expanded once per
+_coin_class() and copied.
+
+Positions at the start of a turn are keyed on a canonical encoding, see
+_canonical(), and solved values are kept in a transposition table that
+later queries reuse. The table is bounded; the oldest entries are evicted
+first, and are solved again if they are needed again.
+'''
+import logging
+from array import array
+import numpy as np
+from gym_coup.envs.coup_env import *
+from gym_coup.envs.compact_game import CompactGame
+
+logger = logging.getLogger(__name__)
+
+# Node kinds of the position graph
+_MAX    = 0 # P1 chooses
+_MIN    = 1 # P2 chooses
+_CHANCE = 2 # A card is drawn
+_LEAF   = 3 # Start of a turn, valued by value iteration or by solving a later stage
+_CONST  = 4 # Game over, or a turn start already in the table
+
+
+class _NeedDraw(Exception):
+    pass
+
+
+class _ChanceGame(CompactGame):
+    '''
+    CompactGame that draws a scripted sequence of card values
+    instead of the top of the deck. The deck is kept sorted,
+    since its order is only a chance outcome.
+    '''
+    __slots__ = ('script', 'drawn')
+
+    def __init__(self, state, script=()):
+        self.state = state
+        self.script = script
+        self.drawn = 0
+        self.turn_count = 0
+        self.num_human_players = 0
+        self.rng = None
+
+    def draw_card(self):
+        if self.drawn == len(self.script):
+            raise _NeedDraw
+        v = self.script[self.drawn]
+        self.drawn += 1
+        s = self.state
+        n = s[DECK_SIZE]
+        deck = s[DECK:DECK + n]
+        deck.remove(v)
+        deck.append(0)
+        s[DECK:DECK + n] = deck
+        s[DECK_SIZE] = n - 1
+        return v
+
+    def shuffle_deck(self):
+        s = self.state
+        end = DECK + s[DECK_SIZE]
+        s[DECK:end] = array('b', sorted(s[DECK:end]))
+
+
+def _game_state(game):
+    '''
+    Return the flat state of a Game or CompactGame with the deck sorted
+    and unused deck slots cleared
+    '''
+    s = array('b', game.to_array())
+    n = s[DECK_SIZE]
+    s[DECK:DECK + n] = array('b', sorted(s[DECK:DECK + n]))
+    s[DECK + n:STATE_SIZE] = array('b', bytes(STATE_SIZE - DECK - n))
+    return s
+
+
+def _canonical(state):
+    '''
+    Canonical encoding of a state at the start of a turn.
+    Players are swapped so that P1 takes the turn, and the last actions
+    are cleared since nothing reads them before they are replaced.
+
+    Return (key, sign), sign = -1 if the players were swapped
+    '''
+    s = array('b', state)
+    sign = 1
+    if s[WHOSE_TURN] == 1:
+        sign = -1
+        for start, size in ((CARDS, 4), (FACE_UP, 4), (COINS, 1), (LAST_ACTION, 1), (LOST_CHALLENGE, 1)):
+            a = s[start:start + size]
+            s[start:start + size] = s[start + size:start + 2 * size]
+            s[start + size:start + 2 * size] = a
+        s[WHOSE_TURN] = 0
+        s[WHOSE_ACTION] = 1 - s[WHOSE_ACTION]
+    s[LAST_ACTION] = NONE
+    s[LAST_ACTION + 1] = NONE
+    return bytes(s), sign
+
+
+def _stage(key):
+    '''
+    Stage of a canonical turn start: its face up cards, sorted
+    so that it doesn't depend on which player holds them
+    '''
+    return tuple(sorted(key[CARDS + i] for i in range(8) if key[FACE_UP + i] == 1))
+
+
+# Actions that never read or change coins
+_COINLESS_ACTIONS = frozenset([
+    EXCHANGE, LOSE_CARD_1, LOSE_CARD_2,
+    PASS_FA_BLOCK, PASS_EXCHANGE, PASS_ASSASSINATE_BLOCK, PASS_STEAL_BLOCK,
+    BLOCK_FA, BLOCK_ASSASSINATE, BLOCK_STEAL,
+    CHALLENGE_EXCHANGE, CHALLENGE_ASSASSINATE_BLOCK,
+    EXCHANGE_RETURN_12, EXCHANGE_RETURN_13, EXCHANGE_RETURN_14,
+    EXCHANGE_RETURN_23, EXCHANGE_RETURN_24, EXCHANGE_RETURN_34,
+])
+
+
+def _p1_wins(state):
+    return any(state[CARDS + i] != NONE and not state[FACE_UP + i] for i in range(4))
+
+
+def _outcomes(state, action):
+    '''
+    Take action from state, bytes in the flat state layout,
+    drawing every possible card wherever one is drawn
+
+    Return list of (next state bytes, probability)
+    '''
+    results = {}
+    stack = [((), 1.0)]
+    while stack:
+        script, p = stack.pop()
+        g = _ChanceGame(array('b', state), script)
+        try:
+            g._action_handlers[action](g)
+        except _NeedDraw:
+            # Branch on the card drawn next
+            s = g.state
+            n = s[DECK_SIZE]
+            deck = s[DECK:DECK + n].tolist()
+            for v in set(deck):
+                stack.append((script + (v,), p * deck.count(v) / n))
+            continue
+
+        s = g.state
+        for c in (CARDS + 2, CARDS + 6):
+            # Cards drawn for an exchange are interchangeable
+            if s[c] != NONE and s[c] > s[c + 1]:
+                s[c], s[c + 1] = s[c + 1], s[c]
+        # So are the cards in the deck, which may have had cards returned to its end
+        n = s[DECK_SIZE]
+        s[DECK:DECK + n] = array('b', sorted(s[DECK:DECK + n]))
+        k = s.tobytes()
+        results[k] = results.get(k, 0.0) + p
+    return list(results.items())
+
+
+class _Nodes:
+    '''
+    Nodes and edges of positions, as flat arrays. Each node's edges are
+    contiguous. Subclasses decide what end() returns for the states that end
+    a turn, ie game over or the start of the next turn.
+    '''
+    def __init__(self, coinless, max_nodes):
+        '''
+        coinless:  Shared cache of outcomes(), see _Graph
+        max_nodes: Raise a RuntimeError once there are more nodes than this
+        '''
+        self.coinless = coinless
+        self.max_nodes = max_nodes
+        self.kind = array('b')
+        self.const = array('d')
+        self.leaf_tb = array('q')
+        self.edge_start = array('q')
+        self.edge_count = array('q')
+        self.edge_child = array('q')
+        self.edge_prob = array('d')
+        self.nodes = {}       # In-turn state: node
+        self._stack = []
+
+    def _check_size(self, num_new):
+        if len(self.kind) + num_new > self.max_nodes:
+            raise RuntimeError(f'Solver: position graph has more than {self.max_nodes} nodes, '
+                               f'raise max_graph_size to solve this position')
+
+    def _add(self, kind, const=0.0, tb=-1):
+        self._check_size(1)
+        self.kind.append(kind)
+        self.const.append(const)
+        self.leaf_tb.append(tb)
+        self.edge_start.append(0)
+        self.edge_count.append(0)
+        return len(self.kind) - 1
+
+    def node(self, k):
+        '''
+        Return the node of state bytes k, adding it to expand later if it is new
+        '''
+        if k[GAME_OVER] or k[IS_TURN_BEGIN]:
+            return self.end(k)
+        n = self.nodes.get(k)
+        if n is None:
+            n = self.nodes[k] = self.add_decision(k)
+        return n
+
+    def add_decision(self, k):
+        '''
+        Add a node where the whose_action of state bytes k chooses, to expand later
+        '''
+        n = self._add(_MAX if k[WHOSE_ACTION] == 0 else _MIN)
+        self._stack.append((n, k))
+        return n
+
+    def outcomes(self, k, action):
+        if action not in _COINLESS_ACTIONS:
+            return _outcomes(k, action)
+        pre, coins, post = k[:COINS], k[COINS:COINS + 2], k[COINS + 2:]
+        results = self.coinless.get((pre, post, action))
+        if results is None:
+            results = [(s[:COINS], s[COINS + 2:], p) for s, p in _outcomes(pre + bytes(2) + post, action)]
+            self.coinless[(pre, post, action)] = results
+        return [(pre + coins + post, p) for pre, post, p in results]
+
+    def _set_edges(self, n, children, probs):
+        self.edge_start[n] = len(self.edge_child)
+        self.edge_count[n] = len(children)
+        self.edge_child.extend(children)
+        self.edge_prob.extend(probs)
+
+    def expand(self):
+        '''
+        Expand every added node, and every node reachable from them
+        '''
+        while self._stack:
+            n, k = self._stack.pop()
+            children = []
+            for a in _ChanceGame(array('b', k)).get_valid_actions():
+                outcomes = self.outcomes(k, a)
+                if len(outcomes) == 1:
+                    children.append(self.node(outcomes[0][0]))
+                else:
+                    c = self._add(_CHANCE)
+                    self._set_edges(c, [self.node(s) for s, _ in outcomes], [p for _, p in outcomes])
+                    children.append(c)
+            self._set_edges(n, children, [1.0] * len(children))
+
+
+def _coin_class(key):
+    '''
+    Class of a canonical turn start: the key with the coins replaced by the
+    turn player's coin bucket and the opponent's coins up to 2, everything
+    the turn's valid actions and steals read. Turn starts of the same class
+    play the same turn, with the coins of every position shifted
+    '''
+    return key[:COINS] + bytes((COIN_BUCKETS[min(key[COINS], 10)], min(key[COINS + 1], 2))) + key[COINS + 2:]
+
+
+class _Turn(_Nodes):
+    '''
+    Every position of one turn, from a canonical turn start to the states that
+    end it, expanded once per _coin_class() and copied by _Graph.add_turn().
+    The turn start is node 0, and an edge to the i-th state in ends is -1 - i.
+    '''
+    def __init__(self, key, coinless, max_nodes):
+        super().__init__(coinless, max_nodes)
+        self.coins = key[COINS], key[COINS + 1]
+        # (value, None, 0) for game over, (canonical key, stage, sign) for a turn start
+        self.ends = []
+        self._end_index = {}
+        self.add_decision(key)
+        self.expand()
+        self.nodes = self._end_index = None
+
+    def end(self, k):
+        i = self._end_index.get(k)
+        if i is None:
+            i = self._end_index[k] = len(self.ends)
+            if k[GAME_OVER]:
+                self.ends.append((1.0 if _p1_wins(array('b', k)) else -1.0, None, 0))
+            else:
+                key, sign = _canonical(k)
+                self.ends.append((key, _stage(key), sign))
+        return -1 - i
+
+
+class _Graph(_Nodes):
+    '''
+    Positions reachable from some states, with every turn start of the stage
+    not in the table as a _LEAF to solve, and every turn start of a later
+    stage as a _LEAF to fill in once that stage is solved.
+    Node values are from P1's view.
+    '''
+    def __init__(self, table, stage, max_nodes):
+        '''
+        table:     Solved canonical turn starts
+        stage:     _stage() of the turn starts expanded in this graph
+        max_nodes: Raise a RuntimeError once the graph has more nodes than this
+        '''
+        # (State without coins, action): _outcomes() without coins, shared with the turns.
+        # Positions that only differ in coins share the rest of an exchange or lost card
+        super().__init__({}, max_nodes)
+        self.table = table
+        self.stage = stage
+        self.tb_index = {}    # Canonical turn start: index
+        self.tb_keys = []
+        self.tb_roots = []    # Index: node of its expanded state, once expanded
+        self.turn_nodes = {}  # (canonical turn start, sign): node
+        self.later = {}       # (canonical turn start of a later stage, sign): node
+        self.consts = {}      # Value: node
+        self.canonical = {}   # Turn start state: (_canonical() key, _stage(), sign)
+        self.turns = {}       # _coin_class(): _Turn
+
+    def _const(self, value):
+        n = self.consts.get(value)
+        if n is None:
+            n = self.consts[value] = self._add(_CONST, value)
+        return n
+
+    def end(self, k):
+        if k[GAME_OVER]:
+            return self._const(1.0 if _p1_wins(array('b', k)) else -1.0)
+        c = self.canonical.get(k)
+        if c is None:
+            key, sign = _canonical(k)
+            c = self.canonical[k] = key, _stage(key), sign
+        return self.turn_start(*c)
+
+    def turn_start(self, key, stage, sign):
+        '''
+        Return the node of canonical turn start key, from P1's view if sign = 1
+        '''
+        n = self.turn_nodes.get((key, sign))
+        if n is not None:
+            return n
+        v = self.table.get(key)
+        if v is not None:
+            n = self._const(sign * v)
+        elif stage != self.stage:
+            n = self.later[(key, sign)] = self._add(_LEAF)
+        else:
+            n = self._add(_LEAF, sign, self.add_turn_start(key))
+        self.turn_nodes[(key, sign)] = n
+        return n
+
+    def add_turn_start(self, key):
+        '''
+        Add canonical turn start key to expand, return its index
+        '''
+        i = self.tb_index.get(key)
+        if i is None:
+            i = self.tb_index[key] = len(self.tb_keys)
+            self.tb_keys.append(key)
+            self.tb_roots.append(-1)
+        return i
+
+    def add_turn(self, key):
+        '''
+        Add the positions of the turn from canonical turn start key,
+        copied from the _Turn of its _coin_class(). Return the node of key
+        '''
+        c = _coin_class(key)
+        turn = self.turns.get(c)
+        if turn is None:
+            turn = self.turns[c] = _Turn(key, self.coinless, self.max_nodes)
+        d0 = key[COINS] - turn.coins[0]
+        d1 = key[COINS + 1] - turn.coins[1]
+
+        ends = []
+        for k, stage, sign in turn.ends:
+            if stage is None:
+                ends.append(self._const(k))
+                continue
+            if d0 or d1:
+                # The next turn start has the players swapped if sign = -1
+                s0, s1 = (d0, d1) if sign == 1 else (d1, d0)
+                k = k[:COINS] + bytes((k[COINS] + s0, k[COINS + 1] + s1)) + k[COINS + 2:]
+            ends.append(self.turn_start(k, stage, sign))
+
+        self._check_size(len(turn.kind))
+        base = len(self.kind)
+        edge_base = len(self.edge_child)
+        self.kind.extend(turn.kind)
+        self.const.extend(turn.const)
+        self.leaf_tb.extend(turn.leaf_tb)
+        self.edge_start.extend([s + edge_base for s in turn.edge_start])
+        self.edge_count.extend(turn.edge_count)
+        self.edge_child.extend([c + base if c >= 0 else ends[-1 - c] for c in turn.edge_child])
+        self.edge_prob.extend(turn.edge_prob)
+        return base
+
+    def expand_turn_starts(self):
+        '''
+        Expand every turn start leaf of the stage, until all positions
+        reachable in the stage are in the graph
+        '''
+        self.expand()
+        i = 0
+        while i < len(self.tb_keys):
+            # Canonical turn starts are P1's turn, so they are valued from the turn player's view
+            self.tb_roots[i] = self.add_turn(self.tb_keys[i])
+            i += 1
+            if i % 10000 == 0:
+                logger.debug(f'Solver: stage {self.stage}, {len(self.tb_keys)} turn starts, {len(self.kind)} nodes')
+
+    def set_later(self, values):
+        '''
+        Fill in the turn starts of later stages, values {canonical turn start: value}
+        '''
+        for (key, sign), n in self.later.items():
+            self.kind[n] = _CONST
+            self.const[n] = sign * values[key]
+
+    def compile(self):
+        '''
+        Convert to arrays, with the internal nodes grouped by height
+        so each group only depends on lower ones
+        '''
+        self.a_kind = np.array(self.kind, dtype='int8')
+        self.a_const = np.array(self.const)
+        self.a_child = np.array(self.edge_child, dtype='int64')
+        self.a_prob = np.array(self.edge_prob)
+        start = np.array(self.edge_start, dtype='int64')
+        count = np.array(self.edge_count, dtype='int64')
+        internal = np.flatnonzero(self.a_kind <= _CHANCE)
+        # Each node's edges are contiguous, so ordered by start they tile the edge arrays
+        internal = internal[np.argsort(start[internal], kind='stable')]
+
+        height = np.zeros(len(self.kind), dtype='int64')
+        if len(internal):
+            offsets = start[internal]
+            while True:
+                h = np.maximum.reduceat(height[self.a_child], offsets) + 1
+                if (h == height[internal]).all():
+                    break
+                height[internal] = h
+
+        # Nodes of one height and kind, with their children and reduction
+        self.groups = []
+        for h in range(1, int(height.max(initial=0)) + 1):
+            at_height = internal[height[internal] == h]
+            for kind, ufunc in ((_MAX, np.maximum), (_MIN, np.minimum), (_CHANCE, np.add)):
+                nodes = at_height[self.a_kind[at_height] == kind]
+                if not len(nodes):
+                    continue
+                c = count[nodes]
+                offsets = np.cumsum(c) - c
+                edges = np.repeat(start[nodes] - offsets, c) + np.arange(c.sum())
+                prob = self.a_prob[edges] if kind == _CHANCE else None
+                self.groups.append((nodes, ufunc, self.a_child[edges], prob, offsets))
+
+        self.leaf_nodes = np.flatnonzero(self.a_kind == _LEAF)
+        leaf_tb = np.array(self.leaf_tb, dtype='int64')[self.leaf_nodes]
+        self.leaf_tb_index = leaf_tb
+        self.leaf_sign = self.a_const[self.leaf_nodes]
+        self.roots = np.array(self.tb_roots, dtype='int64')
+
+    def evaluate(self, tb_values=None, leaf_values=None):
+        '''
+        Return values of every node, given the values of the turn start leaves,
+        either tb_values from the turn player's view, or leaf_values for every leaf
+        '''
+        vals = self.a_const.copy()
+        if leaf_values is not None:
+            vals[self.leaf_nodes] = leaf_values
+        else:
+            vals[self.leaf_nodes] = self.leaf_sign * tb_values[self.leaf_tb_index]
+        for nodes, ufunc, children, prob, offsets in self.groups:
+            cv = vals[children]
+            if prob is not None:
+                cv *= prob
+            vals[nodes] = ufunc.reduceat(cv, offsets)
+        return vals
+
+    def children(self, n):
+        s = self.edge_start[n]
+        return self.edge_child[s:s + self.edge_count[n]]
+
+
+class Solver:
+    '''
+    Exact solver for the perfect information game, see the module docs
+
+    Values are from the view of the player choosing: 1 = win, -1 = loss,
+    and in between the expected result under optimal play by both players.
+    '''
+    def __init__(self, max_table_size=1 << 22, max_graph_size=1 << 23, tol=1e-9, max_iterations=100000):
+        '''
+        max_table_size: Max turn starts kept in the table
+        max_graph_size: Max nodes of the position graphs alive at once. A query that
+                        needs more raises a RuntimeError instead of running out of memory
+        tol:            Value iteration stops when no value changes by more than this
+        max_iterations: Value iteration stops after this many sweeps
+        '''
+        self.max_table_size = max_table_size
+        self.max_graph_size = max_graph_size
+        self.tol = tol
+        self.max_iterations = max_iterations
+        # Canonical turn start: value for the player whose turn it is
+        self.table = {}
+
+    def _search(self, game, exact):
+        '''
+        Return (state, actions, graph, root, lo, hi) with lo and hi the
+        bounds of every node's value from P1's view.
+
+        exact: Whether every action must be solved exactly. Otherwise only
+               the value of the position and its optimal action are exact
+        '''
+        state = _game_state(game)
+        actions = _ChanceGame(state).get_valid_actions()
+        graph = _Graph(self.table, _stage(state), self.max_graph_size)
+        root = graph.add_decision(state.tobytes())
+        graph.expand()
+        graph.compile()
+
+        # The rest of this turn may decide the game,
+        # ex: a coup that wins right away
+        lo = hi = None
+        if not exact:
+            lo = graph.evaluate(leaf_values=-1.0)
+            hi = graph.evaluate(leaf_values=1.0)
+        if exact or lo[root] != hi[root]:
+            lo = hi = graph.evaluate(self._solve_graph(graph))
+        return state, actions, graph, root, lo, hi
+
+    def action_values(self, game):
+        '''
+        Return {action: value} of every valid action of game,
+        a Game or CompactGame, for the player choosing
+        '''
+        if game.game_over:
+            return {}
+        state, actions, graph, root, vals, _ = self._search(game, exact=True)
+        sign = 1 if state[WHOSE_ACTION] == 0 else -1
+        return {a: sign * vals[c] for a, c in zip(actions, graph.children(root))}
+
+    def solve(self, game):
+        '''
+        Return (value, optimal action) of game, a Game or CompactGame,
+        for the player choosing. The action is None if the game is over.
+        '''
+        if game.game_over:
+            state = _game_state(game)
+            sign = 1 if state[WHOSE_ACTION] == 0 else -1
+            return sign * (1.0 if _p1_wins(state) else -1.0), None
+
+        state, actions, graph, root, lo, hi = self._search(game, exact=False)
+        # An action is optimal if its bound from the chooser's side reaches the value
+        if state[WHOSE_ACTION] == 0:
+            value, bounds = lo[root], lo
+        else:
+            value, bounds = hi[root], hi
+        for a, c in zip(actions, graph.children(root)):
+            if bounds[c] == value:
+                break
+        sign = 1 if state[WHOSE_ACTION] == 0 else -1
+        return sign * value, a
+
+    def _solve_graph(self, graph):
+        '''
+        Expand the turn starts of graph's stage, solve the later stages
+        they lead to, then value iterate over the stage
+
+        Return the values of graph.tb_keys
+        '''
+        graph.expand_turn_starts()
+        stages = {}
+        for key, _ in graph.later:
+            stages.setdefault(_stage(key), {})[key] = None
+        later = {}
+        # Stages with more face up cards first, they may be reached from the others
+        for stage, keys in sorted(stages.items(), key=lambda s: (-len(s[0]), s[0])):
+            missing = []
+            for key in keys:
+                v = self.table.get(key)
+                if v is None:
+                    missing.append(key)
+                else:
+                    later[key] = v
+            if missing:
+                later.update(zip(missing, self._solve_stage(missing, graph.max_nodes - len(graph.kind))))
+        graph.set_later(later)
+
+        graph.compile()
+        values = self._iterate(graph)
+        self._store(graph, values)
+        return values
+
+    def _solve_stage(self, keys, max_nodes):
+        '''
+        Solve canonical turn starts keys, all of one stage, in a new graph
+        of at most max_nodes nodes
+
+        Return their values
+        '''
+        graph = _Graph(self.table, _stage(keys[0]), max_nodes)
+        for key in keys:
+            graph.add_turn_start(key)
+        values = self._solve_graph(graph)
+        return [values[graph.tb_index[key]] for key in keys]
+
+    def _iterate(self, graph):
+        values = np.zeros(len(graph.tb_keys))
+        for i in range(self.max_iterations):
+            new = graph.evaluate(values)[graph.roots]
+            delta = np.abs(new - values).max(initial=0)
+            values = new
+            if delta <= self.tol:
+                logger.debug(f'Solver: stage {graph.stage}, {len(values)} turn starts converged in {i + 1} iterations')
+                return values
+        logger.warning(f'Solver: value iteration did not converge, last change {delta}')
+        return values
+
+    def _store(self, graph, values):
+        for k, v in zip(graph.tb_keys, values.tolist()):
+            self.table[k] = v
+        # Dicts keep insertion order, so the first keys are the oldest
+        excess = len(self.table) - self.max_table_size
+        if excess > 0:
+            for k in list(self.table)[:excess]:
+                del self.table[k]
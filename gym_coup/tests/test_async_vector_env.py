@@ -0,0 +1,81 @@
+import unittest
+import numpy as np
+from gym_coup.envs.coup_env import *
+from gym_coup.envs.coup_vector_env import CoupVectorEnv
+from gym_coup.envs.async_vector_env import AsyncCoupVectorEnv, _STEP
+from gym_coup.utils import spawn_seeds
+
+
+def random_actions(rng, masks):
+    return (rng.random(masks.shape) * masks).argmax(axis=1)
+
+
+class TestAsyncCoupVectorEnv(unittest.TestCase):
+    def setUp(self):
+        self.env = AsyncCoupVectorEnv(6, num_workers=2, seed=0)
+
+    def tearDown(self):
+        self.env.close()
+
+    def test_matches_vector_env(self):
+        # Each worker steps a slice with its own CoupVectorEnv, seeded from the spawned seeds
+        venvs = [CoupVectorEnv(3, seed=s) for s in spawn_seeds(0, 2)]
+        obs, masks = self.env.reset()
+        expected = [v.reset() for v in venvs]
+        self.assertTrue((obs == np.concatenate([e[0] for e in expected])).all())
+        self.assertTrue((masks == np.concatenate([e[1] for e in expected])).all())
+
+        rng = np.random.default_rng(0)
+        num_done = 0
+        for _ in range(300):
+            actions = random_actions(rng, masks)
+            self.env.step_async(actions)
+            expected = [v.step(actions[3 * i:3 * i + 3]) for i, v in enumerate(venvs)]
+            obs, rewards, dones, masks, info = self.env.step_wait()
+            for k, x in enumerate([obs, rewards, dones, masks, info['acting_player']]):
+                e = np.concatenate([e[k] if k < 4 else e[4]['acting_player'] for e in expected])
+                self.assertTrue((x == e).all())
+            if dones.any():
+                e = np.concatenate([e[4].get('final_obs', np.zeros((3, 21), dtype='int8')) for e in expected])
+                self.assertTrue((info['final_obs'] == e).all())
+            num_done += dones.sum()
+        self.assertGreater(num_done, 0)
+
+    def test_reset_seed(self):
+        obs1, _ = self.env.reset(seed=3)
+        obs1 = obs1.copy()
+        self.env.step(np.full(6, EXCHANGE))
+        obs2, _ = self.env.reset(seed=3)
+        self.assertTrue((obs1 == obs2).all())
+
+    def test_order(self):
+        self.env.reset()
+        with self.assertRaises(RuntimeError):
+            self.env.step_wait()
+        self.env.step_async(np.full(6, INCOME))
+        with self.assertRaises(RuntimeError):
+            self.env.step_async(np.full(6, INCOME))
+        self.env.step_wait()
+
+    def test_invalid_action(self):
+        obs, _ = self.env.reset(seed=1)
+        obs = obs.copy()
+        for a in (COUP, -1, NUM_ACTIONS):
+            with self.assertRaises(RuntimeError):
+                self.env.step(np.full(6, a))
+        with self.assertRaises(RuntimeError):
+            self.env.step(np.full(5, INCOME))
+        # No game was stepped, and the env can go on
+        self.assertTrue((self.env.reset(seed=1)[0] == obs).all())
+        self.env.step(np.full(6, INCOME))
+
+    def test_worker_error(self):
+        self.env.reset()
+        # Skip the parent's checks, so the workers fail
+        self.env._arrays['actions'][:] = COUP
+        self.env._send(_STEP)
+        with self.assertRaisesRegex(RuntimeError, 'Env worker 0 failed: RuntimeError: .*invalid action'):
+            self.env.step_wait()
+        # The failure is cleared by the next command
+        self.env.reset()
+        self.env.step(np.full(6, INCOME))
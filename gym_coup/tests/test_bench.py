@@ -0,0 +1,50 @@
+import json
+import os
+import tempfile
+import unittest
+from gym_coup.bench import *
+
+
+class TestBench(unittest.TestCase):
+    def test_run(self):
+        results = run_benchmarks(['env_step', 'get_valid_actions', 'vector_step'], duration=0.01, repeat=1)
+        self.assertListEqual(list(results), ['env_step', 'get_valid_actions', 'vector_step'])
+        for r in results.values():
+            self.assertGreater(r['value'], 0)
+        self.assertFalse(results['get_valid_actions']['higher_is_better'])
+
+        with self.assertRaises(ValueError):
+            run_benchmarks(['nope'], duration=0.01, repeat=1)
+
+    def test_compare(self):
+        baseline = {'a': {'value': 100, 'unit': 'steps/s', 'higher_is_better': True},
+                    'b': {'value': 10, 'unit': 'us', 'higher_is_better': False}}
+        results = {'a': {'value': 95, 'unit': 'steps/s', 'higher_is_better': True},
+                   'b': {'value': 10.5, 'unit': 'us', 'higher_is_better': False},
+                   'c': {'value': 1, 'unit': 'us', 'higher_is_better': False}}
+        self.assertListEqual(compare(results, baseline), [])
+
+        results['a']['value'] = 80
+        results['b']['value'] = 12
+        self.assertListEqual([r[0] for r in compare(results, baseline)], ['a', 'b'])
+        self.assertListEqual(compare(results, baseline, tolerance=0.5), [])
+
+        # A baseline of 0 gives no scale to compare with
+        baseline['a']['value'] = 0
+        baseline['b']['value'] = 0.0
+        self.assertListEqual(compare(results, baseline), [])
+
+    def test_main(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'baseline.json')
+            args = ['env_reset', '--duration', '0.01', '--repeat', '1']
+            self.assertEqual(main(args + ['--output', path]), 0)
+            with open(path) as f:
+                data = json.load(f)
+            self.assertIn('env_reset', data['results'])
+
+            # Make the baseline unreachably fast
+            data['results']['env_reset']['value'] = 1e-9
+            with open(path, 'w') as f:
+                json.dump(data, f)
+            self.assertEqual(main(args + ['--baseline', path]), 1)
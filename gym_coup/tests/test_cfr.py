@@ -0,0 +1,104 @@
+import os
+import random
+import tempfile
+import unittest
+import numpy as np
+from gym_coup.envs.coup_env import *
+from gym_coup.envs.compact_game import CompactGame
+from gym_coup.cfr import MCCFR
+from gym_coup.utils.seeding import spawn_seeds
+
+
+class CountingGame(CompactGame):
+    '''
+    CompactGame that counts the decisions asked for, one per action taken
+    '''
+    decisions = 0
+
+    def get_valid_actions(self):
+        CountingGame.decisions += 1
+        return super().get_valid_actions()
+
+
+class TestMCCFR(unittest.TestCase):
+    def test_tables(self):
+        solver = MCCFR(capacity=16, seed=0)
+        solver.train(50)
+        self.assertEqual(solver.iterations, 50)
+        self.assertGreater(solver.size, 16)
+        self.assertEqual(solver.regrets.shape, (solver.size, NUM_ACTIONS))
+        self.assertEqual(solver.strategy_sum.shape, (solver.size, NUM_ACTIONS))
+        self.assertEqual(len(np.unique(solver.keys)), solver.size)
+        self.assertTrue(np.isfinite(solver.regrets).all())
+        self.assertTrue((solver.strategy_sum >= 0).all())
+        for k, row in solver.index.items():
+            self.assertEqual(solver.keys[row], k)
+
+    def test_deterministic(self):
+        a = MCCFR(seed=1, game_cls=CompactGame)
+        b = MCCFR(seed=1, game_cls=CompactGame)
+        a.train(30)
+        b.train(30)
+        np.testing.assert_array_equal(a.keys, b.keys)
+        np.testing.assert_allclose(a.regrets, b.regrets)
+        np.testing.assert_allclose(a.strategy_sum, b.strategy_sum)
+
+    def test_last_action(self):
+        # A game ended by the last allowed action is scored, not a draw
+        full = MCCFR(seed=0, game_cls=CountingGame, max_depth=10000)
+        CountingGame.decisions = 0
+        full._episode(0)
+        cut = MCCFR(seed=0, game_cls=CountingGame, max_depth=CountingGame.decisions)
+        cut._episode(0)
+        self.assertTrue(full.regrets.any())
+        np.testing.assert_array_equal(cut.regrets, full.regrets)
+
+    def test_average_strategy(self):
+        solver = MCCFR(seed=0)
+        game = Game(rng=random.Random(0))
+        # Uniform before training
+        strategy = solver.average_strategy(game)
+        self.assertListEqual(sorted(strategy), game.get_valid_actions())
+        self.assertTrue(np.allclose(list(strategy.values()), 1 / len(strategy)))
+
+        solver.train(200)
+        strategy = solver.average_strategy(game)
+        self.assertListEqual(sorted(strategy), game.get_valid_actions())
+        self.assertAlmostEqual(sum(strategy.values()), 1.0)
+        self.assertIn(solver.act(game), strategy)
+
+    def test_checkpoint(self):
+        solver = MCCFR(seed=0)
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'cfr.npz')
+            solver.train(40, merge_interval=20, checkpoint=path)
+            loaded = MCCFR.load(path, seed=0)
+        self.assertEqual(loaded.iterations, 40)
+        np.testing.assert_array_equal(loaded.keys, solver.keys)
+        np.testing.assert_array_equal(loaded.regrets, solver.regrets)
+        np.testing.assert_array_equal(loaded.strategy_sum, solver.strategy_sum)
+        self.assertDictEqual(loaded.index, solver.index)
+        # Training goes on from the loaded tables
+        loaded.train(10)
+        self.assertEqual(loaded.iterations, 50)
+
+    def test_workers(self):
+        solver = MCCFR(seed=0)
+        solver.train(40, num_workers=2, merge_interval=20)
+        self.assertEqual(solver.iterations, 40)
+        self.assertEqual(len(np.unique(solver.keys)), solver.size)
+
+        # One merge round: the tables are the sum of what each worker ran
+        workers = [MCCFR(seed=s) for s in spawn_seeds(np.random.SeedSequence(0), 2)]
+        regrets = {}
+        for w in workers:
+            w.train(20)
+            for k, row in w.index.items():
+                regrets[k] = regrets.get(k, 0) + w.regrets[row]
+        self.assertSetEqual(set(regrets), set(solver.index))
+        for k, r in regrets.items():
+            np.testing.assert_allclose(solver.regrets[solver.index[k]], r)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+import random
+import sys
+import gym_coup.tests.test_env as test_env
+from gym_coup.envs.coup_env import *
+from gym_coup.envs.compact_game import *
+
+
+def game_from_compact(cgame):
+    '''
+    Build a Game with the same state as cgame
+    '''
+    game = Game()
+    for player, cplayer in zip(game.players, cgame.players):
+        player.cards = cplayer.cards
+        player.coins = cplayer.coins
+        player.last_action = cplayer.last_action
+        player.lost_challenge = cplayer.lost_challenge
+    game.deck = cgame.deck
+    game.whose_turn = cgame.whose_turn
+    game.whose_action = cgame.whose_action
+    game.is_turn_begin = cgame.is_turn_begin
+    game.game_over = cgame.game_over
+    game.rehash()
+    return game
+
+
+# Run every CoupEnv scenario on the compact state
+globals().update(test_env.scenario_tests('Compact', compact_state=True))
+
+
+class TestCompactGame(unittest.TestCase):
+    def test_size(self):
+        game = CompactGame()
+        self.assertEqual(len(game.state), STATE_SIZE)
+        self.assertLess(sys.getsizeof(game.state), 128)
+        self.assertFalse(hasattr(game, '__dict__'))
+        self.assertEqual(len(game.deck), 11)
+        self.assertEqual(game.as_numpy().dtype, np.int8)
+
+    def test_same_draws(self):
+        # Both classes draw from the same end of the flat layout's deck,
+        # so the same seed or snapshot plays out the same in either
+        def used(g):
+            # The layout past the deck size is unused
+            s = g.to_array()
+            return s[:DECK + s[DECK_SIZE]]
+
+        game = Game(rng=random.Random(0))
+        cgame = CompactGame(rng=random.Random(0))
+        self.assertEqual(used(cgame), used(game))
+        rng = random.Random(1)
+        for _ in range(5):
+            game.restore_state(cgame.clone_state())
+            self.assertListEqual([game.draw_card().val for _ in range(3)],
+                                 [cgame.draw_card() for _ in range(3)])
+            game.restore_state(cgame.clone_state())
+            while not game.game_over:
+                a = CoupEnv.actions[rng.choice(game.get_valid_actions())]
+                getattr(game, a)()
+                getattr(cgame, a)()
+                self.assertEqual(used(cgame), used(game))
+            cgame = CompactGame(rng=random.Random(rng.random()))
+
+    def test_matches_game(self):
+        # Random play, checking each state against Game
+        random.seed(0)
+        for _ in range(50):
+            cgame = CompactGame()
+            while not cgame.game_over:
+                game = game_from_compact(cgame)
+                valid = cgame.get_valid_actions()
+                self.assertListEqual(valid, game.get_valid_actions())
+                self.assertTupleEqual(cgame.get_obs(), game.get_obs())
+                self.assertTupleEqual(cgame.get_obs(p2_view=True, text=True),
+                                      game.get_obs(p2_view=True, text=True))
+                self.assertListEqual(cgame.get_num_face_up(), game.get_num_face_up())
+                self.assertEqual(cgame.state_hash, game.state_hash)
+                self.assertEqual(cgame.info_hash(1), game.info_hash(1))
+                getattr(cgame, CoupEnv.actions[random.choice(valid)])()
+                self.assertEqual(len(cgame.deck) + sum(len(p.cards) for p in cgame.players), 15)
@@ -0,0 +1,93 @@
+import unittest
+import random
+import gym_coup.tests.test_env as test_env
+from gym_coup.envs.coup_env import *
+from gym_coup.envs.count_deck_game import CountDeckGame
+
+
+# Run every CoupEnv scenario with the count deck
+globals().update(test_env.scenario_tests('CountDeck', count_deck=True))
+
+
+class TestCountDeckGame(unittest.TestCase):
+    def test_deck(self):
+        game = CountDeckGame(rng=random.Random(0))
+        self.assertEqual(game.deck_size, 11)
+        self.assertEqual(sum(game.deck_counts), 11)
+        self.assertListEqual([c.val for c in game.deck], sorted(c.val for c in game.deck))
+        for v in range(len(Card.names)):
+            held = sum(c.val == v for p in game.players for c in p.cards)
+            self.assertEqual(game.deck_counts[v] + held, 3)
+
+        game.deck = [Card(DUKE), Card(ASSASSIN), Card(DUKE)]
+        self.assertListEqual(game.deck_counts, [1, 0, 0, 0, 2])
+        self.assertEqual(game.deck_size, 3)
+
+    def test_random_play(self):
+        env = CoupEnv(count_deck=True)
+        rng = random.Random(0)
+        for seed in range(20):
+            env.reset(seed=seed)
+            done = False
+            while not done:
+                _, _, done, _ = env.step(rng.choice(env.get_valid_actions()))
+                game = env.game
+                game.check_invariants()
+                state = game.to_array()
+                self.assertEqual(game.state_hash, zobrist_hash(state))
+                self.assertEqual(game.info_hash(0), zobrist_hash(state, view=0))
+
+    def test_draw_distribution(self):
+        # Like the first card of a shuffled deck, each card in the deck is equally likely
+        rng = random.Random(0)
+        game = CountDeckGame(rng=rng)
+        game.deck = [Card(DUKE)] * 3 + [Card(CAPTAIN)]
+        n = 20000
+        counts = [0] * len(Card.names)
+        for _ in range(n):
+            g = game.clone(rng)
+            counts[g.draw_card().val] += 1
+            counts[g.draw_card().val] += 1
+        self.assertEqual(counts[DUKE] + counts[CAPTAIN], 2 * n)
+        self.assertAlmostEqual(counts[CAPTAIN] / n, 0.5, delta=0.02)
+
+    def test_deal_matches_game(self):
+        # Hands are dealt with the same distribution as from a shuffled deck
+        n = 5000
+        def frequencies(game_cls):
+            rng = random.Random(0)
+            freq = {}
+            for _ in range(n):
+                g = game_cls(rng=rng)
+                hand = tuple(c.val for c in g.players[0].cards)
+                freq[hand] = freq.get(hand, 0) + 1
+            return freq
+
+        game_freq = frequencies(Game)
+        count_freq = frequencies(CountDeckGame)
+        self.assertSetEqual(set(game_freq), set(count_freq))
+        for hand in game_freq:
+            self.assertAlmostEqual(game_freq[hand] / n, count_freq[hand] / n, delta=0.025)
+
+    def test_clone_restore(self):
+        env = CoupEnv(count_deck=True)
+        env.reset(seed=0)
+        snapshot = env.game.clone_state()
+        clone = env.game.clone()
+        env.game.draw_card()
+        self.assertEqual(clone.deck_size, 11)
+        self.assertEqual(sum(clone.deck_counts), 11)
+
+        env.game.restore_state(snapshot)
+        self.assertEqual(bytes(env.game.to_array()), snapshot.state)
+        self.assertListEqual(env.game.deck_counts, clone.deck_counts)
+        # The same draws follow from the restored RNG state
+        self.assertEqual(env.game.draw_card().val, clone.draw_card().val)
+
+    def test_no_compact_state(self):
+        with self.assertRaises(ValueError):
+            CoupEnv(compact_state=True, count_deck=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import random
+import unittest
+import numpy as np
+from gym_coup.envs.coup_env import *
+from gym_coup.envs.compact_game import CompactGame
+from gym_coup.envs.determinization import observe, sample_determinizations, turn_flags
+
+
+class TestDeterminization(unittest.TestCase):
+    def test_consistent(self):
+        # Every sample looks the same as the real game to the viewer
+        rng = random.Random(0)
+        ambiguous = 0
+        for seed in range(100):
+            env = CoupEnv()
+            env.reset(seed=seed)
+            while True:
+                game = env.game
+                for p in range(2):
+                    obs = env.get_obs(p2_view=p == 1)
+                    self.assertListEqual(observe(game.to_array(), p2_view=p == 1).tolist(), list(obs))
+                    try:
+                        states = sample_determinizations(obs, 8, p2_view=p == 1, rng=seed)
+                    except ValueError:
+                        ambiguous += 1
+                        states = sample_determinizations(obs, 8, p2_view=p == 1,
+                                                         is_turn_begin=game.is_turn_begin, rng=seed)
+                    self.assertEqual(states.shape, (8, STATE_SIZE))
+                    for s in states:
+                        self.assertEqual(zobrist_hash(s, view=p), game.info_hash(p))
+                        cards = s[CARDS:CARDS + 8]
+                        self.assertListEqual(sorted(cards[cards != NONE].tolist() + s[DECK:DECK + s[DECK_SIZE]].tolist()),
+                                             sorted(list(range(5)) * 3))
+                if game.game_over:
+                    break
+                env.step(rng.choice(env.get_valid_actions()))
+        self.assertGreater(ambiguous, 0)
+
+    def test_playable(self):
+        env = CoupEnv()
+        env.reset(seed=0)
+        states = sample_determinizations(env.get_obs(), 4, rng=0)
+        for s in states:
+            game = CompactGame()
+            game.load_array(s)
+            self.assertListEqual(game.get_valid_actions(), env.get_valid_actions())
+            game.exchange()
+            game.pass_exchange()
+            game.check_invariants()
+
+    def test_distribution(self):
+        env = CoupEnv()
+        env.reset(seed=0)
+        k = 20000
+        states = sample_determinizations(env.get_obs(), k, rng=0)
+        # Each unseen card is as likely to be in P2's hand
+        counts = np.full(5, 3)
+        np.subtract.at(counts, [c.val for c in env.game.players[0].cards], 1)
+        freq = np.bincount(states[:, CARDS + 4:CARDS + 6].ravel(), minlength=5) / k
+        np.testing.assert_allclose(freq, 2 * counts / counts.sum(), atol=0.02)
+        self.assertTrue((states[:, CARDS + 4] <= states[:, CARDS + 5]).all())
+        # The deck order is shuffled
+        self.assertGreater(len(np.unique(states[:, DECK:DECK + 11], axis=0)), k // 2)
+
+    def test_sorted_next_to_face_up(self):
+        obs = list(CoupEnv().observation_space.low)
+        obs[0:2] = [CONTESSA, DUKE]
+        obs[4:6] = [CAPTAIN, NONE]
+        obs[12:14] = [1, 0]
+        obs[16:21] = [2, 2, INCOME, INCOME, 0]
+        states = sample_determinizations(obs, 1000, rng=0)
+        # A face down card sorted after a face up Captain is a Contessa or Duke
+        self.assertTrue(np.isin(states[:, CARDS + 5], [CONTESSA, DUKE]).all())
+        self.assertTrue((states[:, CARDS + 4] == CAPTAIN).all())
+
+        obs[4:6] = [NONE, CAPTAIN]
+        obs[12:14] = [0, 1]
+        states = sample_determinizations(obs, 1000, rng=0)
+        self.assertTrue((states[:, CARDS + 4] <= CAPTAIN).all())
+
+    def test_turn_flags(self):
+        # P2 tells a coup to respond to from a coup that ended P2's turn with the loss of a card
+        with self.assertRaises(ValueError):
+            turn_flags(1, [COUP, LOSE_CARD_1], [2, 2])
+        self.assertEqual(turn_flags(1, [COUP, LOSE_CARD_1], [2, 2], is_turn_begin=True), (1, True, [False, False]))
+        self.assertEqual(turn_flags(1, [COUP, LOSE_CARD_1], [2, 2], is_turn_begin=False), (0, False, [False, False]))
+        # P2 challenged P1's tax and lost
+        self.assertEqual(turn_flags(1, [TAX, CHALLENGE_TAX], [2, 2]), (0, False, [False, True]))
+        # P1 is exchanging after P2's challenge failed
+        self.assertEqual(turn_flags(0, [EXCHANGE, CHALLENGE_EXCHANGE], [4, 2]), (0, False, [False, True]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,17 @@
 import unittest
+import random
 import gym
 from gym_coup.envs.coup_env import *
+from gym_coup.envs.compact_game import CompactGame
+from gym_coup.envs.determinization import observe
 
 class TestCoupEnvBase(unittest.TestCase):
+    # Keyword args of gym.make, see scenario_tests()
+    make_kwargs = {}
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.env = gym.make('coup-v0')
+        self.env = gym.make('coup-v0', **self.make_kwargs)
 
     def setUp(self):
         self.env.reset()
@@ -53,6 +59,97 @@ class TestCoupEnv(TestCoupEnvBase):
             self.assertGreaterEqual(obs[i], 0)
             self.assertLessEqual(obs[i], 4)
 
+    def test_action_mask(self):
+        mask = self.env.get_action_mask()
+        self.assertEqual(mask.dtype, np.bool_)
+        self.assertEqual(len(mask), 32)
+        self.assertListEqual(list(np.flatnonzero(mask)), self.env.get_valid_actions())
+        with self.assertRaises(ValueError):
+            mask[0] = False
+
+        self.env.step(FOREIGN_AID)
+        self.assertListEqual(list(np.flatnonzero(self.env.get_action_mask())), [PASS_FA, BLOCK_FA])
+
+    def test_action_types(self):
+        self.env.step(np.int64(FOREIGN_AID))
+        self.env.step('pass_fa')
+        obs, _, _, _ = self.env.last()
+        self.assertEqual(obs[17], 3)
+        for a in [-1, 32, 1.0]:
+            with self.assertRaises(RuntimeError):
+                self.env.step(a)
+
+    def test_step_fused(self):
+        # Same as step(), last() and get_action_mask() in a copy of the env
+        rng = random.Random(0)
+        for compact_state in (False, True):
+            env = CoupEnv(compact_state=compact_state)
+            ref = CoupEnv(compact_state=compact_state)
+            for seed in range(20):
+                env.reset(seed=seed)
+                ref.reset(seed=seed)
+                done = False
+                while not done:
+                    a = rng.choice(ref.get_valid_actions())
+                    reward, p, obs, mask, done = env.step_fused(a)
+                    _, ref_reward, ref_done, _ = ref.step(a)
+                    self.assertEqual(reward, ref_reward)
+                    self.assertEqual(done, ref_done)
+                    self.assertEqual(p, ref.game.whose_action)
+                    self.assertEqual(obs, ref.last()[0])
+                    self.assertEqual(env.cumulative_rewards, ref.cumulative_rewards)
+                    if done:
+                        self.assertFalse(mask.any())
+                    else:
+                        np.testing.assert_array_equal(mask, ref.get_action_mask())
+                    with self.assertRaises(ValueError):
+                        mask[0] = True
+
+    def test_clone_restore_state(self):
+        snapshot = self.env.clone_state()
+
+        def play():
+            # Exchanges draw from the deck and shuffle it
+            for a in [EXCHANGE, PASS_EXCHANGE, EXCHANGE_RETURN_12,
+                      EXCHANGE, PASS_EXCHANGE, EXCHANGE_RETURN_34,
+                      EXCHANGE, PASS_EXCHANGE, EXCHANGE_RETURN_12]:
+                self.env.step(a)
+            return self.env.get_obs(), self.env.get_obs(p2_view=True), self.env.game.to_array()
+
+        first = play()
+        self.env.restore_state(snapshot)
+        self.assertEqual(self.env.game.to_array().tobytes(), snapshot.game.state)
+        self.assertEqual(play(), first)
+
+    def test_clone_game(self):
+        game = self.env.game.clone()
+        self.env.step(INCOME)
+        self.env.step(INCOME)
+        self.assertEqual(game.get_obs()[2], 1)
+        self.assertEqual(self.env.get_obs()[16], 2)
+        # Cards are unchanged
+        self.assertEqual(game.to_array()[:FACE_UP + 8], self.env.game.clone().to_array()[:FACE_UP + 8])
+
+    def test_reset_seed(self):
+        def play(seed):
+            self.env.reset(seed=seed)
+            for a in [EXCHANGE, PASS_EXCHANGE, EXCHANGE_RETURN_12,
+                      EXCHANGE, PASS_EXCHANGE, EXCHANGE_RETURN_34]:
+                self.env.step(a)
+            return self.env.game.to_array()
+
+        first = play(1)
+        random.seed(5) # The env doesn't use the shared random module
+        self.assertEqual(play(1), first)
+        self.assertNotEqual(play(2), first)
+
+    def test_invalid_progression(self):
+        self.env.game.is_turn_begin = False
+        with self.assertRaises(RuntimeError):
+            self.env.get_valid_actions()
+        with self.assertRaises(RuntimeError):
+            self.env.get_action_mask()
+
 
 class TestGeneralActions(TestCoupEnvBase):
     def test_income(self):
@@ -255,3 +352,281 @@ class TestDuke(TestCoupEnvBase):
         self.assertEqual(obs[16], 4)
         self.assertEqual(r, 0)
         self.assertEqual(term, False)
+
+
+
+def scenario_tests(name, **make_kwargs):
+    '''
+    Return {class name: test case} with a subclass of every CoupEnv scenario
+    that runs on gym.make('coup-v0', **make_kwargs),
+    ex: globals().update(scenario_tests('Compact', compact_state=True))
+
+    name: Inserted after 'Test' in the class names
+    '''
+    tests = {}
+    for base in (TestCoupEnv, TestGeneralActions, TestAssassin, TestAmbassador,
+                 TestCaptain, TestContessa, TestDuke):
+        cls_name = 'Test' + name + base.__name__[len('Test'):]
+        tests[cls_name] = type(cls_name, (base,), {'make_kwargs': make_kwargs})
+    return tests
+
+
+class TestInvariants(unittest.TestCase):
+    def corrupt(self, env):
+        # Lose a card from the deck
+        env.game.deck.pop()
+
+    def test_full(self):
+        env = CoupEnv(check_invariants='full')
+        env.reset()
+        env.step(INCOME)
+        self.corrupt(env)
+        with self.assertRaises(RuntimeError):
+            env.step(INCOME)
+
+    def test_sampled(self):
+        env = CoupEnv(check_invariants='sampled', invariant_sample_rate=0.5)
+        env.reset()
+        self.corrupt(env)
+        env.step(INCOME) # Not checked
+        with self.assertRaises(RuntimeError):
+            env.step(INCOME)
+
+    def test_invalid_sample_rate(self):
+        for rate in (0, -0.5, 1.5):
+            with self.assertRaises(ValueError):
+                CoupEnv(check_invariants='sampled', invariant_sample_rate=rate)
+
+    def test_off(self):
+        env = CoupEnv(check_invariants='off', log=False)
+        env.reset()
+        self.corrupt(env)
+        for _ in range(4):
+            env.step(INCOME)
+
+    def test_game_over_not_set(self):
+        env = CoupEnv()
+        env.reset()
+        env.game.players[1].cards[0].is_face_up = True
+        env.game.players[1].cards[1].is_face_up = True
+        with self.assertRaises(RuntimeError):
+            env.step(INCOME)
+
+    def test_invalid_mode(self):
+        with self.assertRaises(ValueError):
+            CoupEnv(check_invariants='some')
+
+    def test_out_of_date(self):
+        env = CoupEnv(log=False)
+        env.reset()
+        env.game.players[1].last_action = TAX
+        with self.assertRaisesRegex(RuntimeError, 'rehash'):
+            env.step(INCOME)
+
+        env.reset()
+        env.game.players[1].last_action = TAX
+        env.game.rehash()
+        env.step(INCOME)
+
+
+class TestProfiler(unittest.TestCase):
+    def check(self, compact_state):
+        env = CoupEnv(profile=True, compact_state=compact_state)
+        env.reset(seed=0)
+        env.step(FOREIGN_AID)
+        env.step(PASS_FA)
+        env.get_valid_actions()
+
+        stats = env.profiler.stats()
+        self.assertEqual(stats['foreign_aid']['calls'], 2) # Once more when the pass completes it
+        self.assertEqual(stats['pass_fa']['calls'], 1)
+        self.assertEqual(stats['income']['calls'], 0)
+        self.assertEqual(stats['partial_obs']['calls'], 2)
+        self.assertEqual(stats['get_valid_actions']['calls'], 1)
+        self.assertEqual(stats['shuffle_deck']['calls'], 1)
+        self.assertGreater(stats['_sort_cards']['calls'], 0)
+        self.assertGreaterEqual(stats['pass_fa']['time'], 0)
+
+        # Clones stay profiled
+        g = env.game.clone()
+        g.income()
+        self.assertEqual(env.profiler.stats()['income']['calls'], 1)
+
+        env.profiler.reset()
+        self.assertTrue(all(v['calls'] == 0 and v['time'] == 0 for v in env.profiler.stats().values()))
+        env.step(INCOME)
+        self.assertEqual(env.profiler.stats()['income']['calls'], 1)
+
+    def test_game(self):
+        self.check(False)
+
+    def test_compact_game(self):
+        self.check(True)
+
+    def test_off(self):
+        env = CoupEnv()
+        env.reset()
+        self.assertIsNone(env.profiler)
+        self.assertIs(type(env.game), Game)
+
+class TestZobristHash(unittest.TestCase):
+    def test_incremental(self):
+        # The hashes kept by the actions match hashing the state from scratch
+        rng = random.Random(0)
+        for _ in range(100):
+            game = Game(p_first_turn=rng.randrange(2), rng=rng)
+            while True:
+                state = game.to_array()
+                self.assertEqual(game.state_hash, zobrist_hash(state))
+                self.assertEqual(game.info_hash(0), zobrist_hash(state, view=0))
+                self.assertEqual(game.info_hash(1), zobrist_hash(state, view=1))
+                if game.game_over:
+                    break
+                game._action_handlers[rng.choice(game.get_valid_actions())](game)
+
+    def test_info_hash(self):
+        game = Game(rng=random.Random(0))
+        other = game.clone()
+        # Give P2 different face down cards, and shuffle the deck
+        p2 = other.players[1]
+        p2.cards = [Card(c.val) for c in other.deck[:2]]
+        other.deck[:2] = [Card(c.val) for c in game.players[1].cards]
+        other.shuffle_deck()
+        p2._sort_cards()
+        other.rehash()
+        self.assertNotEqual(game.state_hash, other.state_hash)
+        self.assertEqual(game.info_hash(0), other.info_hash(0))
+        self.assertNotEqual(game.info_hash(1), other.info_hash(1))
+
+        # Only the deck order differs
+        other = game.clone()
+        other.shuffle_deck()
+        self.assertEqual(game.state_hash, other.state_hash)
+
+    def test_set_attributes(self):
+        game = Game(rng=random.Random(0))
+        game.players[0].coins = 9
+        game.players[1].cards[1].is_face_up = True
+        self.assertEqual(game.state_hash, zobrist_hash(game.to_array()))
+        # Other attributes need a rehash
+        game.players[1].last_action = TAX
+        self.assertNotEqual(game.state_hash, zobrist_hash(game.to_array()))
+        game.rehash()
+        self.assertEqual(game.state_hash, zobrist_hash(game.to_array()))
+
+    def test_clone_restore(self):
+        game = Game(rng=random.Random(0))
+        snapshot = game.clone_state()
+        h = game.state_hash
+        clone = game.clone()
+        clone.income()
+        self.assertNotEqual(clone.state_hash, h)
+        self.assertEqual(game.state_hash, h)
+
+        game.income()
+        game.restore_state(snapshot)
+        self.assertEqual(game.state_hash, h)
+
+class TestPartialObs(unittest.TestCase):
+    def check(self, game):
+        state = game.to_array()
+        for v in (False, True):
+            self.assertListEqual(game.partial_obs(v).tolist(), observe(state, p2_view=v).tolist())
+
+    def test_incremental(self):
+        # The observations kept by the actions match building them from scratch
+        rng = random.Random(0)
+        for game_cls in (Game, CompactGame):
+            for _ in range(50):
+                game = game_cls(p_first_turn=rng.randrange(2), rng=rng)
+                while True:
+                    self.check(game)
+                    if game.game_over:
+                        break
+                    game._action_handlers[rng.choice(game.get_valid_actions())](game)
+
+    def test_clone_restore(self):
+        game = Game(rng=random.Random(0))
+        snapshot = game.clone_state()
+        obs = game.partial_obs().tolist()
+        clone = game.clone()
+        clone.income()
+        self.check(clone)
+        self.assertListEqual(game.partial_obs().tolist(), obs)
+
+        game.foreign_aid()
+        game.restore_state(snapshot)
+        self.assertListEqual(game.partial_obs().tolist(), obs)
+        self.check(game)
+
+
+    def test_set_attributes(self):
+        # Setting coins or turning a card keeps the observations and hashes up to date
+        env = CoupEnv(log=False)
+        env.reset(seed=0)
+        for game in (env.game, env.game.clone()):
+            p = game.players[0]
+            p.coins = 9
+            p.cards[0].is_face_up = True
+            self.check(game)
+            state = game.to_array()
+            self.assertEqual(game.state_hash, zobrist_hash(state))
+            self.assertEqual(game.info_hash(1), zobrist_hash(state, view=1))
+            game.check_invariants()
+        obs = env.get_obs()
+        self.assertEqual((obs[8], obs[16]), (1, 9))
+        self.assertIn(COUP, env.get_valid_actions())
+
+
+class TestAutoForcedMoves(unittest.TestCase):
+    def test_forced_moves(self):
+        # Same as stepping every forced action in an env without the mode
+        rng = random.Random(0)
+        for step_fused in (False, True):
+            env = CoupEnv(auto_forced_moves=True)
+            ref = CoupEnv()
+            num_forced = 0
+            for seed in range(30):
+                env.reset(seed=seed)
+                ref.reset(seed=seed)
+                done = False
+                while not done:
+                    valid = env.get_valid_actions()
+                    self.assertGreater(len(valid), 1)
+                    a = rng.choice(valid)
+                    p = env.game.whose_action
+                    if step_fused:
+                        reward, _, _, _, done = env.step_fused(a)
+                    else:
+                        _, reward, done, info = env.step(a)
+                        self.assertIs(info['forced_actions'], env.forced_actions)
+
+                    _, ref_reward, ref_done, _ = ref.step(a)
+                    for q, forced in env.forced_actions:
+                        self.assertEqual(ref.game.whose_action, q)
+                        self.assertListEqual(ref.get_valid_actions(), [forced])
+                        _, r, ref_done, _ = ref.step(forced)
+                        self.assertEqual(ref.game.players[q].last_action, forced)
+                        ref_reward += r if q == p else -r
+                    num_forced += len(env.forced_actions)
+
+                    self.assertEqual(reward, ref_reward)
+                    self.assertEqual(done, ref_done)
+                    self.assertEqual(env.game.to_array(), ref.game.to_array())
+            self.assertGreater(num_forced, 0)
+
+    def test_cumulative_rewards(self):
+        # Rewards from the forced actions carry on until the player acts
+        env = CoupEnv(auto_forced_moves=True)
+        env.reset(seed=0)
+        g = env.game
+        g.players[0].coins = 7
+        g.players[1].cards[0].is_face_up = True
+        g.players[1].cards.sort(key=lambda c: (c.val, c.is_face_up))
+        g.rehash()
+        _, reward, done, info = env.step(COUP)
+        # P2's only card left is lost
+        self.assertTrue(done)
+        self.assertEqual(reward, 1)
+        self.assertEqual(info['forced_actions'][0][0], 1)
+        self.assertEqual(env.cumulative_rewards, [1, -1])
@@ -0,0 +1,115 @@
+import random
+import time
+import unittest
+from array import array
+import numpy as np
+from gym_coup.envs.coup_env import *
+from gym_coup.envs.compact_game import CompactGame
+from gym_coup.ismcts import ISMCTSAgent, random_rollouts
+
+
+def endgame():
+    '''
+    Each player has one card left, and P1 has the coins to coup
+    '''
+    game = CompactGame(rng=random.Random(0))
+    s = game.state
+    s[CARDS:CARDS + 8] = array('b', [ASSASSIN, CAPTAIN, NONE, NONE, AMBASSADOR, DUKE, NONE, NONE])
+    s[FACE_UP:FACE_UP + 8] = array('b', [0, 1, NONE, NONE, 0, 1, NONE, NONE])
+    deck = [v for v in range(5) for _ in range(3)]
+    for v in s[CARDS:CARDS + 8]:
+        if v != NONE:
+            deck.remove(v)
+    s[DECK_SIZE] = len(deck)
+    s[DECK:DECK + len(deck)] = array('b', deck)
+    s[COINS] = 7
+    return game
+
+
+class TestISMCTS(unittest.TestCase):
+    def test_plays_games(self):
+        rng = random.Random(0)
+        for game_cls in (Game, CompactGame):
+            agent = ISMCTSAgent(simulations=20, game_cls=game_cls, seed=0)
+            game = Game(rng=random.Random(0))
+            while not game.game_over:
+                valid = game.get_valid_actions()
+                a = agent.act(game) if game.whose_action == 0 else rng.choice(valid)
+                self.assertIn(a, valid)
+                game._action_handlers[a](game)
+
+    def test_batched_leaves(self):
+        calls = []
+
+        def value_fn(states):
+            calls.append(states.shape)
+            self.assertEqual(states.dtype, np.int8)
+            return np.zeros(len(states))
+
+        game = Game(rng=random.Random(0))
+        agent = ISMCTSAgent(simulations=100, batch_size=16, value_fn=value_fn, seed=0)
+        visits = agent.search(game)
+        self.assertEqual(sum(visits.values()), 100)
+        self.assertListEqual(sorted(visits), game.get_valid_actions())
+        self.assertLessEqual(len(calls), 7)
+        for shape in calls:
+            self.assertLessEqual(shape[0], 16)
+            self.assertEqual(shape[1], STATE_SIZE)
+
+    def test_tree_reuse(self):
+        game = Game(rng=random.Random(0))
+        agent = ISMCTSAgent(simulations=50, seed=0)
+        agent.search(game)
+        size = len(agent.tree)
+        self.assertGreater(size, 1)
+        self.assertEqual(sum(agent.search(game).values()), 100)
+        self.assertGreaterEqual(len(agent.tree), size)
+        agent.reset()
+        self.assertEqual(len(agent.tree), 0)
+
+        agent = ISMCTSAgent(simulations=50, max_nodes=5, seed=0)
+        agent.search(game)
+        self.assertLessEqual(len(agent.tree), 5)
+
+    def test_full_tree(self):
+        # Every simulation visits the root, so it's never the node dropped
+        game = Game(rng=random.Random(0))
+        agent = ISMCTSAgent(simulations=500, max_nodes=200, seed=0)
+        self.assertEqual(sum(agent.search(game).values()), 500)
+        self.assertEqual(len(agent.tree), 200)
+        self.assertEqual(sum(agent.search(game).values()), 1000)
+        self.assertEqual(len(agent.tree), 200)
+
+    def test_forced_win(self):
+        agent = ISMCTSAgent(simulations=300, seed=0)
+        self.assertEqual(agent.act(endgame()), COUP)
+
+    def test_time_limit(self):
+        agent = ISMCTSAgent(simulations=None, time_limit=0.05, seed=0)
+        t = time.perf_counter()
+        visits = agent.search(Game(rng=random.Random(0)))
+        self.assertLess(time.perf_counter() - t, 2)
+        self.assertGreater(sum(visits.values()), 0)
+        with self.assertRaises(ValueError):
+            ISMCTSAgent(simulations=None)
+
+    def test_random_rollouts(self):
+        game = endgame()
+        s = np.frombuffer(game.to_array(), dtype='int8').copy()
+        states = np.stack([s] * 3)
+        # P2 lost, so the player to act wins, or loses when it is P2
+        states[:, FACE_UP + 4] = 1
+        states[:, GAME_OVER] = 1
+        states[1, WHOSE_ACTION] = 1
+        values = random_rollouts(states, random.Random(0))
+        np.testing.assert_array_equal(values, [1, -1, 1])
+        # Scored even when no action is left to take after the game ended
+        values = random_rollouts(states, random.Random(0), max_actions=0)
+        np.testing.assert_array_equal(values, [1, -1, 1])
+
+        values = random_rollouts(np.stack([s] * 20), random.Random(0))
+        self.assertTrue(np.isin(values, [-1, 1]).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import unittest
+import numpy as np
+import gym_coup.tests.test_env as test_env
+from gym_coup.envs.coup_env import *
+from gym_coup.envs.compact_game import CompactGame
+from gym_coup.envs.kernel import *
+
+
+# Run every CoupEnv scenario through the kernel
+globals().update(test_env.scenario_tests('Kernel', kernel=True))
+
+
+def random_game(seed):
+    '''
+    Play a random game with the kernel, yielding (state, action) before each action
+    '''
+    rng = np.random.default_rng(seed)
+    rng_state = kernel_rng(seed)
+    state = reset_kernel(rng_state, seed % 2)
+    done = False
+    while not done:
+        action = int(rng.choice(np.flatnonzero(legal_mask_kernel(state))))
+        yield state, action
+        state, _, done = step_kernel(state, action, rng_state)
+
+
+class TestKernel(unittest.TestCase):
+    def test_reset(self):
+        state = reset_kernel(kernel_rng(0), 1)
+        self.assertEqual(state.dtype, np.int8)
+        self.assertEqual(len(state), STATE_SIZE)
+        self.assertEqual(state[DECK_SIZE], 11)
+        self.assertListEqual(state[COINS:COINS + 2].tolist(), [2, 1])
+        self.assertEqual(state[WHOSE_ACTION], 1)
+        cards = state[CARDS:CARDS + 8].tolist() + state[DECK:DECK + 11].tolist()
+        self.assertListEqual(sorted(c for c in cards if c != NONE), sorted(list(range(5)) * 3))
+        game = CompactGame()
+        game.load_array(state)
+        game.check_invariants()
+
+    def test_matches_game(self):
+        # Each step is the same as the Game action, apart from which cards are drawn
+        for seed in range(20):
+            for state, action in random_game(seed):
+                game = CompactGame()
+                game.load_array(state)
+                np.testing.assert_array_equal(legal_mask_kernel(state), game.get_action_mask())
+
+                before = state.copy()
+                rng_state = kernel_rng(seed)
+                next_state, reward, done = step_kernel(state, action, rng_state)
+                drew = rng_state[0] != kernel_rng(seed)[0]
+                np.testing.assert_array_equal(state, before)
+
+                num_face_up = game.get_num_face_up()
+                curr = game.whose_action
+                game._action_handlers[action](game)
+                after = game.get_num_face_up()
+                expected = game.as_numpy()
+                self.assertEqual(reward, num_face_up[curr] - after[curr] + after[1 - curr] - num_face_up[1 - curr])
+                self.assertEqual(done, game.game_over)
+                # Coins, last actions, lost challenges, turn flags and deck size
+                np.testing.assert_array_equal(next_state[COINS:DECK], expected[COINS:DECK])
+                for p in range(2):
+                    c = CARDS + 4 * p
+                    f = FACE_UP + 4 * p
+                    # A different card drawn can sort the hand differently
+                    self.assertEqual((next_state[f:f + 4] == 1).sum(), (expected[f:f + 4] == 1).sum())
+                    if not drew:
+                        np.testing.assert_array_equal(next_state[c:c + 4], expected[c:c + 4])
+                        np.testing.assert_array_equal(next_state[f:f + 4], expected[f:f + 4])
+
+    def test_game_over_mask(self):
+        for state, action in random_game(0):
+            pass
+        state, _, done = step_kernel(state, action, kernel_rng(0))
+        self.assertTrue(done)
+        self.assertFalse(legal_mask_kernel(state).any())
+
+    def test_deterministic(self):
+        def play(seed):
+            return [(s.tobytes(), a) for s, a in random_game(seed)]
+        self.assertListEqual(play(3), play(3))
+        self.assertNotEqual(play(3), play(4))
+
+    def test_draw_distribution(self):
+        # Each card in the deck is equally likely to be drawn
+        state = reset_kernel(kernel_rng(0))
+        deck = state[DECK:DECK + state[DECK_SIZE]].tolist()
+        rng_state = kernel_rng(1)
+        counts = np.zeros(len(Card.names))
+        n = 20000
+        for _ in range(n):
+            s, _, _ = step_kernel(state, EXCHANGE, rng_state)
+            s, _, _ = step_kernel(s, PASS_EXCHANGE, rng_state)
+            np.add.at(counts, s[CARDS + 2:CARDS + 4], 1)
+        expected = np.bincount(deck, minlength=len(Card.names)) / len(deck)
+        np.testing.assert_allclose(counts / (2 * n), expected, atol=0.01)
+
+    def test_invalid(self):
+        state = reset_kernel(kernel_rng(0))
+        with self.assertRaises(RuntimeError):
+            step_kernel(state, COUP, kernel_rng(0))
+        with self.assertRaises(RuntimeError):
+            step_kernel(state, NUM_ACTIONS, kernel_rng(0))
+
+
+if __name__ == '__main__':
+    unittest.main()
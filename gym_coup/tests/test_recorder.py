@@ -0,0 +1,117 @@
+import os
+import random
+import tempfile
+import unittest
+import numpy as np
+from gym_coup.envs.coup_env import *
+from gym_coup.recorder import *
+
+
+class TestTrajectoryRecorder(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'rec')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def play(self, env, num_games, rng):
+        '''
+        Play random games, return the expected records
+        '''
+        expected = []
+        for ep in range(num_games):
+            env.reset()
+            done = False
+            while not done:
+                p = env.game.whose_action
+                obs = env.get_obs(p2_view=p == 1)
+                mask = env.get_action_mask().copy()
+                action = rng.choice(env.get_valid_actions())
+                _, reward, done, _ = env.step(action)
+                expected.append((obs, mask, action, reward, done, ep))
+        return expected
+
+    def test_record_read(self):
+        env = TrajectoryRecorder(CoupEnv(check_invariants='off', log=False), self.path, chunk_size=7)
+        env.reset(seed=0)
+        expected = self.play(env, 5, random.Random(0))
+        # Unfinished last episode
+        env.reset()
+        env.step(INCOME)
+        env.close()
+
+        reader = TrajectoryReader(self.path)
+        self.assertEqual(len(reader), len(expected) + 1)
+        self.assertEqual(len(reader.episodes), 6)
+        # Last chunk is trimmed
+        last = os.path.join(self.path, 'transitions_%05d.bin' % (len(reader.chunks) - 1))
+        self.assertEqual(os.path.getsize(last), len(reader.chunks[-1]) * RECORD_DTYPE.itemsize)
+
+        records = reader.records()
+        self.assertEqual(len(records), len(reader))
+        masks = unpack_masks(records['mask'])
+        for i, (obs, mask, action, reward, done, ep) in enumerate(expected):
+            r = reader[i]
+            self.assertListEqual(list(r['obs']), list(obs))
+            self.assertTrue((masks[i] == mask).all())
+            self.assertEqual((r['action'], r['reward'], r['done'], r['episode']), (action, reward, done, ep))
+
+        for ep in range(5):
+            e = reader.episode(ep)
+            self.assertTrue((e['episode'] == ep).all())
+            self.assertTrue(e['done'][-1])
+            self.assertFalse(e['done'][:-1].any())
+        last_ep = reader.episode(5)
+        self.assertEqual(len(last_ep), 1)
+        self.assertFalse(last_ep['done'][0])
+        self.assertEqual(reader[-1]['action'], INCOME)
+
+        self.assertEqual(sum(1 for _ in reader), len(reader))
+        with self.assertRaises(IndexError):
+            reader[len(reader)]
+
+    def test_forced_replay(self):
+        env = TrajectoryRecorder(CoupEnv(check_invariants='off', log=False, auto_forced_moves=True), self.path)
+        rng = random.Random(0)
+        forced = []
+        for seed in range(5):
+            env.reset(seed=seed)
+            done = False
+            while not done:
+                _, _, done, info = env.step(rng.choice(env.get_valid_actions()))
+                forced.append(len(info['forced_actions']))
+        env.close()
+
+        reader = TrajectoryReader(self.path)
+        self.assertListEqual(list(reader.records()['forced']), forced)
+        self.assertGreater(sum(forced), 0)
+        # The recorded actions re-run the games, forced actions included
+        for seed in range(5):
+            e = reader.episode(seed)
+            replay = env.replay(seed, e['action'])
+            self.assertTrue(replay.done)
+            self.assertListEqual(list(replay.rewards), list(e['reward']))
+            for k in range(len(e)):
+                self.assertListEqual(list(replay.obs(k)), list(e['obs'][k]))
+
+    def test_mask_packing(self):
+        mask = np.zeros(32, dtype=bool)
+        mask[[0, 5, 31]] = True
+        bits = pack_mask(mask)
+        self.assertEqual(bits, 1 | 1 << 5 | 1 << 31)
+        self.assertTrue((unpack_masks([bits])[0] == mask).all())
+
+    def test_errors(self):
+        env = TrajectoryRecorder(CoupEnv(), self.path)
+        with self.assertRaises(RuntimeError):
+            env.step(INCOME)
+        env.close()
+        with self.assertRaises(FileExistsError):
+            TrajectoryRecorder(CoupEnv(), self.path)
+
+        # Empty recording
+        reader = TrajectoryReader(self.path)
+        self.assertEqual(len(reader), 0)
+        self.assertEqual(len(reader.episodes), 0)
+        self.assertEqual(len(reader.records()), 0)
@@ -0,0 +1,67 @@
+import random
+import unittest
+from gym_coup.envs.coup_env import *
+
+
+class TestReplay(unittest.TestCase):
+    compact_state = False
+
+    def play(self, seed):
+        '''
+        Play a random game, return its actions, rewards, acting players and states
+        '''
+        env = CoupEnv(compact_state=self.compact_state)
+        env.reset(seed=seed)
+        rng = random.Random(seed)
+        actions, rewards, players, states = [], [], [], [env.clone_state()]
+        done = False
+        while not done:
+            a = rng.choice(env.get_valid_actions())
+            players.append(env.game.whose_action)
+            _, r, done, _ = env.step(a)
+            actions.append(a)
+            rewards.append(r)
+            states.append(env.clone_state())
+        return env, actions, rewards, players, states
+
+    def test_replay(self):
+        env, actions, rewards, players, states = self.play(3)
+        replay = env.replay(3, actions, checkpoint_interval=5)
+        self.assertEqual(len(replay), len(actions))
+        self.assertTrue(replay.done)
+        self.assertListEqual(list(replay.rewards), rewards)
+        self.assertListEqual(list(replay.players), players)
+        self.assertEqual(len(replay.checkpoints), (len(actions) - 1) // 5 + 1)
+
+        # Seek back and forth
+        order = list(range(len(states)))
+        random.Random(0).shuffle(order)
+        for k in order + list(range(len(states))):
+            self.assertEqual(replay.seek(k).clone_state(), states[k])
+
+        # Replayed states play on the same as the original
+        k = len(actions) // 2
+        game = replay.seek(k).game.clone()
+        for a in actions[k:]:
+            game._action_handlers[a](game)
+        self.assertEqual(game.clone_state(), states[-1].game)
+
+        obs = replay.obs(0)
+        env.restore_state(states[0])
+        self.assertEqual(obs, env.get_obs(p2_view=env.game.whose_action == 1))
+
+    def test_invalid(self):
+        env, actions, _, _, _ = self.play(4)
+        with self.assertRaises(RuntimeError):
+            env.replay(4, actions + [INCOME])
+        with self.assertRaises(RuntimeError):
+            env.replay(4, [COUP])
+        replay = env.replay(4, actions[:3])
+        self.assertFalse(replay.done)
+        with self.assertRaises(IndexError):
+            replay.seek(4)
+        self.assertEqual(len(env.replay(4, []).seek(0).game.deck), 11)
+
+
+class TestCompactReplay(TestReplay):
+    compact_state = True
@@ -0,0 +1,81 @@
+import unittest
+import numpy as np
+from gym_coup.envs.coup_env import *
+from gym_coup.rollout import *
+
+
+def first_valid_policy(obs, masks):
+    return masks.argmax(axis=1)
+
+
+class TestRingBuffer(unittest.TestCase):
+    def setUp(self):
+        self.buf = RingBuffer(8)
+
+    def tearDown(self):
+        self.buf.close()
+
+    def write(self, start, n):
+        self.buf.write(obs=np.zeros((n, 21)), mask=np.zeros((n, 32)),
+                       action=np.arange(start, start + n), reward=np.zeros(n),
+                       done=np.zeros(n), player=np.zeros(n), env_id=np.zeros(n))
+
+    def test_wrap(self):
+        self.write(0, 6)
+        self.assertEqual(self.buf.available(), 6)
+        self.assertListEqual(list(self.buf.peek(4)['action']), [0, 1, 2, 3])
+        self.buf.advance(4)
+        self.write(6, 5)
+        # Views stop at the end of the ring
+        self.assertListEqual(list(self.buf.peek()['action']), [4, 5, 6, 7])
+        self.buf.advance(4)
+        self.assertListEqual(list(self.buf.peek()['action']), [8, 9, 10])
+
+    def test_full(self):
+        import threading
+        self.write(0, 8)
+        stop = threading.Event()
+        stop.set()
+        self.assertFalse(self.buf.write(stop=stop, obs=np.zeros((1, 21)), mask=np.zeros((1, 32)),
+                                        action=[0], reward=[0], done=[0], player=[0], env_id=[0]))
+
+
+class TestRolloutEngine(unittest.TestCase):
+    def test_collect(self):
+        with RolloutEngine(num_workers=2, envs_per_worker=4, capacity=64, seed=0) as engine:
+            t = engine.collect(2000)
+        self.assertEqual(t['obs'].shape, (2000, 21))
+        self.assertEqual(t['mask'].shape, (2000, 32))
+        # Every action was valid for the acting player
+        self.assertTrue(t['mask'][np.arange(2000), t['action']].all())
+        self.assertTrue((t['obs'][:, 20] == t['player']).all())
+        self.assertTrue(t['done'].any())
+        self.assertSetEqual(set(t['env_id']), set(range(8)))
+
+    def test_episodes(self):
+        # Split the transitions of all workers back into whole games
+        with RolloutEngine(num_workers=2, envs_per_worker=4, capacity=64, seed=0) as engine:
+            t = engine.collect(4000)
+        games = 0
+        for env_id in range(8):
+            idx = np.flatnonzero(t['env_id'] == env_id)
+            ends = np.flatnonzero(t['done'][idx]) + 1
+            for ep in np.split(idx, ends)[:-1]:
+                obs = t['obs'][ep]
+                # Starts a new game, and face up cards only ever add up
+                self.assertFalse((obs[0, 8:16] == 1).any())
+                self.assertTrue((obs[0, 18:20] == NONE).all())
+                self.assertTrue((np.diff((obs[:, 8:16] == 1).sum(axis=1)) >= 0).all())
+                # P1's rewards add up to a win or a loss
+                p1_rewards = np.where(t['player'][ep] == 0, 1, -1) * t['reward'][ep]
+                self.assertIn(p1_rewards.sum(), (-2, -1, 1, 2))
+                games += 1
+        self.assertGreater(games, 8)
+
+    def test_batches(self):
+        with RolloutEngine(policy=first_valid_policy, num_workers=1, envs_per_worker=2, seed=0) as engine:
+            for batch in engine.batches(max_n=10):
+                # First action in both games is income
+                self.assertListEqual(list(batch['action'][:2]), [INCOME, INCOME])
+                self.assertLessEqual(len(batch['action']), 10)
+                break
@@ -0,0 +1,111 @@
+import unittest
+import numpy as np
+from gym_coup.envs.coup_env import *
+from gym_coup.envs.single_agent import SingleAgentCoupEnv, SingleAgentCoupVectorEnv
+
+
+class RecordingPolicy:
+    '''
+    Random policy that records the batch size of each call
+    '''
+    def __init__(self, seed=0):
+        self.rng = np.random.default_rng(seed)
+        self.batch_sizes = []
+
+    def __call__(self, obs, masks):
+        self.batch_sizes.append(len(obs))
+        return (self.rng.random(masks.shape) * masks).argmax(axis=1)
+
+
+def face_up_dif(obs):
+    '''
+    Opp's face up cards minus own, the sum of rewards over a game
+    '''
+    obs = np.asarray(obs)
+    return int((obs[12:16] == 1).sum()) - int((obs[8:12] == 1).sum())
+
+
+class TestSingleAgentCoupEnv(unittest.TestCase):
+    def play(self, agent_player, p_first_turn=0):
+        opponent = RecordingPolicy()
+        env = SingleAgentCoupEnv(opponent, agent_player=agent_player, p_first_turn=p_first_turn)
+        rng = np.random.default_rng(1)
+        for seed in range(10):
+            obs = env.reset(seed=seed)
+            self.assertEqual(obs, env.env.get_obs(p2_view=agent_player == 1))
+            total = 0
+            done = False
+            while not done:
+                self.assertEqual(env.game.whose_action, agent_player)
+                mask = env.get_action_mask()
+                self.assertListEqual(env.get_valid_actions(), env.game.get_valid_actions())
+                obs, reward, done, info = env.step(rng.choice(np.flatnonzero(mask)))
+                total += reward
+                self.assertIs(info['action_mask'], env.get_action_mask())
+            self.assertTrue(env.game.game_over)
+            self.assertFalse(env.get_action_mask().any())
+            self.assertEqual(obs, env.env.get_obs(p2_view=agent_player == 1))
+            self.assertEqual(total, face_up_dif(obs))
+        self.assertTrue(opponent.batch_sizes)
+        self.assertEqual(set(opponent.batch_sizes), {1})
+
+    def test_p1(self):
+        self.play(0)
+
+    def test_p2(self):
+        self.play(1)
+
+    def test_opponent_first(self):
+        self.play(0, p_first_turn=1)
+
+
+class TestSingleAgentCoupVectorEnv(unittest.TestCase):
+    def check(self, agent_player):
+        opponent = RecordingPolicy()
+        venv = SingleAgentCoupVectorEnv(opponent, 64, agent_player=agent_player, seed=0)
+        obs, masks = venv.reset()
+        rng = np.random.default_rng(1)
+        totals = np.zeros(64, dtype=int)
+        games = 0
+        for _ in range(200):
+            self.assertTrue((venv.venv.whose_action == agent_player).all())
+            self.assertTrue((obs[:, 20] == agent_player).all())
+            self.assertTrue(masks.any(axis=1).all())
+            np.testing.assert_array_equal(obs, venv.venv.get_obs(p2_view=agent_player))
+            actions = (rng.random(masks.shape) * masks).argmax(axis=1)
+            obs, rewards, dones, masks, info = venv.step(actions)
+            totals += rewards
+            for i in np.flatnonzero(dones):
+                self.assertEqual(totals[i], face_up_dif(info['final_obs'][i]))
+                totals[i] = 0
+                games += 1
+        self.assertGreater(games, 0)
+        # The opponent acts in many games at once
+        self.assertGreater(max(opponent.batch_sizes), 1)
+
+    def test_p1(self):
+        self.check(0)
+
+    def test_p2(self):
+        self.check(1)
+
+    def test_invalid_action(self):
+        venv = SingleAgentCoupVectorEnv(RecordingPolicy(), 4, seed=0)
+        _, masks = venv.reset()
+        with self.assertRaises(RuntimeError):
+            venv.step(np.argmin(masks, axis=1))
+        for a in (-NUM_ACTIONS, -1, NUM_ACTIONS):
+            with self.assertRaises(RuntimeError):
+                venv.step(np.full(4, a))
+
+    def test_invalid_opponent_action(self):
+        for a in (-NUM_ACTIONS, -1, NUM_ACTIONS):
+            # The opponent goes first, so it acts on reset
+            venv = SingleAgentCoupVectorEnv(lambda obs, masks: np.full(len(obs), a), 4,
+                                            agent_player=1, seed=0)
+            with self.assertRaises(RuntimeError):
+                venv.reset()
+
+
+if __name__ == '__main__':
+    unittest.main()
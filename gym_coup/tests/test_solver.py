@@ -0,0 +1,158 @@
+import random
+import unittest
+from array import array
+from gym_coup.envs.coup_env import *
+from gym_coup.envs.compact_game import CompactGame
+from gym_coup.solver import Solver, _Graph, _outcomes, _game_state, _stage
+from gym_coup.tests.test_compact_game import game_from_compact
+
+
+# Every card not in the endgame hands
+FULL_DECK = (AMBASSADOR, AMBASSADOR, ASSASSIN, ASSASSIN, CAPTAIN, CAPTAIN,
+             CONTESSA, CONTESSA, CONTESSA, DUKE, DUKE)
+
+
+def endgame(deck=(DUKE, CONTESSA), p2_face_up=1):
+    '''
+    Each player has one card left, and the deck is cut down to keep it quick to solve
+
+    p2_face_up: 0 to give P2 both cards instead
+    '''
+    game = CompactGame(rng=random.Random(1))
+    s = game.state
+    s[CARDS:CARDS + 8] = array('b', [CAPTAIN, ASSASSIN, NONE, NONE, DUKE, AMBASSADOR, NONE, NONE])
+    s[FACE_UP:FACE_UP + 8] = array('b', [1, 0, NONE, NONE, p2_face_up, 0, NONE, NONE])
+    s[DECK_SIZE] = len(deck)
+    s[DECK:DECK + len(deck)] = array('b', deck)
+    return game
+
+
+def swap_players(game):
+    '''
+    Return a copy of game with the players swapped
+    '''
+    swapped = game.clone()
+    s = swapped.state
+    for start, size in ((CARDS, 4), (FACE_UP, 4), (COINS, 1), (LAST_ACTION, 1), (LOST_CHALLENGE, 1)):
+        s[start:start + 2 * size] = s[start + size:start + 2 * size] + s[start:start + size]
+    s[WHOSE_TURN] = 1 - s[WHOSE_TURN]
+    s[WHOSE_ACTION] = 1 - s[WHOSE_ACTION]
+    return swapped
+
+
+class TestSolver(unittest.TestCase):
+    def test_game_over(self):
+        game = endgame()
+        game.state[FACE_UP + 5] = 1
+        game.state[GAME_OVER] = 1
+        self.assertTupleEqual(Solver().solve(game), (1.0, None))
+        self.assertDictEqual(Solver().action_values(game), {})
+        game.state[WHOSE_ACTION] = 1
+        self.assertTupleEqual(Solver().solve(game), (-1.0, None))
+
+    def test_forced_win(self):
+        # A coup, or assassinating with the Assassin held, wins this turn,
+        # without solving any later turn
+        game = endgame()
+        game.state[COINS] = 7
+        solver = Solver()
+        value, action = solver.solve(game)
+        self.assertEqual(value, 1.0)
+        self.assertIn(action, (ASSASSINATE, COUP))
+        self.assertEqual(len(solver.table), 0)
+
+    def test_action_values(self):
+        game = endgame()
+        solver = Solver()
+        values = solver.action_values(game)
+        self.assertListEqual(sorted(values), game.get_valid_actions())
+        self.assertAlmostEqual(values[INCOME], 1.0)
+        # Claiming a card that isn't held loses to a challenge
+        self.assertAlmostEqual(values[TAX], -1.0)
+        self.assertGreater(len(solver.table), 0)
+
+        value, action = solver.solve(game)
+        self.assertAlmostEqual(value, max(values.values()))
+        self.assertAlmostEqual(values[action], value)
+
+        # Same values for P2, and from a Game
+        self.assertDictEqual(solver.action_values(swap_players(game)), values)
+        self.assertDictEqual(solver.action_values(game_from_compact(game)), values)
+
+    def test_table(self):
+        game = endgame()
+        solver = Solver()
+        values = solver.action_values(game)
+
+        # Later queries reuse the table
+        table = dict(solver.table)
+        self.assertDictEqual(solver.action_values(game), values)
+        self.assertDictEqual(solver.table, table)
+
+        # Only the newest entries are kept
+        solver = Solver(max_table_size=10)
+        self.assertDictEqual(solver.action_values(game), values)
+        self.assertListEqual(list(solver.table.items()), list(table.items())[-10:])
+
+    def test_full_deck(self):
+        # All 15 cards in play
+        game = endgame(deck=FULL_DECK)
+        game.check_invariants()
+        solver = Solver()
+        values = solver.action_values(game)
+        self.assertListEqual(sorted(values), game.get_valid_actions())
+        value, action = solver.solve(game)
+        self.assertAlmostEqual(value, max(values.values()))
+        self.assertAlmostEqual(values[action], value)
+        self.assertDictEqual(solver.action_values(swap_players(game)), values)
+
+        # Income ends the turn without a draw, so it's worth what the opponent's turn is worth to them
+        game.income()
+        self.assertAlmostEqual(solver.solve(game)[0], -values[INCOME])
+
+    def test_stages(self):
+        # P2 losing a card moves the game to a later stage, solved first
+        game = endgame(p2_face_up=0)
+        game.state[COINS] = 7
+        solver = Solver()
+        values = solver.action_values(game)
+        self.assertSetEqual({len(_stage(k)) for k in solver.table}, {1, 2})
+
+        game.coup()
+        lose_values = solver.action_values(game)
+        self.assertAlmostEqual(max(lose_values.values()), -values[COUP])
+        for a, v in lose_values.items():
+            g = game.clone()
+            getattr(g, CoupEnv.actions[a])()
+            self.assertEqual(len(_stage(_game_state(g))), 2)
+            # P2 takes the next turn too
+            self.assertAlmostEqual(solver.solve(g)[0], v)
+
+    def test_max_graph_size(self):
+        game = endgame(deck=FULL_DECK)
+        solver = Solver(max_graph_size=10000)
+        with self.assertRaises(RuntimeError):
+            solver.action_values(game)
+        self.assertEqual(len(solver.table), 0)
+        solver.max_graph_size = 1 << 23
+        self.assertDictEqual(solver.action_values(game), Solver().action_values(game))
+
+    def test_coinless_outcomes(self):
+        # Outcomes shared between coin counts match the outcomes with coins
+        rng = random.Random(0)
+        graph = _Graph({}, (), 1 << 20)
+        for _ in range(200):
+            game = CompactGame(rng=rng)
+            while not game.game_over and rng.random() < 0.9:
+                getattr(game, CoupEnv.actions[rng.choice(game.get_valid_actions())])()
+            if game.game_over:
+                continue
+            k = _game_state(game).tobytes()
+            for a in game.get_valid_actions():
+                outcomes = _outcomes(k, a)
+                self.assertAlmostEqual(sum(p for _, p in outcomes), 1.0)
+                self.assertDictEqual(dict(graph.outcomes(k, a)), dict(outcomes))
+
+
+if __name__ == '__main__':
+    unittest.main()
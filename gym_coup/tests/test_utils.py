@@ -1,4 +1,5 @@
 import unittest
+import numpy as np
 from gym_coup.utils import *
 
 class TestEncodeObs(unittest.TestCase):
@@ -101,4 +102,51 @@ class TestEncodeObs(unittest.TestCase):
                0, 0, 0, 0, 1, 0, -1, -1,
                7, 9, 5, 32, 0]
         with self.assertRaises(IndexError):
-            enc = encode_obs(obs)
\ No newline at end of file
+            enc = encode_obs(obs)
+
+class TestEncodeObsBatch(unittest.TestCase):
+    def setUp(self):
+        self.obs = np.array([[0, 3, -1, -1, -1, -1, -1, -1,
+                              0, 0, -1, -1, 0, 0, -1, -1,
+                              1, 2, -1, -1, 0],
+                             [1, 2, -1, -1, 0, -1, -1, -1,
+                              0, 1, -1, -1, 1, 0, -1, -1,
+                              0, 4, 2, 7, 1],
+                             [0, 0, 2, 4, 0, -1, -1, -1,
+                              0, 0, 0, 0, 1, 0, -1, -1,
+                              7, 9, 5, 31, 0]], dtype='int8')
+
+    def test_matches_encode_obs(self):
+        enc = encode_obs_batch(self.obs)
+        self.assertEqual(enc.shape, (3, 123))
+        self.assertEqual(enc.dtype, np.int8)
+        for o, e in zip(self.obs, enc):
+            self.assertListEqual(list(e), list(encode_obs(list(o))))
+
+    def test_out(self):
+        buf = np.ones((5, 123), dtype='float32')
+        enc = encode_obs_batch(self.obs, out=buf[1:4])
+        self.assertIs(enc.base, buf)
+        self.assertTrue((buf[0] == 1).all())
+        self.assertTrue((buf[4] == 1).all())
+        for o, e in zip(self.obs, buf[1:4]):
+            self.assertListEqual(list(e), list(encode_obs(list(o))))
+
+        with self.assertRaises(ValueError):
+            encode_obs_batch(self.obs, out=buf)
+
+    def test_invalid(self):
+        # Action 32 invalid
+        self.obs[2, 19] = 32
+        with self.assertRaises(IndexError):
+            encode_obs_batch(self.obs)
+
+
+class TestSpawnSeeds(unittest.TestCase):
+    def test_spawn(self):
+        seeds = spawn_seeds(0, 4)
+        self.assertEqual(len(seeds), 4)
+        self.assertEqual(len(set(seeds)), 4)
+        self.assertListEqual(seeds, spawn_seeds(0, 4))
+        self.assertListEqual(seeds, spawn_seeds(np.random.SeedSequence(0), 4))
+        self.assertNotEqual(seeds, spawn_seeds(1, 4))
@@ -0,0 +1,133 @@
+import unittest
+import numpy as np
+from gym_coup.envs.coup_env import *
+from gym_coup.envs.coup_vector_env import CoupVectorEnv
+
+
+def game_from_vector_env(venv, i):
+    '''
+    Build a Game with the same state as game i of venv
+    '''
+    game = Game()
+    for p, player in enumerate(game.players):
+        player.cards = [Card(int(v), bool(f)) for v, f in zip(venv.cards[i, p], venv.face_up[i, p]) if v != NONE]
+        player.coins = int(venv.coins[i, p])
+        player.last_action = int(venv.last_action[i, p])
+        player.lost_challenge = bool(venv.lost_challenge[i, p])
+    game.whose_turn = int(venv.whose_turn[i])
+    game.whose_action = int(venv.whose_action[i])
+    game.is_turn_begin = bool(venv.is_turn_begin[i])
+    game.game_over = bool(venv.game_over[i])
+    game.rehash()
+    return game
+
+
+def random_actions(rng, masks):
+    return np.array([rng.choice(np.flatnonzero(m)) for m in masks])
+
+
+class TestCoupVectorEnv(unittest.TestCase):
+    def setUp(self):
+        self.venv = CoupVectorEnv(8, seed=0)
+        self.obs, self.masks = self.venv.reset()
+
+    def test_layout_names(self):
+        # Star imports of the module keep the flat state layout's offsets
+        import gym_coup.envs.coup_vector_env as m
+        self.assertEqual((m.DECK, m.DECK_SIZE), (DECK, DECK_SIZE))
+
+    def test_reset_obs(self):
+        self.assertEqual(self.obs.shape, (8, 21))
+        self.assertEqual(self.masks.shape, (8, 32))
+        env = CoupEnv()
+        for o in self.obs:
+            self.assertTrue(env.observation_space.contains(o))
+        self.assertTrue((self.obs[:, 0:2] >= 0).all())
+        self.assertTrue((self.obs[:, 2:8] == -1).all())
+        self.assertTrue((self.obs[:, 16] == 1).all())
+        self.assertTrue((self.obs[:, 17] == 2).all())
+        self.assertTrue((self.obs[:, 20] == 0).all())
+        self.assertListEqual(list(np.flatnonzero(self.masks[0])),
+                             [INCOME, FOREIGN_AID, TAX, EXCHANGE, STEAL])
+
+    def test_income(self):
+        actions = np.full(8, INCOME)
+        obs, r, d, masks, info = self.venv.step(actions)
+        # Next actor is P2, who sees P1's coins as the opp's
+        self.assertTrue((obs[:, 20] == 1).all())
+        self.assertTrue((obs[:, 17] == 2).all())
+        self.assertTrue((obs[:, 19] == INCOME).all())
+        self.assertTrue((r == 0).all())
+        self.assertFalse(d.any())
+        self.assertTrue((info['acting_player'] == 0).all())
+
+    def test_mixed_actions(self):
+        actions = np.array([INCOME, FOREIGN_AID, TAX, EXCHANGE, STEAL, INCOME, TAX, STEAL])
+        _, _, _, masks, _ = self.venv.step(actions)
+        self.assertListEqual(list(np.flatnonzero(masks[1])), [PASS_FA, BLOCK_FA])
+        self.assertListEqual(list(np.flatnonzero(masks[2])), [PASS_TAX, CHALLENGE_TAX])
+        self.assertListEqual(list(np.flatnonzero(masks[3])), [PASS_EXCHANGE, CHALLENGE_EXCHANGE])
+        self.assertListEqual(list(np.flatnonzero(masks[4])), [PASS_STEAL, BLOCK_STEAL, CHALLENGE_STEAL])
+
+    def test_invalid_action(self):
+        with self.assertRaises(RuntimeError):
+            self.venv.step(np.full(8, COUP))
+        # Out of range ids, which would wrap around to INCOME and the last action
+        for a in (-NUM_ACTIONS, -1, NUM_ACTIONS):
+            with self.assertRaises(RuntimeError):
+                self.venv.step(np.full(8, a))
+
+    def test_matches_game(self):
+        # Random legal play, checking the masks against Game.get_valid_actions
+        # and that finished games are reset
+        rng = np.random.default_rng(1)
+        num_done = 0
+        for _ in range(500):
+            for i in range(8):
+                if self.venv.game_over[i]:
+                    continue
+                game = game_from_vector_env(self.venv, i)
+                self.assertListEqual(sorted(game.get_valid_actions()),
+                                     list(np.flatnonzero(self.masks[i])))
+            obs, r, d, self.masks, info = self.venv.step(random_actions(rng, self.masks))
+            self.assertTrue((np.abs(r) <= 2).all())
+            self.assertTrue(self.masks.any(axis=1).all())
+            self.assertTrue((self.venv.deck_size + (self.venv.cards != NONE).sum(axis=(1, 2)) == 15).all())
+            num_done += d.sum()
+            if d.any():
+                final = info['final_obs'][d]
+                # One of the players has lost both cards
+                self.assertTrue(((final[:, 8:10] == 1).all(axis=1) | (final[:, 12:14] == 1).all(axis=1)).all())
+                self.assertTrue((obs[d, 16:18] == [1, 2]).all())
+        self.assertGreater(num_done, 0)
+
+    def test_deterministic_handlers_match_game(self):
+        # Actions that don't draw from the deck give the same obs as Game
+        rng = np.random.default_rng(2)
+        for _ in range(300):
+            actions = random_actions(rng, self.masks)
+            games = [game_from_vector_env(self.venv, i) for i in range(8)]
+            acting = self.venv.whose_action.copy()
+            self.venv.step(actions)
+            for i, game in enumerate(games):
+                a = actions[i]
+                if a in [PASS_EXCHANGE, CHALLENGE_FA_BLOCK, CHALLENGE_TAX, CHALLENGE_EXCHANGE,
+                         CHALLENGE_ASSASSINATE_BLOCK, CHALLENGE_STEAL, CHALLENGE_STEAL_BLOCK] or a >= EXCHANGE_RETURN_12:
+                    continue
+                getattr(game, CoupEnv.actions[a])()
+                if game.game_over:
+                    continue
+                env = CoupEnv()
+                env.game = game
+                self.assertTupleEqual(env.get_obs(acting[i] == 1),
+                                      tuple(self.venv.get_obs(acting)[i]))
+            self.masks = self.venv.get_action_mask()
+
+    def test_seed(self):
+        a = CoupVectorEnv(4, seed=3)
+        b = CoupVectorEnv(4, seed=3)
+        self.assertTrue((a.reset()[0] == b.reset()[0]).all())
+        a.step(np.full(4, EXCHANGE))
+        a.step(np.full(4, PASS_EXCHANGE))
+        self.assertTrue((a.reset(seed=7)[0] == b.reset(seed=7)[0]).all())
+        self.assertTrue((a.deck == b.deck).all())
@@ -1 +1,2 @@
-from gym_coup.utils.encode_obs import encode_obs
\ No newline at end of file
+from gym_coup.utils.encode_obs import encode_obs, encode_obs_batch
+from gym_coup.utils.seeding import spawn_seeds
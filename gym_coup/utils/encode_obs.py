@@ -25,4 +25,42 @@ def encode_obs(obs):
         arr += create_and_encode(32, obs[i])
     arr.append(obs[20])
 
-    return np.array(arr, dtype='int8')
\ No newline at end of file
+    return np.array(arr, dtype='int8')
+
+ENCODED_OBS_SIZE = 123
+
+# Columns of obs that are one-hot encoded, with the size and offset of each encoding
+_ONE_HOT_COLS = np.r_[0:16, 18:20]
+_ONE_HOT_SIZES = np.array([5] * 8 + [2] * 8 + [32] * 2)
+_ONE_HOT_OFFSETS = np.concatenate(([0], np.cumsum(_ONE_HOT_SIZES)[:-1]))
+_ONE_HOT_OFFSETS[16:] += 2 # Coin counts come before the last actions
+
+def encode_obs_batch(obs, out=None):
+    '''
+    One-hot encode a batch of CoupEnv observations,
+    same layout as encode_obs
+
+    obs: (N, 21) array of observations from CoupEnv.get_obs()
+    out: Optional (N, 123) array to write the encoding into,
+         ex: a slice of a replay buffer
+
+    Return out, or a new (N, 123) int8 np array
+    '''
+    obs = np.asarray(obs)
+    n = len(obs)
+    if out is None:
+        out = np.zeros((n, ENCODED_OBS_SIZE), dtype='int8')
+    else:
+        if out.shape != (n, ENCODED_OBS_SIZE):
+            raise ValueError(f'out must have shape {(n, ENCODED_OBS_SIZE)}, got {out.shape}')
+        out[...] = 0
+
+    one_hot = obs[:, _ONE_HOT_COLS]
+    if (one_hot >= _ONE_HOT_SIZES).any():
+        raise IndexError('Observation value out of range for one-hot encoding')
+
+    rows, cols = np.nonzero(one_hot != -1)
+    out[rows, _ONE_HOT_OFFSETS[cols] + one_hot[rows, cols]] = 1
+    out[:, 56:58] = obs[:, 16:18]
+    out[:, 122] = obs[:, 20]
+    return out
@@ -0,0 +1,15 @@
+import numpy as np
+
+def spawn_seeds(seed, n):
+    '''
+    Spawn n independent seeds from one seed,
+    ex: one per env or worker process
+
+    seed: int, None or np.random.SeedSequence
+    n:    Number of seeds
+
+    Return list of n ints, for CoupEnv.reset(seed=...) or CoupVectorEnv(seed=...)
+    '''
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    return [int.from_bytes(s.generate_state(4).tobytes(), 'little') for s in seed.spawn(n)]